@@ -0,0 +1,75 @@
+#benchmark file_utils.load_multi_json against the old line-by-line parser, on pretty-printed objects
+#of increasing size - the old version retries json.loads on the growing string after every line
+#(quadratic in object size), the new one decodes each object once (should scale linearly)
+
+#usage: python benchmarks/bench_load_multi_json.py [max_object_lines] [max_old_object_lines]
+#(the old version gets very slow quickly, so it's only run on the smaller objects)
+
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import file_utils
+
+#the original load_multi_json, for comparison
+def old_load_multi_json(filename):
+	d = []
+	curr = ""
+	with open(filename) as f:
+		for line in f:
+			curr += line
+			try:
+				jobj = json.loads(curr)
+				d.append(jobj)
+				curr = ""
+			except ValueError:
+				#not yet a complete JSON value
+				pass
+	return d
+#end old_load_multi_json
+
+#write a file with num_objects pretty-printed objects, each spanning about object_lines lines
+def write_test_file(filename, object_lines, num_objects=4):
+	obj = {"id_h": "abc", "extension": {"socialsim_information_id": ["douma"]}, "items": [{"n": i, "text": "white helmets"} for i in range(object_lines // 4)]}
+	with open(filename, "w") as f:
+		for i in range(num_objects):
+			f.write(json.dumps(obj, indent=4))
+			f.write("\n")
+#end write_test_file
+
+#time a loader on a file, best of a few runs
+def time_loader(loader, filename, repeat=3):
+	best = None
+	for i in range(repeat):
+		start = time.perf_counter()
+		loader(filename)
+		elapsed = time.perf_counter() - start
+		best = elapsed if best is None else min(best, elapsed)
+	return best
+#end time_loader
+
+
+if __name__ == "__main__":
+	max_lines = int(sys.argv[1]) if len(sys.argv) > 1 else 256000
+	max_old_lines = int(sys.argv[2]) if len(sys.argv) > 2 else 4000
+
+	print("%12s %12s %12s %12s %14s" % ("obj lines", "MB", "old (s)", "new (s)", "new MB/s"))
+	with tempfile.TemporaryDirectory() as tmp_dir:
+		filename = os.path.join(tmp_dir, "multi.json")
+		object_lines = 1000
+		while object_lines <= max_lines:
+			write_test_file(filename, object_lines)
+			size = os.path.getsize(filename) / (1024*1024)
+			new_time = time_loader(file_utils.load_multi_json, filename)
+			if object_lines <= max_old_lines:
+				assert old_load_multi_json(filename) == file_utils.load_multi_json(filename)
+				old_time = "%12.4f" % time_loader(old_load_multi_json, filename)
+			else:
+				old_time = "%12s" % "-"
+			print("%12d %12.2f %s %12.4f %14.1f" % (object_lines, size, old_time, new_time, size / new_time))
+			object_lines *= 2
+	#linear scaling: new time should roughly double (and MB/s stay flat) as object size doubles,
+	#while the old time roughly quadruples
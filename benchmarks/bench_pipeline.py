@@ -0,0 +1,172 @@
+#benchmark the loaders and narrative pipeline on synthetic data (see make_synthetic_data.py)
+#reports time, throughput (records/s, MB/s of input) and peak RSS for:
+#  file_utils.load_zipped_multi_json, file_utils.load_multi_json, load_data.narrative_analysis,
+#  load_data.search_narrative_keywords, load_data.save_narrative_freq
+#each benchmark runs in a fresh process, so peak memory is measured per benchmark
+#results can be saved to json and compared against a previous run (ie, from another commit)
+
+#usage: python benchmarks/bench_pipeline.py data_file.json.gz [--output results.json] [--compare old_results.json]
+
+import argparse
+import contextlib
+import gzip
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+from queue import Empty
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, REPO_DIR)
+
+#fields searched for keywords (same as the video search in load_data)
+SEARCH_FIELDS = [["snippet", "title_m"], ["snippet", "description_m"], ["snippet", "tags"]]
+
+#keyword -> component mapping from the synthetic data's label set (stand-in for search_term_mapping.csv)
+def synthetic_keywords(data):
+	comps = set()
+	for item in data:
+		for label in item['extension']['socialsim_information_id']:
+			comps.update(comp for comp in label.split('-') if comp != "")
+	return {comp.replace("_", " "): comp for comp in sorted(comps)}
+#end synthetic_keywords
+
+#run a single benchmark (in a child process): returns (seconds, records processed)
+#setup work (ie, loading data for the analysis benchmarks) isn't timed, but does count towards peak memory
+def run_benchmark(name, gz_file, json_file, out_dir):
+	import file_utils
+	import load_data
+
+	with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+		if name == "load_zipped_multi_json":
+			start = time.perf_counter()
+			data = file_utils.load_zipped_multi_json(gz_file)
+			return time.perf_counter() - start, len(data)
+
+		if name == "load_multi_json":
+			start = time.perf_counter()
+			data = file_utils.load_multi_json(json_file)
+			return time.perf_counter() - start, len(data)
+
+		data = file_utils.load_zipped_multi_json(gz_file)
+		if name == "narrative_analysis":
+			start = time.perf_counter()
+			load_data.narrative_analysis(data, "bench")
+			return time.perf_counter() - start, len(data)
+
+		if name == "search_narrative_keywords":
+			keywords = synthetic_keywords(data)
+			start = time.perf_counter()
+			load_data.search_narrative_keywords(data, SEARCH_FIELDS, keywords)
+			return time.perf_counter() - start, len(data)
+
+		if name == "save_narrative_freq":
+			res = load_data.narrative_analysis(data, "bench")
+			narr_res = {"bench": res}
+			start = time.perf_counter()
+			load_data.save_narrative_freq(narr_res, set(res['label_freq']), set(res['comp_freq']), os.path.join(out_dir, "bench_freq"))
+			return time.perf_counter() - start, len(data)
+
+	raise ValueError("unknown benchmark " + name)
+#end run_benchmark
+
+#child process entry point: run benchmark and send back results, including this process's peak RSS
+#sends ("ok", (seconds, records, peak rss)), or ("error", traceback text) if the benchmark raised
+def benchmark_worker(name, gz_file, json_file, out_dir, queue):
+	try:
+		seconds, records = run_benchmark(name, gz_file, json_file, out_dir)
+	except BaseException:
+		queue.put(("error", traceback.format_exc()))
+		raise
+	peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024		#linux reports KB
+	queue.put(("ok", (seconds, records, peak_rss)))
+#end benchmark_worker
+
+#run a benchmark in a fresh (spawned, so nothing inherited) process, return dictionary of results
+#raises RuntimeError if the benchmark fails, the worker dies without a result, or it takes more than
+#timeout seconds (None for no limit)
+def measure(name, gz_file, json_file, out_dir, timeout=None):
+	ctx = multiprocessing.get_context("spawn")
+	queue = ctx.Queue()
+	proc = ctx.Process(target=benchmark_worker, args=(name, gz_file, json_file, out_dir, queue))
+	proc.start()
+	start = time.perf_counter()
+	try:
+		while True:
+			try:
+				status, res = queue.get(timeout=1)
+				break
+			except Empty:
+				if not proc.is_alive():
+					proc.join()
+					raise RuntimeError("benchmark %s: worker exited with code %s without a result" % (name, proc.exitcode))
+				if timeout is not None and time.perf_counter() - start > timeout:
+					raise RuntimeError("benchmark %s: timed out after %ds" % (name, timeout))
+	finally:
+		proc.join(5)		#give a finished worker a moment to exit
+		if proc.is_alive():
+			proc.terminate()		#timed out, or stuck after sending its result
+			proc.join()
+	if status == "error":
+		raise RuntimeError("benchmark %s failed in the worker process:\n%s" % (name, res))
+	seconds, records, peak_rss = res
+
+	input_file = json_file if name == "load_multi_json" else gz_file
+	size_mb = os.path.getsize(input_file) / (1024*1024)
+	return {"seconds": seconds, "records": records, "records_per_s": records / seconds if seconds > 0 else None,
+		"mb_per_s": size_mb / seconds if seconds > 0 else None, "input_mb": size_mb, "peak_rss_mb": peak_rss / (1024*1024)}
+#end measure
+
+#current git commit of the repo (for labelling results), or None
+def git_commit():
+	try:
+		return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, stderr=subprocess.DEVNULL).decode().strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+#end git_commit
+
+
+BENCHMARKS = ["load_zipped_multi_json", "load_multi_json", "narrative_analysis", "search_narrative_keywords", "save_narrative_freq"]
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Benchmark loaders and narrative pipeline")
+	parser.add_argument("data_file", help="synthetic .json.gz data file")
+	parser.add_argument("--benchmarks", default=",".join(BENCHMARKS), help="comma-separated benchmarks to run")
+	parser.add_argument("--output", help="save results to this json file")
+	parser.add_argument("--compare", help="previous results json file to compare against")
+	parser.add_argument("--timeout", type=float, default=3600, help="seconds to wait for each benchmark before giving up (default: %(default)s)")
+	args = parser.parse_args()
+
+	results = {"commit": git_commit(), "data_file": os.path.abspath(args.data_file), "benchmarks": {}}
+	with tempfile.TemporaryDirectory() as tmp_dir:
+		#load_multi_json reads plain text, so unpack a copy
+		json_file = os.path.join(tmp_dir, "data.json")
+		with gzip.open(args.data_file, 'rb') as f_in, open(json_file, 'wb') as f_out:
+			shutil.copyfileobj(f_in, f_out)
+
+		for name in args.benchmarks.split(","):
+			results['benchmarks'][name] = measure(name, args.data_file, json_file, tmp_dir, args.timeout)
+
+	old = None
+	if args.compare:
+		with open(args.compare) as f:
+			old = json.load(f)
+		print("comparing against commit", old.get('commit'))
+
+	print("%-28s %10s %12s %10s %10s %s" % ("benchmark", "seconds", "records/s", "MB/s", "peak MB", "(vs old)" if old else ""))
+	for name, res in results['benchmarks'].items():
+		line = "%-28s %10.3f %12.0f %10.1f %10.1f" % (name, res['seconds'], res['records_per_s'] or 0, res['mb_per_s'] or 0, res['peak_rss_mb'])
+		if old and name in old['benchmarks']:
+			line += "   time x%.2f, peak x%.2f" % (res['seconds'] / old['benchmarks'][name]['seconds'], res['peak_rss_mb'] / old['benchmarks'][name]['peak_rss_mb'])
+		print(line)
+
+	if args.output:
+		with open(args.output, 'w') as f:
+			json.dump(results, f, indent=4)
+		print("Results saved to", args.output)
@@ -0,0 +1,56 @@
+#measure command line startup time: how long before load_data.py can do any work
+#(python start + imports + argument parsing, measured with --help so no data is read)
+#also reports the import time of each pipeline module on its own
+#heavy packages (pandas, pyarrow, numpy, scipy) should only be imported by the commands that need them,
+#so exits with status 1 if startup is over the target (ie, for a pre-commit check)
+
+#usage: python benchmarks/bench_startup.py [--target 0.15] [--repeat 10]
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+#modules that must not be imported at startup
+HEAVY_MODULES = ["pandas", "pyarrow", "numpy", "scipy"]
+
+#run a python command repeat times in a fresh process, return the best (min) wall time in seconds
+def time_command(args, repeat):
+	best = None
+	for i in range(repeat):
+		start = time.perf_counter()
+		subprocess.run([sys.executable] + args, cwd=REPO_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+		elapsed = time.perf_counter() - start
+		best = elapsed if best is None else min(best, elapsed)
+	return best
+#end time_command
+
+#which heavy modules get imported along with the given module
+def heavy_imports(module):
+	code = "import sys, %s; print(' '.join(m for m in %r if m in sys.modules))" % (module, HEAVY_MODULES)
+	return subprocess.check_output([sys.executable, "-c", code], cwd=REPO_DIR).decode().split()
+#end heavy_imports
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Measure load_data.py startup time")
+	parser.add_argument("--target", type=float, default=0.15, help="max allowed startup time in seconds (default: %(default)s)")
+	parser.add_argument("--repeat", type=int, default=10, help="runs per measurement, best time is reported")
+	args = parser.parse_args()
+
+	baseline = time_command(["-c", "pass"], args.repeat)
+	print("%-28s %8.3fs" % ("python (empty)", baseline))
+	for module in ["file_utils", "keyword_utils", "narrative_utils", "instrument_utils", "load_data"]:
+		seconds = time_command(["-c", "import " + module], args.repeat)
+		heavy = heavy_imports(module)
+		print("%-28s %8.3fs   %s" % ("import " + module, seconds, ("also imports " + ", ".join(heavy)) if heavy else ""))
+
+	startup = time_command(["load_data.py", "--help"], args.repeat)
+	print("%-28s %8.3fs   (target %.3fs)" % ("load_data.py --help", startup, args.target))
+
+	if startup > args.target:
+		print("Startup over target")
+		sys.exit(1)
@@ -0,0 +1,107 @@
+#generate synthetic White Helmets-style data files (.json.gz, one object per line) for benchmarking,
+#since the real /data/socsim dumps can't be shared
+#objects have the same fields the pipeline uses: id_h, extension.socialsim_information_id (labels drawn
+#from the real label set in results/*_narrative_labels.csv), snippet.title_m/description_m/tags, plus
+#text, user and created_at for tweets - everything else in the real objects is left out
+
+#usage: python benchmarks/make_synthetic_data.py out_dir [--records N] [--types videos,comments,tweets] [--seed S]
+
+import argparse
+import base64
+import csv
+import glob
+import gzip
+import json
+import os
+import random
+import time
+
+#filler words for generated text (narrative components are mixed in, so keyword searches find something)
+FILLER_WORDS = ["the", "video", "syria", "news", "report", "watch", "people", "government", "war", "today",
+	"children", "rescue", "aleppo", "truth", "media", "civil", "defence", "attack", "footage", "breaking"]
+
+#load the set of real narrative labels from the frequency csvs in results_dir
+def load_label_set(results_dir):
+	labels = set()
+	for filename in glob.glob(os.path.join(results_dir, "*_narrative_labels.csv")):
+		with open(filename, 'r') as f:
+			reader = csv.reader(f)
+			next(reader)		#skip header
+			for row in reader:
+				if row and row[0] != "":
+					labels.add(row[0])
+	return sorted(labels)
+#end load_label_set
+
+#random anonymized id, same shape as the id_h values in the data (22 url-safe base64 chars)
+def random_id(rng):
+	return base64.urlsafe_b64encode(rng.getrandbits(128).to_bytes(16, 'little')).decode('ascii')[:22]
+#end random_id
+
+#random text of about num_words words, with some narrative components mixed in
+def random_text(rng, num_words, comps):
+	return " ".join(rng.choice(comps).replace("_", " ") if rng.random() < 0.1 else rng.choice(FILLER_WORDS) for i in range(num_words))
+#end random_text
+
+#build a single synthetic object of the given datatype
+#unlabeled_frac of objects get no narrative label (['']), the rest get 1-3 labels
+def make_record(rng, datatype, labels, comps, unlabeled_frac=0.3):
+	if rng.random() < unlabeled_frac:
+		narratives = [""]
+	else:
+		narratives = rng.sample(labels, min(len(labels), rng.choice([1, 1, 1, 2, 3])))
+	record = {"id_h": random_id(rng), "extension": {"socialsim_information_id": narratives}}
+
+	if datatype == "tweets":
+		record["text"] = random_text(rng, rng.randint(5, 40), comps)
+		record["user"] = {"id_str_h": "u%d" % rng.randint(0, 50000)}
+		record["created_at"] = time.strftime("%a %b %d %H:%M:%S +0000 %Y", time.gmtime(1514764800 + rng.randint(0, 2*365*86400)))
+	else:
+		record["snippet"] = {
+			"title_m": random_text(rng, rng.randint(3, 15), comps),
+			"description_m": random_text(rng, rng.randint(0, 120), comps),
+			"tags": [rng.choice(FILLER_WORDS + comps) for i in range(rng.randint(0, 10))],
+			"publishedAt": time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(1514764800 + rng.randint(0, 2*365*86400))),
+			"channelId_h": "c%d" % rng.randint(0, 5000),
+		}
+	return record
+#end make_record
+
+#write a synthetic .json.gz file with num_records objects of the given datatype
+#duplicate_frac of the objects are repeats of an earlier object (same id_h), to exercise dedup
+def write_synthetic_file(filename, num_records, datatype, labels, seed=0, duplicate_frac=0.01):
+	rng = random.Random(seed)
+	comps = sorted(set(comp for label in labels for comp in label.split('-')))
+	recent = []		#pool of recent objects to duplicate from
+	with gzip.open(filename, 'wt', encoding='utf-8', compresslevel=6) as f:
+		for i in range(num_records):
+			if recent and rng.random() < duplicate_frac:
+				record = rng.choice(recent)
+			else:
+				record = make_record(rng, datatype, labels, comps)
+				if len(recent) < 1000:
+					recent.append(record)
+				else:
+					recent[rng.randrange(1000)] = record
+			f.write(json.dumps(record))
+			f.write("\n")
+#end write_synthetic_file
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Generate synthetic White Helmets-style data for benchmarks")
+	parser.add_argument("out_dir", help="directory to write the .json.gz files to")
+	parser.add_argument("--records", type=int, default=10000, help="objects per file (ie 10000 to 50000000)")
+	parser.add_argument("--types", default="videos,comments,tweets", help="comma-separated datatypes to generate")
+	parser.add_argument("--seed", type=int, default=0, help="random seed")
+	parser.add_argument("--results-dir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "results"), help="where to find *_narrative_labels.csv")
+	args = parser.parse_args()
+
+	labels = load_label_set(args.results_dir)
+	print(len(labels), "narrative labels")
+	os.makedirs(args.out_dir, exist_ok=True)
+	for i, datatype in enumerate(args.types.split(",")):
+		filename = os.path.join(args.out_dir, "synthetic_%s_%d.json.gz" % (datatype, args.records))
+		start = time.perf_counter()
+		write_synthetic_file(filename, args.records, datatype, labels, seed=args.seed + i)
+		print("Wrote %d %s to %s (%.1f MB, %.1fs)" % (args.records, datatype, filename, os.path.getsize(filename) / (1024*1024), time.perf_counter() - start))
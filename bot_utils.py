@@ -0,0 +1,157 @@
+#utility methods for joining Botometer bot scores onto tweets
+#scores from the botometer result files are stored as two compact arrays (sorted 64-bit user id hashes,
+#and a float32 score for each), so attaching scores to tweets is a vectorized binary search over a whole
+#batch of user ids instead of a dict lookup per tweet
+#tweets can then be split into bot-likelihood bands, for narrative frequencies per band
+
+import array
+from collections import defaultdict
+
+import numpy as np
+
+import file_utils
+
+#default fields: user id in the botometer results and in the tweets
+BOT_USER_FIELD = ["user", "id_str_h"]
+TWEET_USER_FIELD = ["user", "id_str_h"]
+
+#default bot score bands (score edges, last band includes 1.0)
+BAND_EDGES = [0.0, 0.2, 0.4, 0.6, 0.8, 1.0]
+
+#how to combine scores for a user found in more than one botometer file
+RESOLVE_MODES = ["first", "max", "mean"]
+
+#user ids hashed at a time by user_hashes (its fixed-width array is this many ids x the longest id)
+HASH_CHUNK = 100000
+
+#64-bit FNV-1a constants, for user_hashes
+FNV_OFFSET = np.uint64(14695981039346656037)
+FNV_PRIME = np.uint64(1099511628211)
+
+#64-bit hashes of a list (or array) of user ids, as a uint64 array, without a python call per id: each chunk
+#of HASH_CHUNK ids is converted to a fixed-width unicode array and hashed (FNV-1a over the code points) a
+#character position at a time - the padding of shorter ids is skipped, so an id hashes the same whatever
+#chunk it's in
+#users are only matched by hash, the ids aren't kept: with n users, the chance of any two of them sharing a
+#hash (and so a resolved score) is about n^2/2^65 - under one in a million for 5 million users - and the
+#chance of a tweet's user with no score matching someone else's is about n/2^64 per tweet
+def user_hashes(user_ids):
+	hashes = np.empty(len(user_ids), dtype=np.uint64)
+	for low in range(0, len(user_ids), HASH_CHUNK):
+		ids = np.array(user_ids[low:low+HASH_CHUNK], dtype=np.str_)
+		codes = ids.view(np.uint32).reshape(len(ids), ids.itemsize // 4)
+		chunk_hashes = np.full(len(ids), FNV_OFFSET, dtype=np.uint64)
+		for column in codes.T:
+			chunk_hashes = np.where(column != 0, (chunk_hashes ^ column) * FNV_PRIME, chunk_hashes)
+		hashes[low:low+len(ids)] = chunk_hashes
+	return hashes
+#end user_hashes
+
+#given a list of (botometer results filename, score field) - ie the english score from the en results
+#and the universal (language independent) score from the ar results - build the user -> score arrays
+#users in more than one file are resolved with resolve: "first" (score from the first file listed),
+#"max" or "mean" of their scores
+#returns dictionary of keys (sorted uint64 user id hashes, see user_hashes) and scores (float32), plus stats
+#user ids are hashed a chunk at a time as they're read, so only their hashes are kept
+def load_bot_scores(score_files, user_field=BOT_USER_FIELD, resolve="max"):
+	if resolve not in RESOLVE_MODES:
+		raise ValueError("unknown resolve mode %s (expected one of %s)" % (resolve, RESOLVE_MODES))
+
+	key_chunks = []
+	user_ids = []		#ids not hashed yet
+	scores = array.array('d')
+	stats = {"files": {}}
+	for filename, score_field in score_files:
+		count = missing = 0
+		for item in file_utils.stream_zipped_multi_json(filename, [user_field, score_field]):
+			user_id = file_utils.get_field(item, user_field)
+			score = file_utils.get_field(item, score_field)
+			if user_id is None or not isinstance(score, (int, float)):
+				missing += 1
+				continue
+			user_ids.append(user_id)
+			scores.append(score)
+			count += 1
+			if len(user_ids) == HASH_CHUNK:
+				key_chunks.append(user_hashes(user_ids))
+				user_ids = []
+		stats['files'][filename] = {"scores": count, "missing": missing}
+	key_chunks.append(user_hashes(user_ids))
+
+	#sort by user (stable, so file order is kept within each user) and resolve repeats
+	keys = np.concatenate(key_chunks)
+	scores = np.frombuffer(scores, dtype=np.float64)
+	order = np.argsort(keys, kind='stable')
+	keys = keys[order]
+	scores = scores[order]
+	unique_keys, starts, counts = np.unique(keys, return_index=True, return_counts=True)
+	if resolve == "first":
+		resolved = scores[starts]
+	elif resolve == "max":
+		resolved = np.maximum.reduceat(scores, starts) if len(starts) else scores
+	else:
+		resolved = np.add.reduceat(scores, starts) / counts if len(starts) else scores
+	stats['users'] = len(unique_keys)
+	stats['overlapping_users'] = int(np.sum(counts > 1))
+	return {"keys": unique_keys, "scores": resolved.astype(np.float32), "stats": stats}
+#end load_bot_scores
+
+#given bot scores (from load_bot_scores) and a list of user ids, return array of their scores
+#(nan for users with no score) - the whole batch is hashed at once, then found with one binary search
+def lookup_scores(bot_scores, user_ids):
+	keys = bot_scores['keys']
+	if len(keys) == 0:
+		return np.full(len(user_ids), np.nan, dtype=np.float32)
+	user_ids = np.array(user_ids, dtype=object)
+	known = np.not_equal(user_ids, None)		#users missing from a tweet never match
+	hashes = user_hashes(user_ids)
+	pos = np.minimum(np.searchsorted(keys, hashes), len(keys)-1)
+	found = (keys[pos] == hashes) & known
+	return np.where(found, bot_scores['scores'][pos], np.nan).astype(np.float32)
+#end lookup_scores
+
+#names of the bands for the given edges (ie "bot_0.2-0.4"), plus the band for tweets with no score
+def band_names(edges=BAND_EDGES):
+	return ["bot_%g-%g" % (edges[i], edges[i+1]) for i in range(len(edges)-1)] + ["bot_unknown"]
+#end band_names
+
+#given array of scores, return array of band indexes (into band_names) - nan scores get the unknown band
+def score_bands(scores, edges=BAND_EDGES):
+	bands = np.clip(np.searchsorted(edges, scores, side='right') - 1, 0, len(edges)-2)
+	bands[np.isnan(scores)] = len(edges) - 1
+	return bands
+#end score_bands
+
+#narrative frequencies of tweets split by the bot score band of their user
+#tweets are read in batches of batch_size, and scores looked up for the whole batch at once
+#returns dictionary of band name -> {unlabeled_count, label_freq, comp_freq} (same as narrative_analysis,
+#so the result can be saved with save_narrative_freq), and band name -> number of tweets
+def bot_narrative_analysis(tweets, bot_scores, user_field=TWEET_USER_FIELD, edges=BAND_EDGES, batch_size=100000):
+	names = band_names(edges)
+	label_counts = [defaultdict(int) for name in names]
+	unlabeled = [0] * len(names)
+	tweet_counts = [0] * len(names)
+
+	for batch in file_utils.batched(tweets, batch_size):
+		bands = score_bands(lookup_scores(bot_scores, [file_utils.get_field(tweet, user_field) for tweet in batch]), edges)
+		for tweet, band in zip(batch, bands.tolist()):
+			tweet_counts[band] += 1
+			labels = file_utils.get_field(tweet, ["extension", "socialsim_information_id"]) or [""]
+			if labels[0] == "":
+				unlabeled[band] += 1
+			counts = label_counts[band]
+			for label in labels:
+				counts[label] += 1
+
+	#break label counts down into components, same as narrative_analysis
+	res = {}
+	for i, name in enumerate(names):
+		comp_counts = defaultdict(int)
+		for label, count in label_counts[i].items():
+			for comp in label.split('-'):
+				comp_counts[comp] += count
+		label_counts[i].pop('', None)
+		comp_counts.pop('', None)
+		res[name] = {"unlabeled_count": unlabeled[i], "label_freq": label_counts[i], "comp_freq": comp_counts}
+	return res, dict(zip(names, tweet_counts))
+#end bot_narrative_analysis
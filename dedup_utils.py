@@ -0,0 +1,189 @@
+#utility methods for removing duplicate records (same id_h) from the raw data
+#two modes:
+#  memory: single streaming pass, keeps a set of every id seen
+#  disk:   bounded memory, for files with too many ids to hold at once - first pass hashes ids into
+#          on-disk partition files and finds the duplicated ids one partition at a time, second pass
+#          streams the records again and drops the repeats (only duplicated ids are kept in memory)
+#both keep the first copy of each id, and can optionally check whether duplicate copies are identical
+#records with a missing or empty id (ie retweet chains, bot scores) can't be matched, so they're all passed
+#through untouched and only counted (no_id)
+#stats for each run are collected in a report dictionary (see new_dedup_report)
+
+import hashlib
+import json
+import os
+import tempfile
+
+#max number of conflicting ids (duplicates whose copies differ) listed in a report
+MAX_REPORT_IDS = 1000
+
+#create a new report dictionary for a dedup run
+def new_dedup_report(mode, check_content):
+	return {"mode": mode, "check_content": check_content, "records": 0, "no_id": 0, "unique_ids": 0, "duplicate_records": 0, "duplicated_ids": 0, "conflicting_ids": 0, "conflicting_id_list": []}
+#end new_dedup_report
+
+#True if a record id is missing or empty (record passed through by dedup)
+def missing_id(record_id):
+	return record_id is None or record_id == ""
+#end missing_id
+
+#hash of a record's content (key order doesn't matter)
+def content_hash(record):
+	return hashlib.blake2b(json.dumps(record, sort_keys=True).encode('utf-8'), digest_size=16).hexdigest()
+#end content_hash
+
+#given an iterable of records, yield them with repeated ids removed (first copy kept), keeping all ids in memory
+#if check_content is True, also compare each duplicate against the first copy's content hash
+#report (from new_dedup_report) is updated as records are consumed
+def dedup_records(records, id_field="id_h", check_content=False, report=None):
+	if report is None:
+		report = new_dedup_report("memory", check_content)
+	seen = {}			#id -> content hash of first copy (or None if not checking content)
+	duplicated = set()
+	conflicting = set()
+	for record in records:
+		report['records'] += 1
+		record_id = record.get(id_field)
+		if missing_id(record_id):
+			report['no_id'] += 1
+			yield record
+			continue
+		record_hash = content_hash(record) if check_content else None
+		if record_id in seen:
+			report['duplicate_records'] += 1
+			if record_id not in duplicated:
+				duplicated.add(record_id)
+				report['duplicated_ids'] += 1
+			if check_content and record_hash != seen[record_id] and record_id not in conflicting:
+				conflicting.add(record_id)
+				add_conflict(report, record_id)
+			continue
+		seen[record_id] = record_hash
+		report['unique_ids'] += 1
+		yield record
+#end dedup_records
+
+#bounded-memory version of dedup_records, for a single data source that can be read twice
+#get_records is a function that returns a fresh iterable of the records each time it's called
+#(ie, lambda: file_utils.stream_zipped_multi_json(filename))
+#ids are hashed into num_partitions temporary files in tmp_dir, so peak memory is about one
+#partition's worth of ids, plus the set of ids that actually have duplicates
+def dedup_records_on_disk(get_records, id_field="id_h", check_content=False, report=None, num_partitions=256, tmp_dir=None):
+	if report is None:
+		report = new_dedup_report("disk", check_content)
+
+	with tempfile.TemporaryDirectory(dir=tmp_dir) as part_dir:
+		#first pass: write (id, content hash) of every record to a partition based on id hash
+		part_files = [open(os.path.join(part_dir, "part%d" % i), 'w', encoding='utf-8') for i in range(num_partitions)]
+		try:
+			for record in get_records():
+				record_id = record.get(id_field)
+				if missing_id(record_id):
+					report['records'] += 1
+					report['no_id'] += 1
+					continue
+				record_hash = content_hash(record) if check_content else ""
+				part = int.from_bytes(hashlib.blake2b(json.dumps(record_id).encode('utf-8'), digest_size=4).digest(), 'little') % num_partitions
+				part_files[part].write("%s\t%s\n" % (json.dumps(record_id), record_hash))
+		finally:
+			for f in part_files:
+				f.close()
+
+		#find duplicated ids (and conflicting copies) one partition at a time
+		duplicated = set()
+		for i in range(num_partitions):
+			first_hash = {}		#id -> content hash of first copy, for this partition only
+			conflicting = set()
+			with open(os.path.join(part_dir, "part%d" % i), encoding='utf-8') as f:
+				for line in f:
+					record_id, record_hash = line.rstrip("\n").split("\t")
+					record_id = json.loads(record_id)
+					report['records'] += 1
+					if record_id not in first_hash:
+						first_hash[record_id] = record_hash
+						report['unique_ids'] += 1
+						continue
+					report['duplicate_records'] += 1
+					if record_id not in duplicated:
+						duplicated.add(record_id)
+						report['duplicated_ids'] += 1
+					if check_content and record_hash != first_hash[record_id] and record_id not in conflicting:
+						conflicting.add(record_id)
+						add_conflict(report, record_id)
+			os.remove(os.path.join(part_dir, "part%d" % i))
+
+	#second pass: stream records, dropping repeat copies of the duplicated ids
+	yielded = set()
+	for record in get_records():
+		record_id = record.get(id_field)
+		if record_id in duplicated:
+			if record_id in yielded:
+				continue
+			yielded.add(record_id)
+		yield record
+#end dedup_records_on_disk
+
+#given a pyarrow table, return table with rows of repeated ids removed (first row of each id kept, and
+#all rows with a null or empty id) - content check not available here, only the cached columns are in the table
+def dedup_table(table, id_col="id_h", report=None):
+	import pyarrow as pa
+	import pyarrow.compute as pc
+
+	if report is None:
+		report = new_dedup_report("table", False)
+	ids = table[id_col]
+	has_id = pc.is_valid(ids)
+	if pa.types.is_string(ids.type) or pa.types.is_large_string(ids.type):
+		has_id = pc.and_(has_id, pc.fill_null(pc.not_equal(ids, ""), False))
+	row_nums = pa.array(range(table.num_rows), type=pa.int64())
+	with_id = pa.table({id_col: ids, "row": row_nums}).filter(has_id)
+	first_rows = with_id.group_by(id_col).aggregate([("row", "min")])["row_min"]
+	no_id_rows = row_nums.filter(pc.invert(has_id))
+	keep_rows = pa.chunked_array(first_rows.chunks + [no_id_rows], type=pa.int64())
+	deduped = table.take(pc.take(keep_rows, pc.sort_indices(keep_rows)))
+
+	#count ids that appear more than once
+	counts = with_id.group_by(id_col).aggregate([([], "count_all")])["count_all"]
+	report['records'] += table.num_rows
+	report['no_id'] += len(no_id_rows)
+	report['unique_ids'] += len(first_rows)
+	report['duplicate_records'] += with_id.num_rows - len(first_rows)
+	report['duplicated_ids'] += pc.sum(pc.greater(counts, 1)).as_py() or 0
+	return deduped
+#end dedup_table
+
+#given a record store (see store_utils), return store with records of repeated ids removed (first record
+#of each id kept, and all records with an empty id) - content check not available here either, only the
+#stored fields are kept
+def dedup_store(store, report=None):
+	import store_utils
+
+	if report is None:
+		report = new_dedup_report("store", False)
+	first_records = {}
+	id_counts = {}
+	keep_records = []
+	for record_num, record_id in enumerate(store_utils.iter_batched(store, store_utils.store_ids)):
+		if missing_id(record_id):
+			keep_records.append(record_num)
+			continue
+		if record_id not in first_records:
+			first_records[record_id] = record_num
+			keep_records.append(record_num)
+		id_counts[record_id] = id_counts.get(record_id, 0) + 1
+	deduped = store_utils.take_records(store, keep_records) if len(keep_records) < store['num_records'] else store
+
+	report['records'] += store['num_records']
+	report['no_id'] += len(keep_records) - len(first_records)
+	report['unique_ids'] += len(first_records)
+	report['duplicate_records'] += store['num_records'] - len(keep_records)
+	report['duplicated_ids'] += sum(1 for count in id_counts.values() if count > 1)
+	return deduped
+#end dedup_store
+
+#record a conflicting id in a report (list is capped, count isn't)
+def add_conflict(report, record_id):
+	report['conflicting_ids'] += 1
+	if len(report['conflicting_id_list']) < MAX_REPORT_IDS:
+		report['conflicting_id_list'].append(record_id)
+#end add_conflict
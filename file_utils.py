@@ -1,21 +1,41 @@
 #utility methods for loading/reading data files and saving pickles
+#(pandas and pyarrow are only imported by the functions that use them, to keep imports of this module fast)
 
 import json
 import gzip
+import zlib
+import queue
+import threading
+import contextlib
+import fnmatch
+import shutil
 import tarfile
 import pickle
 import csv
 import os
-import tarfile
-import itertools
 import sys
 from itertools import zip_longest
-import pandas as pd
 import glob
+import hashlib
+import re
+import time
 import itertools
 
 DISPLAY = False
 
+#whitespace allowed between json values
+JSON_WHITESPACE = re.compile(r'\s*')
+
+#separator for data files read straight out of a tar archive, ie "Tng_an_WH_Youtube.tar::Tng_an_Videos.json.gz"
+#(accepted anywhere a .json.gz filename is, except for the chunked/indexed reads, which need a real file)
+TAR_MEMBER_SEP = "::"
+
+#pipelined reads: if PREFETCH_DEPTH > 0, the .json.gz stream/load functions read and decompress the file in
+#a background thread, up to PREFETCH_DEPTH blocks ahead of the parsing (see stream_zipped_multi_json_pipelined)
+#each block is PREFETCH_BLOCK_SIZE compressed bytes (several times that once decompressed)
+PREFETCH_DEPTH = 0
+PREFETCH_BLOCK_SIZE = 1024*1024
+
 #given a filepath to a zipped json file, load the data
 def load_zipped_json(filename):
 	if DISPLAY:
@@ -26,15 +46,384 @@ def load_zipped_json(filename):
 #end load_zipped_json
 
 #given a .json.gz that contains multiple json objects, read data
-def load_zipped_multi_json(filename):
+#if a list of fields is given, only those fields are kept (see json_line_parser)
+def load_zipped_multi_json(filename, fields=None):
+	return list(stream_zipped_multi_json(filename, fields))
+#end load_zipped_multi_json
+
+#given a .json.gz that contains multiple json objects, yield them one at a time
+#(same objects as load_zipped_multi_json, but never holds the whole file in memory)
+#if a stats dictionary is given, it's filled with time spent reading/decompressing vs parsing,
+#number of records, and compressed/decompressed bytes (slightly slower, so off by default)
+def stream_zipped_multi_json(filename, fields=None, stats=None):
 	if DISPLAY:
 		print ("Loading", filename)
-	with gzip.GzipFile(filename, 'r',) as f:
-		d = []
+	parse_line = json_line_parser(fields)
+	if PREFETCH_DEPTH > 0:
+		yield from stream_zipped_multi_json_pipelined(filename, parse_line, stats, PREFETCH_DEPTH, PREFETCH_BLOCK_SIZE)
+		return
+	if stats is not None:
+		yield from stream_zipped_multi_json_timed(filename, parse_line, stats)
+		return
+	with open_zipped(filename) as f:
 		for line in f:
-			d.append(json.loads(line.decode('utf-8')))
-	return d
-#end load_zipped_multi_json
+			yield parse_line(line)
+#end stream_zipped_multi_json
+
+#stream_zipped_multi_json, with timing of each read and parse (see stream_zipped_multi_json for stats)
+def stream_zipped_multi_json_timed(filename, parse_line, stats):
+	stats.update({"file": filename, "compressed_bytes": zipped_size(filename), "bytes": 0, "records": 0, "decompress_s": 0.0, "parse_s": 0.0})
+	clock = time.perf_counter
+	decompress_s = parse_s = 0.0
+	records = num_bytes = 0
+	try:
+		with open_zipped(filename) as f:
+			lines = iter(f)
+			while True:
+				start = clock()
+				line = next(lines, None)
+				read_done = clock()
+				if line is None:
+					break
+				obj = parse_line(line)
+				decompress_s += read_done - start
+				parse_s += clock() - read_done
+				records += 1
+				num_bytes += len(line)
+				yield obj
+	finally:
+		#update stats even if the caller stops early
+		stats.update({"bytes": num_bytes, "records": records, "decompress_s": decompress_s, "parse_s": parse_s})
+#end stream_zipped_multi_json_timed
+
+#pipelined version of stream_zipped_multi_json: a background thread reads and decompresses blocks of the
+#file into a queue (at most queue_depth blocks ahead), while this thread splits lines and parses them
+#so the disk (and zlib, which releases the GIL) are busy at the same time as the json parsing
+#parse_line is a line parser from json_line_parser, given every line the same as stream_zipped_multi_json
+#(blank lines included), and truncated/padded files are handled the same as gzip (see inflate_blocks)
+#if a stats dictionary is given, decompress_s is the time spent waiting on the reader thread (0 if the
+#reads keep up with the parsing), plus the same counts as stream_zipped_multi_json_timed (parse time
+#isn't split out, since the parsing is interleaved with whatever consumes the objects)
+def stream_zipped_multi_json_pipelined(filename, parse_line, stats=None, queue_depth=4, block_size=1024*1024):
+	clock = time.perf_counter
+	wait_s = 0.0
+	records = num_bytes = 0
+	if stats is not None:
+		stats.update({"file": filename, "compressed_bytes": zipped_size(filename), "bytes": 0, "records": 0, "decompress_s": 0.0, "parse_s": None, "queue_depth": queue_depth})
+	pending = b""		#partial line at the end of the previous block
+	try:
+		with open_zipped_raw(filename) as raw:
+			blocks = prefetch(inflate_blocks(raw, block_size), queue_depth)
+			try:
+				while True:
+					start = clock()
+					block = next(blocks, None)
+					wait_s += clock() - start
+					if block is None:
+						break
+					num_bytes += len(block)
+					lines = (pending + block).split(b"\n")
+					pending = lines.pop()
+					for line in lines:
+						records += 1
+						yield parse_line(line)
+			finally:
+				blocks.close()		#stop the reader thread before the file is closed
+			if pending:
+				records += 1
+				yield parse_line(pending)
+	finally:
+		if stats is not None:
+			stats.update({"bytes": num_bytes, "records": records, "decompress_s": wait_s})
+#end stream_zipped_multi_json_pipelined
+
+#given a file object of gzip-compressed data, yield the decompressed data in blocks
+#(one block per block_size compressed bytes read, handles files with multiple gzip members)
+#same as gzip: zero padding after a member is skipped, and EOFError is raised if the data ends in the
+#middle of a member
+def inflate_blocks(raw, block_size=1024*1024):
+	decompressor = None		#None between members (only padding or another member can follow)
+	while True:
+		data = raw.read(block_size)
+		if not data:
+			break
+		while data:
+			if decompressor is None:
+				data = data.lstrip(b"\x00")
+				if not data:
+					break
+				decompressor = zlib.decompressobj(31)		#31: gzip header
+			block = decompressor.decompress(data)
+			if block:
+				yield block
+			data = b""
+			if decompressor.eof:
+				#padding or start of next gzip member (if any)
+				data = decompressor.unused_data
+				decompressor = None
+	if decompressor is not None:
+		raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+#end inflate_blocks
+
+#run a generator in a background thread, up to queue_depth items ahead of the consumer
+#yields the same items - exceptions in the generator are raised here, and stopping early stops the thread
+def prefetch(items, queue_depth=4):
+	q = queue.Queue(maxsize=queue_depth)
+	done = object()		#end of items marker
+	stop = threading.Event()
+
+	def put(item):
+		#wait for space, unless the consumer has stopped
+		while not stop.is_set():
+			try:
+				q.put(item, timeout=0.1)
+				return True
+			except queue.Full:
+				pass
+		return False
+
+	def producer():
+		try:
+			for item in items:
+				if not put((item, None)):
+					return
+			put((done, None))
+		except BaseException as e:
+			put((None, e))
+
+	thread = threading.Thread(target=producer, daemon=True)
+	thread.start()
+	try:
+		while True:
+			item, error = q.get()
+			if error is not None:
+				raise error
+			if item is done:
+				break
+			yield item
+	finally:
+		stop.set()
+		thread.join()
+#end prefetch
+
+#open a .json.gz file (or a .json.gz member of a tar, "archive.tar::member") for reading decompressed lines
+#tar members are decompressed on the fly, nothing is unpacked to disk
+#use as a context manager, ie:	with open_zipped(filename) as f:
+@contextlib.contextmanager
+def open_zipped(filename):
+	with open_zipped_raw(filename) as raw, gzip.GzipFile(fileobj=raw, mode='r') as f:
+		yield f
+#end open_zipped
+
+#same as open_zipped, but the file object reads the compressed bytes
+@contextlib.contextmanager
+def open_zipped_raw(filename):
+	tar_filename, member = split_tar_member(filename)
+	if member is None:
+		with open(filename, 'rb') as raw:
+			yield raw
+		return
+	with tarfile.open(tar_filename, 'r:*') as tar:
+		with tar.extractfile(find_tar_member(tar, member)) as raw:
+			yield raw
+#end open_zipped_raw
+
+#split a data filename into (tar filename, member name), or (filename, None) if not a tar member
+def split_tar_member(filename):
+	if TAR_MEMBER_SEP in filename:
+		tar_filename, member = filename.split(TAR_MEMBER_SEP, 1)
+		return tar_filename, member
+	return filename, None
+#end split_tar_member
+
+#find a member of an open tar by name - full path within the archive, or just the file name
+#(only reads member headers up to the match, skipping over the data of the others)
+def find_tar_member(tar, member):
+	for info in tar:
+		if info.isfile() and (info.name == member or os.path.basename(info.name) == member):
+			return info
+	raise KeyError("%s not found in %s" % (member, tar.name))
+#end find_tar_member
+
+#compressed size of a data file (or tar member), in bytes
+def zipped_size(filename):
+	tar_filename, member = split_tar_member(filename)
+	if member is None:
+		return os.path.getsize(filename)
+	with tarfile.open(tar_filename, 'r:*') as tar:
+		return find_tar_member(tar, member).size
+#end zipped_size
+
+#given a tar archive, yield (member name, object) for every object in its .json.gz members (or the
+#members whose file name matches pattern), in archive order
+#reads the archive as a single sequential stream, decompressing each member on the fly - so the
+#archive doesn't need to be unpacked first, and can even be read from a pipe
+def stream_tar_multi_json(filename, pattern="*.json.gz", fields=None):
+	parse_line = json_line_parser(fields)
+	with tarfile.open(filename, 'r|*') as tar:
+		for info in tar:
+			if not info.isfile() or not fnmatch.fnmatch(os.path.basename(info.name), pattern):
+				continue
+			if DISPLAY:
+				print("Loading", info.name, "from", filename)
+			with tar.extractfile(info) as raw, gzip.GzipFile(fileobj=raw, mode='r') as f:
+				for line in f:
+					yield info.name, parse_line(line)
+#end stream_tar_multi_json
+
+#given a tar archive, return dictionary of member file name -> data filename ("archive.tar::member")
+#for its .json.gz members (or those matching pattern) - ie, to build a datatype -> file map for load_domain_data
+def list_tar_data_files(filename, pattern="*.json.gz"):
+	with tarfile.open(filename, 'r:*') as tar:
+		return {os.path.basename(info.name): filename + TAR_MEMBER_SEP + info.name for info in tar if info.isfile() and fnmatch.fnmatch(os.path.basename(info.name), pattern)}
+#end list_tar_data_files
+
+#given a list of fields, where each field is a list of nested keys (same as search_narrative_keywords),
+#ie [["id_h"], ["extension", "socialsim_information_id"]], return a function that parses a single
+#json line (bytes) into a dictionary with only those fields, nested the same as the full object
+#fields missing from an object are left out
+#if simdjson is installed the line is parsed lazily, and only the requested values are ever built
+#into python objects - otherwise falls back to a full json.loads that is then trimmed
+#if fields is None, the parser returns the whole object
+def json_line_parser(fields=None):
+	if fields is None:
+		return lambda line: json.loads(line.decode('utf-8'))
+
+	try:
+		import simdjson
+	except ImportError:
+		return lambda line: project_fields(json.loads(line.decode('utf-8')), fields)
+
+	parser = simdjson.Parser()		#reused for every line, no allocations per object
+	#json pointer for each field (escape ~ and / in key names)
+	pointers = [(field, "/" + "/".join(key.replace("~", "~0").replace("/", "~1") for key in field)) for field in fields]
+
+	def parse_line(line):
+		doc = parser.parse(line)
+		obj = {}
+		for field, pointer in pointers:
+			try:
+				value = doc.at_pointer(pointer)
+			except (LookupError, TypeError):
+				continue		#field not in this object
+			#nested objects/lists come back as lazy proxies, convert to python
+			if isinstance(value, simdjson.Object):
+				value = value.as_dict()
+			elif isinstance(value, simdjson.Array):
+				value = value.as_list()
+			set_field(obj, field, value)
+		return obj
+
+	return parse_line
+#end json_line_parser
+
+#given a loaded object and list of fields (each a list of nested keys), return a new dictionary
+#containing only those fields, with the same nesting - missing fields are left out
+def project_fields(obj, fields):
+	projected = {}
+	for field in fields:
+		value = obj
+		for key in field:
+			if isinstance(value, dict) and key in value:
+				value = value[key]
+			else:
+				break
+		else:
+			set_field(projected, field, value)
+	return projected
+#end project_fields
+
+#set a nested field (list of keys) in a dictionary, creating intermediate dictionaries as needed
+def set_field(obj, field, value):
+	for key in field[:-1]:
+		obj = obj.setdefault(key, {})
+	obj[field[-1]] = value
+#end set_field
+
+#build a seek index for a (single stream) .json.gz, so the file can be split into byte ranges
+#and decompressed by several workers at once
+#writes two sidecar files next to the data file:
+#  filename.gzindex       gzip access points (uses indexed_gzip, a zran-style index)
+#  filename.gzindex.json  file size/mtime, and offsets (in decompressed bytes) of line starts
+#                         roughly every chunk_size bytes, so each range holds complete json objects
+#spacing is the distance between gzip access points - smaller is faster seeks, but bigger index
+def build_gzip_index(filename, chunk_size=256*1024*1024, spacing=32*1024*1024):
+	import indexed_gzip		#only needed for the chunked reads, so don't require it everywhere
+
+	if DISPLAY:
+		print("Indexing", filename)
+
+	#single pass over the whole file: builds the access points as it goes,
+	#and records a line start every chunk_size bytes
+	line_offsets = [0]
+	pos = 0					#decompressed offset of current block
+	next_split = chunk_size
+	with indexed_gzip.IndexedGzipFile(filename, spacing=spacing) as f:
+		while True:
+			block = f.read(16*1024*1024)
+			if not block:
+				break
+			while next_split < pos + len(block):
+				newline = block.find(b'\n', max(0, next_split - pos))
+				if newline == -1:
+					break		#split point is in the middle of a line that continues in the next block
+				line_offsets.append(pos + newline + 1)
+				next_split = pos + newline + 1 + chunk_size
+			pos += len(block)
+		f.export_index(filename + ".gzindex")
+
+	#last offset is always the end of the file
+	if line_offsets[-1] != pos:
+		line_offsets.append(pos)
+
+	stat = os.stat(filename)
+	index = {"size": stat.st_size, "mtime": stat.st_mtime, "chunk_size": chunk_size, "line_offsets": line_offsets}
+	save_json(index, filename + ".gzindex.json")
+	return index
+#end build_gzip_index
+
+#load the seek index for a .json.gz file, (re)building it if the file has changed since
+#the index was built (based on size and mtime), or if it was built with a different chunk size
+def load_gzip_index(filename, chunk_size=256*1024*1024):
+	if verify_file(filename + ".gzindex") and verify_file(filename + ".gzindex.json"):
+		index = load_json(filename + ".gzindex.json")
+		stat = os.stat(filename)
+		if index['size'] == stat.st_size and index['mtime'] == stat.st_mtime and index['chunk_size'] == chunk_size:
+			return index
+	return build_gzip_index(filename, chunk_size)
+#end load_gzip_index
+
+#given a .json.gz file, return list of (start, end) decompressed byte ranges that split the file
+#on line boundaries, each roughly chunk_size bytes (builds the index if needed)
+def gzip_line_ranges(filename, chunk_size=256*1024*1024):
+	offsets = load_gzip_index(filename, chunk_size)['line_offsets']
+	return list(zip(offsets[:-1], offsets[1:]))
+#end gzip_line_ranges
+
+#given a .json.gz with multiple json objects and an indexed (start, end) range from gzip_line_ranges,
+#yield the objects in just that range, seeking straight to the start via the index
+def stream_zipped_multi_json_range(filename, start, end, fields=None):
+	import indexed_gzip
+
+	parse_line = json_line_parser(fields)
+	with indexed_gzip.IndexedGzipFile(filename) as f:
+		f.import_index(filename + ".gzindex")
+		f.seek(start)
+		remaining = end - start
+		partial = b''		#incomplete line carried over from the previous block
+		while remaining > 0:
+			block = f.read(min(remaining, 16*1024*1024))
+			if not block:
+				break
+			remaining -= len(block)
+			lines = (partial + block).split(b'\n')
+			partial = lines.pop()
+			for line in lines:
+				if line.strip():
+					yield parse_line(line)
+		if partial.strip():
+			yield parse_line(partial)
+#end stream_zipped_multi_json_range
 
 #given a filename, load the json
 def load_json(filename):
@@ -51,23 +440,53 @@ def save_json(data, filename):
 #end save_json
 
 #given a filename, load the multiple json objects
+#objects can be pretty-printed over multiple lines, or several to a line (any whitespace between)
 def load_multi_json(filename):
+	return list(stream_multi_json(filename))
+#end load_json
+
+#given a filename containing multiple json objects, yield them one at a time
+#reads the file in blocks and decodes each object directly from the buffer, so every object is
+#only parsed once - if an object runs past the end of the buffer, the next read is at least as big
+#as what's already buffered, so very large objects still take linear time overall
+def stream_multi_json(filename, block_size=1024*1024):
 	if DISPLAY:
 		print("Loading", filename)
-	d = []
-	curr = ""
+	decoder = json.JSONDecoder()
+	buf = ""
+	pos = 0			#start of unparsed data in buf
+	eof = False
 	with open(filename) as f:
-		for line in f:
-			curr += line
+		while True:
+			pos = JSON_WHITESPACE.match(buf, pos).end()
+			if pos == len(buf):
+				#buffer used up, start a new one
+				if eof:
+					return
+				buf = f.read(block_size)
+				pos = 0
+				eof = len(buf) == 0
+				continue
+
 			try:
-				jobj = json.loads(curr)
-				d.append(jobj)
-				curr = ""
+				jobj, end = decoder.raw_decode(buf, pos)
+				#a value that ends exactly at the end of the buffer might continue (ie, a number)
+				complete = end < len(buf) or eof
 			except ValueError:
-				#not yet a complete JSON value
-				pass
-	return d
-#end load_json
+				if eof:
+					raise		#no more data coming, this really is bad json
+				complete = False
+
+			if complete:
+				yield jobj
+				pos = end
+			else:
+				#not yet a complete JSON value - keep the unparsed part and read more
+				more = f.read(max(block_size, len(buf) - pos))
+				eof = len(more) == 0
+				buf = buf[pos:] + more
+				pos = 0
+#end stream_multi_json
 
 #given a filepath, load pickled data
 def load_pickle(filename):
@@ -130,15 +549,11 @@ def save_csv(data, filename, fields=False, file_mode='w'):
 			writer.writerow({key: row[key] for key in fields})
 #end save_csv
 
-#unpacks gzip file to desired destination
-def unzip_gz(source, dest):
-	inF = gzip.GzipFile(source, 'rb')
-	s = inF.read()
-	inF.close()
-
-	outF = open(dest, 'wb')
-	outF.write(s)
-	outF.close()
+#unpacks gzip file (or .gz tar member, "archive.tar::member") to desired destination
+#copies chunk_size bytes at a time, so memory use doesn't depend on the size of the file
+def unzip_gz(source, dest, chunk_size=16*1024*1024):
+	with open_zipped(source) as f_in, open(dest, 'wb') as f_out:
+		shutil.copyfileobj(f_in, f_out, chunk_size)
 #end unzip_gz
 
 #given a path to a directory, create it if it does not exist
@@ -217,14 +632,133 @@ def multi_dict_to_csv(filename, fields, dict_list):
 
 #given a filename, load the parquet file into a pandas dataframe
 def load_parquet(filename):
+	import pandas as pd
 	df = pd.read_parquet(filename, engine='pyarrow')
 	return df
 #end load_parquet
 
+#save a pandas dataframe to a parquet file
+def save_parquet(df, filename, include_index=False):
+	df.to_parquet(filename, engine='pyarrow', index=include_index)
+#end save_parquet
+
+#given a .json.gz with multiple json objects and a list of fields (each a list of nested keys),
+#return a pyarrow table with one column per field (named with the keys joined by '.', ie "snippet.title_m")
+#the table is cached as a parquet file in cache_dir the first time, and later calls read the cache instead
+#cache is rebuilt automatically if the source file's size or mtime changes
+#list fields (like narrative labels or tags) become list<string> columns, missing fields are null
+#column types are unified over the whole file (see unify_schemas), so ie ints that later turn into floats
+#give a float column, and a field that's always null early on takes the type of its later values - a field
+#whose values can't share one type (ie strings and dicts) becomes a string column, with anything that isn't
+#already a string json-encoded
+def load_cached_zipped_multi_json(filename, fields, cache_dir="./data/cache", batch_size=100000):
+	import tempfile
+	import pyarrow as pa
+	import pyarrow.parquet as pq
+
+	#one cache file per source file + field list (for tar members, the whole archive is checked for changes)
+	stat = os.stat(split_tar_member(filename)[0])
+	source = {"path": os.path.abspath(filename), "size": stat.st_size, "mtime": stat.st_mtime, "fields": fields}
+	key = hashlib.md5(json.dumps([source['path'], fields]).encode('utf-8')).hexdigest()[:12]
+	cache_file = os.path.join(cache_dir, "%s.%s.parquet" % (os.path.basename(filename), key))
+
+	#use the cache if it was built from this exact version of the file
+	if verify_file(cache_file):
+		metadata = pq.read_schema(cache_file).metadata or {}
+		if json.loads(metadata.get(b'source', b'null')) == source:
+			if DISPLAY:
+				print("Loading", filename, "from cache", cache_file)
+			return pq.read_table(cache_file)
+
+	#(re)build cache - convert in batches, so the whole file is never in memory as python objects
+	#each batch is written to a temporary part file with its own column types first, and the parts are
+	#copied into the cache once the types of the whole file are known
+	if DISPLAY:
+		print("Caching", filename, "to", cache_file)
+	verify_dir(cache_dir)
+	columns = [".".join(field) for field in fields]
+	tmp_dir = tempfile.mkdtemp(dir=cache_dir)
+	try:
+		part_files = []
+		for batch in batched(stream_zipped_multi_json(filename, fields), batch_size):
+			part_files.append(os.path.join(tmp_dir, "part%d.parquet" % len(part_files)))
+			pq.write_table(rows_to_table([[get_field(item, field) for item in batch] for field in fields], columns), part_files[-1])
+
+		#combined column types - anything with no values at all is assumed to be string(s)
+		schema = unify_schemas([pq.read_schema(part_file) for part_file in part_files]) if part_files else pa.schema([pa.field(col, pa.null()) for col in columns])
+		for i, col in enumerate(schema):
+			if pa.types.is_null(col.type):
+				schema = schema.set(i, pa.field(col.name, pa.string()))
+			elif pa.types.is_list(col.type) and pa.types.is_null(col.type.value_type):
+				schema = schema.set(i, pa.field(col.name, pa.list_(pa.string())))
+		schema = schema.with_metadata({"source": json.dumps(source)})
+
+		with pq.ParquetWriter(cache_file + ".tmp", schema) as writer:
+			for part_file in part_files:
+				part = pq.read_table(part_file)
+				writer.write_table(pa.Table.from_arrays([cast_column(part[col.name], col.type) for col in schema], schema=schema))
+	finally:
+		shutil.rmtree(tmp_dir)
+	os.replace(cache_file + ".tmp", cache_file)		#only replace old cache once the new one is complete
+
+	return pq.read_table(cache_file)
+#end load_cached_zipped_multi_json
+
+#given a list of columns (each a list of values) and their names, return a pyarrow table with each column's
+#type inferred from its values - a column whose values can't share one type (ie strings and dicts) becomes a
+#string column, with anything that isn't already a string json-encoded
+def rows_to_table(column_values, columns):
+	import pyarrow as pa
+
+	arrays = []
+	for values in column_values:
+		try:
+			arrays.append(pa.array(values))
+		except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError):
+			arrays.append(json_string_array(values))
+	return pa.Table.from_arrays(arrays, names=columns)
+#end rows_to_table
+
+#pyarrow string array of a list of values: strings and None as they are, anything else json-encoded
+def json_string_array(values):
+	import pyarrow as pa
+	return pa.array([value if value is None or isinstance(value, str) else json.dumps(value) for value in values], type=pa.string())
+#end json_string_array
+
+#cast a pyarrow column to a type from unify_schemas - columns that were unified to strings from a type arrow
+#can't cast to a string (ie lists or structs) are json-encoded instead
+def cast_column(column, to_type):
+	import pyarrow as pa
+	if pa.types.is_string(to_type) and not (pa.types.is_string(column.type) or pa.types.is_null(column.type)):
+		return json_string_array(column.to_pylist())
+	return column.cast(to_type)
+#end cast_column
+
+#given an object and a field (list of nested keys), return the value of that field, or None if missing
+def get_field(obj, field):
+	for key in field:
+		if isinstance(obj, dict) and key in obj:
+			obj = obj[key]
+		else:
+			return None
+	return obj
+#end get_field
+
+#given an iterable, yield lists of (up to) size items at a time
+def batched(iterable, size):
+	iterator = iter(iterable)
+	while True:
+		batch = list(itertools.islice(iterator, size))
+		if not batch:
+			return
+		yield batch
+#end batched
+
 
 #load a csv file to a pandas dataframe
 #if index_col is given, set that column to be the index
 def load_csv_pandas(filename, index_col=False):
+	import pandas as pd
 	df = pd.read_csv(filename)
 	if index_col != False:
 		df.set_index(index_col, inplace=True)
@@ -242,19 +776,20 @@ def save_csv_pandas(df, filename, include_index=True):
 #a single csv file, saved to the output filename
 #(uses combine_csv_list to do the actual combining)
 #if file already exists, skip it - if not, combine to create new file
-def combine_csv(combined_filename, glob_string, display=False):
+#if the output filename ends with .parquet, combine to a parquet file instead (see combine_csv_list)
+def combine_csv(combined_filename, glob_string, display=False, processes=None):
 	#check if file already exists
 	if verify_file(combined_filename) == False:
 		#get list of files to combine
-		combine_file_list = glob.glob(glob_string)
+		combine_file_list = sorted(glob.glob(glob_string))
 		#return if no files
 		if len(combine_file_list) == 0:
 			if display: print("No matching files to combine for %s" % combined_filename)
 			return
 
-		#combine contents into a single csv file
+		#combine contents into a single file
 		if display: print("Combining %d files to %s" % (len(combine_file_list), combined_filename))
-		combine_csv_list(combine_file_list, combined_filename)
+		combine_csv_list(combine_file_list, combined_filename, processes=processes)
 
 	#combined file already exists, skip	
 	elif display: print("Skipping combine, %s already exists" % combined_filename)	
@@ -262,13 +797,143 @@ def combine_csv(combined_filename, glob_string, display=False):
 
 
 #given a list of csv files, combine them into a single file
-#(all files must have the same column structure, or this doesn't make much sense)
-#find all csv files in the folder
-#use glob pattern matching -> extension = 'csv'
-#save result in list -> all_filenames
-def combine_csv_list(file_list, combined_filename):
-	#combine all files in the list
-	combined_csv = pd.concat([pd.read_csv(f) for f in file_list])
-	#export to csv
-	combined_csv.to_csv(combined_filename, index=False, encoding='utf-8-sig')
-#end combine_csv_list
\ No newline at end of file
+#all files must have the same columns - raises ValueError if not (columns in a different order are ok,
+#rows of those files are reordered to match the first file)
+#rows are streamed through in chunk_size blocks, so memory use doesn't depend on the size of the files
+#if combined_filename ends with .parquet, write a parquet file instead, with each file's rows in its own
+#row group(s) - files are converted in parallel (processes workers, default one per cpu)
+def combine_csv_list(file_list, combined_filename, chunk_size=16*1024*1024, processes=None):
+	if combined_filename.endswith(".parquet"):
+		combine_csv_list_parquet(file_list, combined_filename, processes)
+		return
+
+	header = None
+	#write to a temp file, and only rename once complete (so a failed combine isn't skipped next time)
+	tmp_filename = combined_filename + ".tmp"
+	try:
+		with open(tmp_filename, 'w', newline='', encoding='utf-8-sig') as out:
+			for filename in file_list:
+				with open(filename, 'r', newline='', encoding='utf-8-sig') as f:
+					reader = csv.reader(f)
+					file_header = next(reader, None)
+					if file_header is None:
+						continue		#empty file
+					if header is None:
+						header = file_header
+						csv.writer(out, lineterminator="\n").writerow(header)
+					check_csv_header(header, file_header, filename)
+
+					if file_header == header:
+						#same columns in same order: copy rows straight through, no parsing
+						last = None
+						while True:
+							block = f.read(chunk_size)
+							if block == "":
+								break
+							out.write(block)
+							last = block[-1]
+						if last is not None and last not in "\r\n":
+							out.write("\n")		#file didn't end with a newline
+					else:
+						#same columns, different order
+						order = [file_header.index(col) for col in header]
+						writer = csv.writer(out, lineterminator="\n")
+						for row in reader:
+							writer.writerow([row[i] for i in order])
+	except Exception:
+		if os.path.exists(tmp_filename):
+			os.remove(tmp_filename)
+		raise
+	os.replace(tmp_filename, combined_filename)
+#end combine_csv_list
+
+#raise ValueError if a csv file's header doesn't have the same columns as the combined header
+def check_csv_header(header, file_header, filename):
+	if len(file_header) != len(header) or set(file_header) != set(header):
+		raise ValueError("%s columns %s don't match %s" % (filename, file_header, header))
+#end check_csv_header
+
+#parquet version of combine_csv_list: each csv file is converted to a temporary parquet file in a
+#separate process (streaming, in blocks), and then their row groups are copied into the combined file
+#each file's column types are inferred separately, then unified (see unify_schemas) and every part cast to
+#the combined types, so ie an int column in one file and a float column in another combine as float
+def combine_csv_list_parquet(file_list, combined_filename, processes=None):
+	import multiprocessing
+	import tempfile
+	import pyarrow.csv as pv
+	import pyarrow.parquet as pq
+
+	#columns (and their order) from the first file
+	reader = pv.open_csv(file_list[0])
+	columns = reader.schema.names
+	reader.close()
+
+	tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(combined_filename)))
+	try:
+		part_files = [os.path.join(tmp_dir, "part%d.parquet" % i) for i in range(len(file_list))]
+		with multiprocessing.Pool(processes) as pool:
+			part_schemas = pool.starmap(csv_to_parquet, [(filename, part_file, columns) for filename, part_file in zip(file_list, part_files)])
+		schema = unify_schemas(part_schemas)
+
+		#temp file renamed once complete, same as combine_csv_list
+		tmp_filename = combined_filename + ".tmp"
+		try:
+			with pq.ParquetWriter(tmp_filename, schema) as writer:
+				for part_file in part_files:
+					part = pq.ParquetFile(part_file)
+					for i in range(part.num_row_groups):
+						writer.write_table(part.read_row_group(i).select(schema.names).cast(schema))
+		except Exception:
+			if os.path.exists(tmp_filename):
+				os.remove(tmp_filename)
+			raise
+		os.replace(tmp_filename, combined_filename)
+	finally:
+		shutil.rmtree(tmp_dir)
+#end combine_csv_list_parquet
+
+#given a list of pyarrow schemas with the same columns (in any order), return one schema that tables of all
+#of them can be cast to (columns in the first schema's order): types are promoted where arrow can (ie
+#int -> double, null -> anything), and columns with types that can't be merged (ie int and string) become
+#strings
+def unify_schemas(schemas):
+	import pyarrow as pa
+
+	fields = []
+	for name in schemas[0].names:
+		column_schemas = [pa.schema([schema.field(name)]) for schema in schemas if name in schema.names]
+		try:
+			fields.append(pa.unify_schemas(column_schemas, promote_options="permissive").field(0))
+		except (pa.ArrowInvalid, pa.ArrowTypeError):
+			fields.append(pa.field(name, pa.string()))
+	return pa.schema(fields)
+#end unify_schemas
+
+#convert a single csv file to parquet, streaming one block at a time, and return the schema written
+#column types are inferred from the first block - if a later block doesn't fit them (ie a float in what
+#looked like an int column), the file is converted again with every column as a string
+#if columns is given, the file must have those columns (in any order)
+def csv_to_parquet(filename, parquet_filename, columns=None, all_strings=False):
+	import pyarrow as pa
+	import pyarrow.csv as pv
+	import pyarrow.parquet as pq
+
+	convert_options = None
+	if all_strings:
+		with open(filename, 'r', newline='', encoding='utf-8-sig') as f:
+			header = next(csv.reader(f), [])
+		convert_options = pv.ConvertOptions(column_types={name: pa.string() for name in header})
+	reader = pv.open_csv(filename, convert_options=convert_options)
+	schema = reader.schema
+	if columns is not None:
+		check_csv_header(columns, schema.names, filename)
+	try:
+		with pq.ParquetWriter(parquet_filename, schema) as writer:
+			for batch in reader:
+				writer.write_table(pa.Table.from_batches([batch]))
+	except pa.ArrowInvalid:
+		if all_strings:
+			raise
+		return csv_to_parquet(filename, parquet_filename, columns, all_strings=True)
+	return schema
+#end csv_to_parquet
\ No newline at end of file
@@ -0,0 +1,179 @@
+#utility methods for retweet cascades as compact array-backed graphs
+#tweet ids (ie, id_h strings) are interned to integer node ids once while loading, and the graph is kept
+#as numpy arrays: a parent array (one entry per node, -1 for roots) and CSR parent -> child adjacency
+#cascade size/depth/breadth are computed for every node at once with pointer jumping and numpy
+#reductions, instead of walking dict-of-dict trees in python
+
+import csv
+
+import numpy as np
+
+import file_utils
+
+#default fields of the retweet chain objects: the retweet's id, and the id of the tweet it retweets
+CHILD_FIELD = ["tweet_id_h"]
+PARENT_FIELD = ["retweeted_from_tweet_id_h"]
+
+#given an iterable of objects with a child and parent tweet id each (ie, the retweet chain data),
+#build the retweet graph - returns dictionary of:
+#  ids:       node id -> tweet id (list)
+#  id_nodes:  tweet id -> node id (dict)
+#  parent:    node id -> parent node id, -1 for tweets with no (known) parent
+#  indptr, children: CSR adjacency, children of node n are children[indptr[n]:indptr[n+1]]
+#objects missing either id are skipped, and if a tweet has more than one parent only the first is kept
+def build_retweet_graph(data, child_field=CHILD_FIELD, parent_field=PARENT_FIELD):
+	ids = []
+	id_nodes = {}
+	edge_child = []
+	edge_parent = []
+	for item in data:
+		child = file_utils.get_field(item, child_field)
+		parent = file_utils.get_field(item, parent_field)
+		if child is None or parent is None or child == parent:
+			continue
+		#intern both ids
+		child_node = id_nodes.get(child)
+		if child_node is None:
+			child_node = id_nodes[child] = len(ids)
+			ids.append(child)
+		parent_node = id_nodes.get(parent)
+		if parent_node is None:
+			parent_node = id_nodes[parent] = len(ids)
+			ids.append(parent)
+		edge_child.append(child_node)
+		edge_parent.append(parent_node)
+
+	#parent array (first edge for each child wins - np.unique gives the index of each child's first edge)
+	parent = np.full(len(ids), -1, dtype=np.int64)
+	edge_child = np.array(edge_child, dtype=np.int64)
+	edge_parent = np.array(edge_parent, dtype=np.int64)
+	children, first_edges = np.unique(edge_child, return_index=True)
+	parent[children] = edge_parent[first_edges]
+
+	graph = {"ids": ids, "id_nodes": id_nodes, "parent": parent}
+	graph.update(build_csr(parent))
+	return graph
+#end build_retweet_graph
+
+#load the retweet graph from a retweet chain .json.gz (only the two id fields are parsed)
+def load_retweet_graph(filename, child_field=CHILD_FIELD, parent_field=PARENT_FIELD):
+	return build_retweet_graph(file_utils.stream_zipped_multi_json(filename, [child_field, parent_field]), child_field, parent_field)
+#end load_retweet_graph
+
+#given a parent array, build CSR parent -> child adjacency (children in node order)
+def build_csr(parent):
+	has_parent = np.flatnonzero(parent >= 0)
+	order = np.argsort(parent[has_parent], kind='stable')
+	indptr = np.zeros(len(parent) + 1, dtype=np.int64)
+	np.cumsum(np.bincount(parent[has_parent], minlength=len(parent)), out=indptr[1:])
+	return {"indptr": indptr, "children": has_parent[order]}
+#end build_csr
+
+#children (node ids) of a single node
+def children_of(graph, node):
+	return graph['children'][graph['indptr'][node]:graph['indptr'][node+1]]
+#end children_of
+
+#find the root and depth (retweet hops from the root) of every node, by pointer jumping:
+#each round every node jumps to its ancestor's ancestor, so it takes log2(max depth) rounds
+#returns (root, depth) arrays - nodes on a parent cycle (bad data) get root -1 and depth -1
+def node_roots(graph):
+	parent = graph['parent']
+	nodes = np.arange(len(parent))
+	ancestor = np.where(parent >= 0, parent, nodes)
+	depth = (parent >= 0).astype(np.int64)
+	for i in range(64):
+		next_ancestor = ancestor[ancestor]
+		if np.array_equal(next_ancestor, ancestor):
+			break
+		depth = depth + depth[ancestor]
+		ancestor = next_ancestor
+	#anything not pointing at a root now is on (or hangs off) a cycle
+	bad = parent[ancestor] >= 0
+	ancestor[bad] = -1
+	depth[bad] = -1
+	return ancestor, depth
+#end node_roots
+
+#compute stats of every cascade (one per root tweet) - returns dictionary of arrays, one entry per cascade:
+#  root:    root node id
+#  size:    number of tweets in the cascade, including the root
+#  depth:   longest retweet path from the root
+#  breadth: most tweets at any single depth (the root alone is depth 0)
+def cascade_stats(graph, roots=None):
+	if roots is None:
+		roots = node_roots(graph)
+	root, depth = roots
+	valid = root >= 0
+	root = root[valid]
+	depth = depth[valid]
+
+	cascade_roots, cascade = np.unique(root, return_inverse=True)
+	size = np.bincount(cascade)
+	max_depth = np.zeros(len(cascade_roots), dtype=np.int64)
+	np.maximum.at(max_depth, cascade, depth)
+
+	#count nodes per (cascade, depth) pair, widest level of each cascade
+	num_levels = int(depth.max()) + 1 if len(depth) else 1
+	levels, level_counts = np.unique(cascade * num_levels + depth, return_counts=True)
+	breadth = np.zeros(len(cascade_roots), dtype=np.int64)
+	np.maximum.at(breadth, levels // num_levels, level_counts)
+
+	return {"root": cascade_roots, "size": size, "depth": max_depth, "breadth": breadth}
+#end cascade_stats
+
+#given the graph and an iterable of tweets, return dictionary of root node id -> narrative labels of
+#that root tweet (only root tweets are kept, ie every tweet of the cascade gets its root's narratives)
+def root_labels(graph, tweets, id_field=["id_h"]):
+	roots = set(np.flatnonzero(graph['parent'] < 0).tolist())
+	labels = {}
+	for tweet in tweets:
+		node = graph['id_nodes'].get(file_utils.get_field(tweet, id_field))
+		if node is not None and node in roots and node not in labels:
+			labels[node] = file_utils.get_field(tweet, ["extension", "socialsim_information_id"]) or [""]
+	return labels
+#end root_labels
+
+#cascade stats per narrative label and component of the root tweets
+#returns (label_stats, comp_stats): dictionaries of label/component -> {cascades, tweets, mean_size,
+#max_size, mean_depth, max_depth, max_breadth} - cascades whose root isn't in root_label_dict, or has
+#no narrative, are counted under ''
+def narrative_cascade_stats(stats, root_label_dict):
+	#(cascade index, label) and (cascade index, component) pairs - once per distinct label/comp in the root
+	label_names = {}
+	comp_names = {}
+	label_pairs = []
+	comp_pairs = []
+	for i, root in enumerate(stats['root'].tolist()):
+		labels = set(root_label_dict.get(root, [""]))
+		comps = set(comp for label in labels for comp in label.split('-') if comp != "") or set([""])
+		label_pairs.extend((i, label_names.setdefault(label, len(label_names))) for label in labels)
+		comp_pairs.extend((i, comp_names.setdefault(comp, len(comp_names))) for comp in comps)
+	return group_cascade_stats(stats, label_pairs, label_names), group_cascade_stats(stats, comp_pairs, comp_names)
+#end narrative_cascade_stats
+
+#aggregate cascade stats over groups, given list of (cascade index, group index) pairs and group name -> index
+def group_cascade_stats(stats, pairs, names):
+	pairs = np.array(pairs, dtype=np.int64).reshape(-1, 2)
+	cascade, group = pairs[:, 0], pairs[:, 1]
+	num_groups = len(names)
+	count = np.bincount(group, minlength=num_groups)
+	res = {"cascades": count, "tweets": np.bincount(group, weights=stats['size'][cascade], minlength=num_groups).astype(np.int64)}
+	for key in ["size", "depth", "breadth"]:
+		res["max_" + key] = np.zeros(num_groups, dtype=np.int64)
+		np.maximum.at(res["max_" + key], group, stats[key][cascade])
+	res['mean_size'] = res['tweets'] / np.maximum(count, 1)
+	res['mean_depth'] = np.bincount(group, weights=stats['depth'][cascade], minlength=num_groups) / np.maximum(count, 1)
+	return {name: {key: val[i].item() for key, val in res.items()} for name, i in names.items()}
+#end group_cascade_stats
+
+#save per-narrative cascade stats (from narrative_cascade_stats) to csv, largest first
+def save_cascade_stats(group_stats, name_field, filename):
+	fields = ["cascades", "tweets", "mean_size", "max_size", "mean_depth", "max_depth", "max_breadth"]
+	rows = sorted(group_stats.items(), key=lambda item: (-item[1]['tweets'], item[0]))
+	with open(filename, 'w', newline='') as f:
+		writer = csv.writer(f)
+		writer.writerow([name_field] + fields)
+		for name, stats in rows:
+			writer.writerow([name] + [round(stats[field], 3) if isinstance(stats[field], float) else stats[field] for field in fields])
+#end save_cascade_stats
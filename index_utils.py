@@ -0,0 +1,179 @@
+#utility methods for random access to single records by id (ie, id_h) without loading whole datasets
+#a one-time indexing pass records the file and byte offset of every record, stored compactly as
+#sorted numpy arrays keyed by a 64-bit hash of the id - lookups are a binary search, and then only
+#the matching records are read and decoded
+#plain json files are read through mmap, .json.gz files through their own gzip seek points, saved next to
+#the index with a small spacing so a lookup only inflates a little data before the record
+
+import hashlib
+import json
+import mmap
+import os
+
+import numpy as np
+
+import file_utils
+
+#distance between gzip access points of the id index seek files (a lookup inflates up to this much data
+#before reaching its record - each access point stores a 32KB window, so the seek file is about 3% of the
+#decompressed data)
+SEEK_SPACING = 1024*1024
+
+#64-bit hash of a record id (stable across runs, unlike python's hash)
+def id_hash(record_id):
+	return int.from_bytes(hashlib.blake2b(str(record_id).encode('utf-8'), digest_size=8).digest(), 'little')
+#end id_hash
+
+#given a list of files with one json object per line (.json or .json.gz), build an index of
+#id -> (file, offset, length) for every record, and save it to index_file (.npz)
+#offsets in .json.gz files are in decompressed bytes - gzip access points every SEEK_SPACING bytes are
+#built during the same pass, and saved to index_file.<file number>.gzindex for reading the records later
+#returns the loaded index, same as load_id_index
+#tar members ("archive.tar::member") can't be indexed - a record is read by seeking in its own file, so
+#raises ValueError for them (extract the member first)
+def build_id_index(files, index_file, id_field="id_h"):
+	for filename in files:
+		if file_utils.split_tar_member(filename)[1] is not None:
+			raise ValueError("can't build an id index over tar member %s, extract it from the archive first" % filename)
+
+	parse_line = file_utils.json_line_parser([[id_field]])
+	seek_files = []
+
+	keys = []
+	file_ids = []
+	offsets = []
+	lengths = []
+	for file_id, filename in enumerate(files):
+		if file_utils.DISPLAY:
+			print("Indexing ids in", filename)
+		if filename.endswith(".gz"):
+			import indexed_gzip		#only needed for .json.gz files
+			seek_files.append("%s.%d.gzindex" % (index_file, file_id))
+			f = indexed_gzip.IndexedGzipFile(filename, spacing=SEEK_SPACING)
+		else:
+			seek_files.append("")
+			f = open(filename, 'rb')
+		with f:
+			offset = 0
+			for line in f:
+				if line.strip():
+					record_id = parse_line(line).get(id_field)
+					if record_id is not None:
+						keys.append(id_hash(record_id))
+						file_ids.append(file_id)
+						offsets.append(offset)
+						lengths.append(len(line))
+				offset += len(line)
+			if seek_files[-1]:
+				f.export_index(seek_files[-1])
+
+	#sort everything by id hash (stable, so duplicate ids stay in file order)
+	keys = np.array(keys, dtype=np.uint64)
+	order = np.argsort(keys, kind='stable')
+	stats = [os.stat(filename) for filename in files]
+	np.savez(index_file,
+		keys=keys[order],
+		file_ids=np.array(file_ids, dtype=np.uint32)[order],
+		offsets=np.array(offsets, dtype=np.uint64)[order],
+		lengths=np.array(lengths, dtype=np.uint32)[order],
+		files=np.array([os.path.abspath(filename) for filename in files]),
+		seek_files=np.array([os.path.abspath(seek_file) if seek_file else "" for seek_file in seek_files]),
+		sizes=np.array([stat.st_size for stat in stats], dtype=np.int64),
+		mtimes=np.array([stat.st_mtime for stat in stats], dtype=np.float64),
+		id_field=np.array(id_field))
+
+	return load_id_index(index_file)
+#end build_id_index
+
+#load an id index saved by build_id_index
+#returns a dictionary of the index arrays, plus open readers for the data files (see close_id_index)
+#raises ValueError if any of the indexed files have changed since the index was built, or the index is
+#from an older version (no seek files of its own)
+def load_id_index(index_file):
+	with np.load(index_file) as npz:
+		index = {key: npz[key] for key in npz.files}
+	if 'seek_files' not in index:
+		raise ValueError("id index %s has no seek files, rebuild it" % index_file)
+	index['files'] = [str(filename) for filename in index['files']]
+	index['seek_files'] = [str(seek_file) for seek_file in index['seek_files']]
+	for seek_file in index['seek_files']:
+		if seek_file and not file_utils.verify_file(seek_file):
+			raise ValueError("seek file %s of id index %s is missing" % (seek_file, index_file))
+	index['id_field'] = str(index['id_field'])
+	for filename, size, mtime in zip(index['files'], index['sizes'], index['mtimes']):
+		stat = os.stat(filename)
+		if stat.st_size != size or stat.st_mtime != mtime:
+			raise ValueError("%s has changed since id index %s was built" % (filename, index_file))
+	index['readers'] = {}
+	return index
+#end load_id_index
+
+#given list of files and index filename, load the index if it exists and is current, otherwise (re)build it
+def get_id_index(files, index_file, id_field="id_h"):
+	if file_utils.verify_file(index_file):
+		try:
+			index = load_id_index(index_file)
+			if index['files'] == [os.path.abspath(filename) for filename in files] and index['id_field'] == id_field:
+				return index
+			close_id_index(index)
+		except ValueError:
+			pass		#stale, rebuild
+	return build_id_index(files, index_file, id_field)
+#end get_id_index
+
+#close any data files opened for reading records
+def close_id_index(index):
+	for reader in index['readers'].values():
+		reader.close()
+	index['readers'] = {}
+#end close_id_index
+
+#read length bytes at offset from an indexed file (opening it on first use)
+def read_record_bytes(index, file_id, offset, length):
+	if file_id not in index['readers']:
+		filename = index['files'][file_id]
+		if filename.endswith(".gz"):
+			import indexed_gzip
+			reader = indexed_gzip.IndexedGzipFile(filename)
+			reader.import_index(index['seek_files'][file_id])
+		else:
+			with open(filename, 'rb') as f:
+				reader = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		index['readers'][file_id] = reader
+	reader = index['readers'][file_id]
+
+	if isinstance(reader, mmap.mmap):
+		return reader[offset:offset+length]
+	reader.seek(offset)
+	return reader.read(length)
+#end read_record_bytes
+
+#given an id index and a record id, return the (first) record with that id, or None if not found
+def get_by_id(index, record_id):
+	return get_many(index, [record_id]).get(record_id)
+#end get_by_id
+
+#given an id index and a list of record ids, return dictionary of id -> record for the ids found
+#(if an id appears more than once in the data, the first occurrence is returned)
+#records are read in file/offset order, so a big batch is a sequential pass over the data
+def get_many(index, record_ids):
+	keys = index['keys']
+
+	#find index entries for each id (all entries with the same hash, in case of collisions)
+	entries = []
+	for record_id in set(record_ids):
+		key = np.uint64(id_hash(record_id))
+		start = np.searchsorted(keys, key, side='left')
+		end = np.searchsorted(keys, key, side='right')
+		for i in range(start, end):
+			entries.append((int(index['file_ids'][i]), int(index['offsets'][i]), int(index['lengths'][i]), record_id))
+
+	records = {}
+	for file_id, offset, length, record_id in sorted(entries, key=lambda entry: entry[:2]):
+		if record_id in records:
+			continue		#already have the first occurrence
+		record = json.loads(read_record_bytes(index, file_id, offset, length).decode('utf-8'))
+		if record.get(index['id_field']) == record_id:		#skip hash collisions
+			records[record_id] = record
+	return records
+#end get_many
@@ -0,0 +1,171 @@
+#utility methods for instrumenting pipeline runs
+#wrap each stage of a run (load, analyse, write, ...) in the stage context manager (or the instrumented
+#decorator) to record wall time, cpu time, bytes read, records processed and memory - all stages of
+#the current run are collected into a run report, saved as json with save_run_report
+#memory: resident memory at the start/end of each stage, and how much the stage raised the peak (the peak
+#itself is a high-water mark for the whole process so far, so it only tells a stage apart if it grew) -
+#worker processes (ie parallel mode) are counted separately, as the peak of the largest finished worker
+#cProfile and tracemalloc can be switched on for individual stages (by name) when starting the run
+
+import contextlib
+import cProfile
+import datetime
+import functools
+import io
+import os
+import pstats
+import resource
+import sys
+import time
+import tracemalloc
+
+import file_utils
+
+#report for the current run (None if no run started - stages are still measured, just not collected)
+RUN = None
+
+#start a new run report
+#profile_stages: names of stages to run under cProfile (stats saved to profile_dir, top functions in report)
+#trace_memory_stages: names of stages to run under tracemalloc (peak python allocations in report)
+def start_run(profile_stages=(), trace_memory_stages=(), profile_dir="results/profiles"):
+	global RUN
+	RUN = {
+		"started": datetime.datetime.now().isoformat(timespec='seconds'),
+		"argv": sys.argv,
+		"profile_stages": list(profile_stages),
+		"trace_memory_stages": list(trace_memory_stages),
+		"profile_dir": profile_dir,
+		"stages": [],
+	}
+	RUN['_start'] = time.perf_counter()
+	return RUN
+#end start_run
+
+#total bytes read by this process so far (all reads, including from cache), or None if not available
+#(linux only - from /proc/self/io)
+def bytes_read():
+	try:
+		with open("/proc/self/io") as f:
+			for line in f:
+				if line.startswith("rchar:"):
+					return int(line.split()[1])
+	except OSError:
+		pass
+	return None
+#end bytes_read
+
+#peak resident memory so far, in MB - of this process (the high-water mark since it started), or with
+#who=resource.RUSAGE_CHILDREN, of the largest child process that has finished (0 if none)
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+	peak = resource.getrusage(who).ru_maxrss
+	return peak / (1024*1024) if sys.platform == "darwin" else peak / 1024		#bytes on mac, KB on linux
+#end peak_rss_mb
+
+#current resident memory of this process, in MB, or None if not available (linux only - from /proc/self/statm)
+def current_rss_mb():
+	try:
+		with open("/proc/self/statm") as f:
+			return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024*1024)
+	except (OSError, ValueError):
+		return None
+#end current_rss_mb
+
+#context manager to measure a single stage of a run
+#any extra keyword args are stored in the stage record (ie, platform="YouTube")
+#yields the stage record dictionary, so the caller can fill in 'records' (and anything else)
+#ie:	with instrument_utils.stage("analyse", platform="Twitter") as rec:
+#			res = narrative_analysis(data)
+#			rec['records'] = len(data)
+@contextlib.contextmanager
+def stage(name, **info):
+	record = {"stage": name}
+	record.update(info)
+	record['records'] = None
+
+	#optional profiling for this stage
+	profiler = None
+	started_tracing = False
+	if RUN is not None and name in RUN['profile_stages']:
+		profiler = cProfile.Profile()
+		try:
+			profiler.enable()
+		except ValueError:
+			profiler = None		#another stage is already being profiled
+	if RUN is not None and name in RUN['trace_memory_stages']:
+		if not tracemalloc.is_tracing():
+			tracemalloc.start()
+			started_tracing = True
+		tracemalloc.reset_peak()
+
+	start_bytes = bytes_read()
+	start_rss = current_rss_mb()
+	start_peak = peak_rss_mb()
+	start_children_peak = peak_rss_mb(resource.RUSAGE_CHILDREN)
+	start_cpu = time.process_time()
+	start_wall = time.perf_counter()
+	try:
+		yield record
+	finally:
+		record['wall_s'] = time.perf_counter() - start_wall
+		record['cpu_s'] = time.process_time() - start_cpu
+		end_bytes = bytes_read()
+		record['bytes_read'] = end_bytes - start_bytes if start_bytes is not None else None
+		#memory: current rss before/after, and the peak so far (and how much this stage raised it)
+		record['rss_start_mb'] = start_rss
+		record['rss_end_mb'] = current_rss_mb()
+		record['peak_rss_so_far_mb'] = peak_rss_mb()
+		record['peak_rss_increase_mb'] = record['peak_rss_so_far_mb'] - start_peak
+		children_peak = peak_rss_mb(resource.RUSAGE_CHILDREN)
+		if children_peak > start_children_peak:		#worker processes finished during this stage
+			record['children_peak_rss_so_far_mb'] = children_peak
+			record['children_peak_rss_increase_mb'] = children_peak - start_children_peak
+		if record['records'] is not None and record['wall_s'] > 0:
+			record['records_per_s'] = record['records'] / record['wall_s']
+
+		if tracemalloc.is_tracing() and RUN is not None and name in RUN['trace_memory_stages']:
+			record['py_peak_mb'] = tracemalloc.get_traced_memory()[1] / (1024*1024)
+			if started_tracing:
+				tracemalloc.stop()
+
+		if profiler is not None:
+			profiler.disable()
+			save_profile(profiler, record)
+
+		if RUN is not None:
+			RUN['stages'].append(record)
+#end stage
+
+#decorator version of stage, to measure every call to a function
+#ie:	@instrument_utils.instrumented("write")
+#		def save_narrative_freq(...):
+def instrumented(name, **info):
+	def decorator(func):
+		@functools.wraps(func)
+		def wrapper(*args, **kwargs):
+			with stage(name, function=func.__name__, **info):
+				return func(*args, **kwargs)
+		return wrapper
+	return decorator
+#end instrumented
+
+#save cProfile stats for a stage to the run's profile dir, and add the top functions to the stage record
+def save_profile(profiler, record, top=15):
+	file_utils.verify_dir(RUN['profile_dir'])
+	profile_file = os.path.join(RUN['profile_dir'], "%s_%d.prof" % (record['stage'], len(RUN['stages'])))
+	profiler.dump_stats(profile_file)
+	record['profile_file'] = profile_file
+
+	out = io.StringIO()
+	pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(top)
+	record['profile_top'] = [line for line in out.getvalue().splitlines() if line.strip() != ""]
+#end save_profile
+
+#save the current run report to a json file
+def save_run_report(filename):
+	report = {key: val for key, val in RUN.items() if not key.startswith("_")}
+	report['finished'] = datetime.datetime.now().isoformat(timespec='seconds')
+	report['total_wall_s'] = time.perf_counter() - RUN['_start']
+	report['peak_rss_mb'] = peak_rss_mb()
+	report['children_peak_rss_mb'] = peak_rss_mb(resource.RUSAGE_CHILDREN)
+	file_utils.save_json(report, filename)
+#end save_run_report
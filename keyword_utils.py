@@ -0,0 +1,172 @@
+#utility methods for multi-keyword text search (Aho-Corasick automaton)
+#build the matcher once from a keyword -> label dictionary, then scan each text a single time
+#for all keywords at once, instead of testing every keyword against the text separately
+
+#uses the pyahocorasick package (C implementation) if installed, otherwise a pure python automaton
+
+from collections import deque
+
+#given a dictionary of keyword -> label (ie, from search_term_mapping.csv),
+#build a keyword matcher for use with match_keywords/match_labels
+#if word_boundary is True, keywords only match when not part of a larger word
+#(no letter/digit/underscore directly before or after the match)
+def build_keyword_matcher(keywords_dict, word_boundary=False):
+	keywords = list(keywords_dict.keys())
+	matcher = {
+		"keywords": keywords,
+		"labels": [keywords_dict[keyword] for keyword in keywords],
+		"word_boundary": word_boundary,
+		#empty keyword is in every string (same as '' in text)
+		"always": [idx for idx, keyword in enumerate(keywords) if keyword == ""],
+	}
+
+	try:
+		import ahocorasick
+	except ImportError:
+		ahocorasick = None
+
+	if ahocorasick is not None:
+		automaton = ahocorasick.Automaton()
+		for idx, keyword in enumerate(keywords):
+			if keyword != "":
+				automaton.add_word(keyword, (idx, len(keyword)))
+		if len(automaton) != 0:
+			automaton.make_automaton()
+		matcher["automaton"] = automaton
+	else:
+		matcher["trie"] = build_trie(keywords)
+
+	return matcher
+#end build_keyword_matcher
+
+#build pure python Aho-Corasick automaton for a list of keywords
+#returns (goto, fail, out): goto is list of char -> next node dictionaries (node 0 is the root),
+#fail is the fallback node for each node, and out is the list of (keyword index, keyword length)
+#matched when reaching each node (including those of its fail chain)
+def build_trie(keywords):
+	goto = [{}]
+	out = [[]]
+
+	#add each keyword to the trie
+	for idx, keyword in enumerate(keywords):
+		if keyword == "":
+			continue
+		node = 0
+		for char in keyword:
+			if char not in goto[node]:
+				goto.append({})
+				out.append([])
+				goto[node][char] = len(goto) - 1
+			node = goto[node][char]
+		out[node].append((idx, len(keyword)))
+
+	#breadth-first over the trie to set fail links: longest proper suffix that is also in the trie
+	fail = [0] * len(goto)
+	queue = deque(goto[0].values())
+	while queue:
+		node = queue.popleft()
+		for char, child in goto[node].items():
+			queue.append(child)
+			state = fail[node]
+			while state != 0 and char not in goto[state]:
+				state = fail[state]
+			fail[child] = goto[state].get(char, 0)
+			out[child] = out[child] + out[fail[child]]
+
+	return goto, fail, out
+#end build_trie
+
+#given a keyword matcher and a text, return the set of keyword indices (into matcher['keywords'])
+#that appear in the text
+def match_keywords(matcher, text):
+	matched = set(matcher['always'])
+	word_boundary = matcher['word_boundary']
+
+	#get (keyword index, keyword length, index of last char) for every match
+	if "automaton" in matcher:
+		if len(matcher['automaton']) == 0:
+			return matched
+		hits = ((idx, length, end) for end, (idx, length) in matcher['automaton'].iter(text))
+	else:
+		hits = trie_iter(matcher['trie'], text)
+
+	for idx, length, end in hits:
+		if idx in matched:
+			continue
+		if word_boundary and not is_word_boundary(text, end - length + 1, end + 1):
+			continue
+		matched.add(idx)
+	return matched
+#end match_keywords
+
+#walk the pure python automaton over the text, yielding (keyword index, keyword length, index of last char)
+def trie_iter(trie, text):
+	goto, fail, out = trie
+	node = 0
+	for pos, char in enumerate(text):
+		while node != 0 and char not in goto[node]:
+			node = fail[node]
+		node = goto[node].get(char, 0)
+		for idx, length in out[node]:
+			yield idx, length, pos
+#end trie_iter
+
+#true if text[start:end] is not part of a larger word (no word character on either side)
+def is_word_boundary(text, start, end):
+	if start > 0 and (text[start-1].isalnum() or text[start-1] == "_"):
+		return False
+	if end < len(text) and (text[end].isalnum() or text[end] == "_"):
+		return False
+	return True
+#end is_word_boundary
+
+#given a keyword matcher and a text, return list of labels for keywords found in the text
+#labels are in the order of the keywords dictionary the matcher was built from, without duplicates
+#(same as looping the dictionary and checking each keyword in text)
+def match_labels(matcher, text):
+	labels = []
+	for idx in sorted(match_keywords(matcher, text)):
+		label = matcher['labels'][idx]
+		if label not in labels:
+			labels.append(label)
+	return labels
+#end match_labels
+
+#given an object and a list of text fields (each a list of nested keys), return the texts to search:
+#one per field, lowercased, with lists (ie tags) joined by spaces
+#stops at the first field the object doesn't have (later fields aren't searched)
+def search_texts(item, fields):
+	texts = []
+	for field in fields:
+		#grab desired text field
+		text = item
+		for subfield in field:
+			if subfield in text:
+				text = text[subfield]
+			else:
+				text = None
+				break
+
+		#skip if bad text (ie, skipping field)
+		if text is None:
+			break
+
+		#if text is a list (tags), make into a string
+		if isinstance(text, list):
+			text = ' '.join(text)
+		texts.append(text.lower())
+	return texts
+#end search_texts
+
+#given a keyword matcher and list of texts (from search_texts), return list of labels for keywords found
+#labels found in each text are added in keyword dictionary order, texts in order, without duplicates
+def match_text_labels(matcher, texts):
+	labels = []
+	found = set()		#same labels as the list, for fast membership checks
+	for text in texts:
+		for label in match_labels(matcher, text):
+			if label not in found:
+				found.add(label)
+				labels.append(label)
+	return labels
+#end match_text_labels
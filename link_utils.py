@@ -0,0 +1,212 @@
+#utility methods for linking tweets to the YouTube videos they reference
+#the videos are loaded once into a compact lookup table (sorted 64-bit video id hashes, and an interned
+#narrative label set for each), then the tweets are streamed in a single pass: YouTube video ids are pulled
+#out of each tweet's url entities and text, and a whole batch of candidate ids is joined against the table
+#with one vectorized binary search - memory only depends on the number of videos, not tweets
+#every match becomes an edge (tweet, video, both sides' narratives), written out as it's found, and the
+#edges are summed into per-narrative cross-platform spread counts
+
+import csv
+import re
+from collections import defaultdict
+
+import numpy as np
+
+import file_utils
+import index_utils
+
+#default fields: video id, tweet id, and the tweet fields to search for video links (any strings
+#anywhere inside these fields are searched, ie the expanded_url of every url entity)
+#the video id has to be the plain YouTube id, as written in the urls - the anonymized id_h is a hash of it,
+#and never matches a link
+VIDEO_ID_FIELD = ["id"]
+TWEET_ID_FIELD = ["id_h"]
+TWEET_LINK_FIELDS = [["entities", "urls"], ["text"]]
+
+#narrative labels of videos and tweets
+LABEL_FIELD = ["extension", "socialsim_information_id"]
+
+#YouTube video links: youtube.com/watch?v=ID (v= anywhere in the query), youtu.be/ID, and
+#youtube.com/embed|v|shorts|live/ID - ids that aren't in the video table are just not joined
+YOUTUBE_LINK_PATTERN = re.compile(r'(?:youtube\.com/(?:watch\?(?:\S*?&)?v=|embed/|v/|shorts/|live/)|youtu\.be/)([A-Za-z0-9_-]+)', re.IGNORECASE)
+
+#build the video lookup table from an iterable of video objects - returns dictionary of:
+#  keys:        sorted uint64 video id hashes
+#  label_sets:  label set id of each video (index into label_set_list)
+#  label_set_list: distinct narrative label sets (tuples), shared with the tweets side
+#  missing_ids: number of videos skipped for not having the id field
+#videos missing an id are skipped, repeated ids keep their first copy
+def build_video_table(videos, id_field=VIDEO_ID_FIELD):
+	label_set_ids = {}
+	keys = []
+	label_sets = []
+	missing_ids = 0
+	for video in videos:
+		video_id = file_utils.get_field(video, id_field)
+		if video_id is None:
+			missing_ids += 1
+			continue
+		labels = tuple(file_utils.get_field(video, LABEL_FIELD) or [""])
+		keys.append(index_utils.id_hash(video_id))
+		label_sets.append(label_set_ids.setdefault(labels, len(label_set_ids)))
+
+	keys = np.array(keys, dtype=np.uint64)
+	label_sets = np.array(label_sets, dtype=np.int32)
+	unique_keys, first = np.unique(keys, return_index=True)		#first copy of each id (np.unique returns first index)
+	label_set_list = [None] * len(label_set_ids)
+	for labels, label_set_id in label_set_ids.items():
+		label_set_list[label_set_id] = labels
+	return {"keys": unique_keys, "label_sets": label_sets[first], "label_set_ids": label_set_ids, "label_set_list": label_set_list, "missing_ids": missing_ids}
+#end build_video_table
+
+#YouTube video ids referenced anywhere in a value (string, or list/dict of them) - list, without repeats
+def extract_video_ids(value, found=None):
+	if found is None:
+		found = []
+	if isinstance(value, str):
+		for video_id in YOUTUBE_LINK_PATTERN.findall(value):
+			if video_id not in found:
+				found.append(video_id)
+	elif isinstance(value, list):
+		for item in value:
+			extract_video_ids(item, found)
+	elif isinstance(value, dict):
+		for item in value.values():
+			extract_video_ids(item, found)
+	return found
+#end extract_video_ids
+
+#table row of each video id hash in a batch (-1 if not in the table)
+def lookup_videos(video_table, hashes):
+	keys = video_table['keys']
+	if len(keys) == 0:
+		return np.full(len(hashes), -1, dtype=np.int64)
+	pos = np.minimum(np.searchsorted(keys, hashes), len(keys)-1)
+	return np.where(keys[pos] == hashes, pos, -1)
+#end lookup_videos
+
+#intern a tweet's label set into the video table's label set list (so both sides share ids)
+def label_set_id(video_table, labels):
+	labels = tuple(labels or [""])
+	label_set = video_table['label_set_ids'].get(labels)
+	if label_set is None:
+		label_set = video_table['label_set_ids'][labels] = len(video_table['label_set_list'])
+		video_table['label_set_list'].append(labels)
+	return label_set
+#end label_set_id
+
+#stream tweets (iterable, looped once) and join their YouTube links against the video table
+#for every tweet linking to at least one video in the table, yields (tweet id, tweet label set id, edges),
+#edges a list of (video id, video label set id, video table row) - label sets index into
+#video_table['label_set_list']
+#tweets are processed in batches of batch_size, with the id lookups for a whole batch done at once
+def link_tweets(tweets, video_table, tweet_id_field=TWEET_ID_FIELD, link_fields=TWEET_LINK_FIELDS, batch_size=100000):
+	for batch in file_utils.batched(tweets, batch_size):
+		#candidate video ids of every tweet in the batch
+		tweet_nums = []
+		video_ids = []
+		for i, tweet in enumerate(batch):
+			found = []
+			for field in link_fields:
+				extract_video_ids(file_utils.get_field(tweet, field), found)
+			tweet_nums.extend([i] * len(found))
+			video_ids.extend(found)
+		if not video_ids:
+			continue
+
+		#join the whole batch against the table
+		rows = lookup_videos(video_table, np.array([index_utils.id_hash(video_id) for video_id in video_ids], dtype=np.uint64))
+		matched = np.flatnonzero(rows >= 0).tolist()
+		video_sets = video_table['label_sets'][rows[matched]].tolist()
+
+		#group matches by tweet (candidates of a tweet are next to each other)
+		for j, k in enumerate(matched):
+			i = tweet_nums[k]
+			if j == 0 or tweet_nums[matched[j-1]] != i:
+				tweet = batch[i]
+				edges = []
+			edges.append((video_ids[k], video_sets[j], int(rows[k])))
+			if j == len(matched)-1 or tweet_nums[matched[j+1]] != i:
+				yield file_utils.get_field(tweet, tweet_id_field), label_set_id(video_table, file_utils.get_field(tweet, LABEL_FIELD)), edges
+#end link_tweets
+
+#new spread counts dictionary, for the video table
+#  linked:  which videos (table rows) were linked from at least one tweet
+#  links:   edges per (tweet label set, video label set) pair
+#  tweets:  linking tweets per (tweet label set, set of linked videos' label sets)
+def new_spread_counts(video_table):
+	return {"linked": np.zeros(len(video_table['keys']), dtype=bool), "links": defaultdict(int), "tweets": defaultdict(int)}
+#end new_spread_counts
+
+#add the edges of one tweet to the spread counts
+def add_tweet_edges(counts, tweet_set, edges):
+	for video_id, video_set, row in edges:
+		counts['linked'][row] = True
+		counts['links'][(tweet_set, video_set)] += 1
+	counts['tweets'][(tweet_set, frozenset(edge[1] for edge in edges))] += 1
+#end add_tweet_edges
+
+#stream the tweets, write every edge to a csv (tweet id, video id, both sides' narratives, '|' separated)
+#and count the per-narrative spread - returns spread counts (see new_spread_counts), the number of linking
+#tweets and the number of edges
+def link_and_count(tweets, video_table, edge_file, tweet_id_field=TWEET_ID_FIELD, link_fields=TWEET_LINK_FIELDS, batch_size=100000):
+	counts = new_spread_counts(video_table)
+	label_set_list = video_table['label_set_list']
+	num_tweets = num_edges = 0
+	with open(edge_file, 'w', newline='') as f:
+		writer = csv.writer(f)
+		writer.writerow(["tweet_id", "video_id", "tweet_narratives", "video_narratives"])
+		for tweet_id, tweet_set, edges in link_tweets(tweets, video_table, tweet_id_field, link_fields, batch_size):
+			for video_id, video_set, row in edges:
+				writer.writerow([tweet_id, video_id, "|".join(label_set_list[tweet_set]), "|".join(label_set_list[video_set])])
+			add_tweet_edges(counts, tweet_set, edges)
+			num_tweets += 1
+			num_edges += len(edges)
+	return counts, num_tweets, num_edges
+#end link_and_count
+
+#per-narrative spread from the counts, for labels (split=False) or components (split=True)
+#returns narrative -> {videos, linked_videos, links, linking_tweets, linking_tweets_same_narrative,
+#tweets_linking_out}:
+#  videos:        videos with the narrative, linked_videos: how many of them are linked from any tweet
+#  links:         tweet -> video edges to videos with the narrative
+#  linking_tweets: tweets linking to at least one video with the narrative (_same_narrative: and the
+#                 tweet has the narrative too)
+#  tweets_linking_out: tweets with the narrative that link to any video in the table
+def narrative_spread(video_table, counts, split=False):
+	label_set_list = video_table['label_set_list']
+	#narratives of each label set (labels, or their components), without the empty label
+	set_narratives = [set(comp for label in labels for comp in (label.split('-') if split else [label])) - set([""]) for labels in label_set_list]
+
+	spread = defaultdict(lambda: {"videos": 0, "linked_videos": 0, "links": 0, "linking_tweets": 0, "linking_tweets_same_narrative": 0, "tweets_linking_out": 0})
+	num_sets = len(label_set_list)
+	videos = np.bincount(video_table['label_sets'], minlength=num_sets).tolist()
+	linked = np.bincount(video_table['label_sets'][counts['linked']], minlength=num_sets).tolist()
+	for label_set, narratives in enumerate(set_narratives):
+		for narrative in narratives:
+			spread[narrative]['videos'] += videos[label_set]
+			spread[narrative]['linked_videos'] += linked[label_set]
+	for (tweet_set, video_set), count in counts['links'].items():
+		for narrative in set_narratives[video_set]:
+			spread[narrative]['links'] += count
+	for (tweet_set, video_sets), count in counts['tweets'].items():
+		video_narratives = set().union(*(set_narratives[video_set] for video_set in video_sets))
+		for narrative in video_narratives:
+			spread[narrative]['linking_tweets'] += count
+			if narrative in set_narratives[tweet_set]:
+				spread[narrative]['linking_tweets_same_narrative'] += count
+		for narrative in set_narratives[tweet_set]:
+			spread[narrative]['tweets_linking_out'] += count
+	return dict(spread)
+#end narrative_spread
+
+#save per-narrative spread (from narrative_spread) to csv, most linked first
+def save_narrative_spread(spread, name_field, filename):
+	fields = ["videos", "linked_videos", "links", "linking_tweets", "linking_tweets_same_narrative", "tweets_linking_out"]
+	rows = sorted(spread.items(), key=lambda item: (-item[1]['linking_tweets'], -item[1]['tweets_linking_out'], item[0]))
+	with open(filename, 'w', newline='') as f:
+		writer = csv.writer(f)
+		writer.writerow([name_field] + fields)
+		for name, stats in rows:
+			writer.writerow([name] + [stats[field] for field in fields])
+#end save_narrative_spread
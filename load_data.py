@@ -1,41 +1,191 @@
-#load raw Twitter + YouTube White Helmets data
+#load raw Twitter + YouTube White Helmets data, and analyse the narrative labels
+#run from the command line, ie:	python load_data.py freq
+#(see python load_data.py --help, and the README, for the other commands)
 
 import file_utils
+import keyword_utils
+import narrative_utils
+import dedup_utils
+import instrument_utils
 
 from collections import defaultdict
-
-#file locations
-
-#youtube originally from /data/socsim/2019DecCP/White_Helmet/YouTube/Tng_an_WH_Youtube.tar, but these are the unpacked files
-youtube_data_files = {
-					"captions": "./data/YouTube/Tng_an_Captions.json.gz", 
-					"channels": "./data/YouTube/Tng_an_Channels.json.gz", 
-					"comments": "./data/YouTube/Tng_an_Comments.json.gz", 
-					"comment_replies": "./data/YouTube/Tng_an_CommentReplies.json.gz", 
-					"videos": "./data/YouTube/Tng_an_Videos.json.gz"
-					}
-#twitter data directly from source
-twitter_data_files = {
-					"tweets": "/data/socsim/2019DecCP/White_Helmet/Twitter/Tng_an_WH_Twitter_v2.json.gz",
-					"retweet_chain": "/data/socsim/2019DecCP/White_Helmet/Twitter/Tng_an_Retweet_Chain_WH.json.gz",
-					"botometer_en": "/data/socsim/2019DecCP/White_Helmet/Twitter/Tng_an_en_Twitter_WH_botometer_results.json.gz",
-					"botometer_ar": "/data/socsim/2019DecCP/White_Helmet/Twitter/Tng_an_ar_Twitter_WH_botometer_results.json.gz"
-}
-
-#file containing mapping from search term -> narrative label component
-search_term_mapping_file = "./data/search_term_mapping.csv"
+import argparse
+import json
+import multiprocessing
+import os
+
+#default config file: data file locations for each platform, search term mapping, output directories
+DEFAULT_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config", "white_helmets.json")
+
+#the only fields the narrative frequency analysis needs - when streaming, or in parallel mode,
+#everything else in each object is skipped while parsing
+narrative_fields = [["extension", "socialsim_information_id"]]
+
+#fields to keep in the parquet cache (one column each)
+cache_fields = [["id_h"], ["extension", "socialsim_information_id"], ["snippet", "title_m"], ["snippet", "description_m"], ["snippet", "tags"], ["text"]]
+
+#text fields to search for narrative keywords, if not given in the config
+keyword_fields = [["snippet", "title_m"], ["snippet", "description_m"], ["snippet", "tags"]]
+
+
+#load the run config (json file), and fill in defaults for anything missing
+#platforms: platform -> data type -> filename (relative paths are from the current directory)
+#search_term_mapping: csv of search term -> narrative label component
+#results_dir: where to save results, cache_dir: parquet cache and record stores, index_dir: id and text indexes
+#rollup_store: sqlite file of time-bucketed counts, timestamp_fields: platform -> timestamp field (see rollup_utils)
+#cascades: which platform/datatypes hold the retweet chain and the tweets, and the chain's id fields
+#bots: botometer datatypes and score fields, user id fields, overlap resolution and score bands (see bot_utils)
+#keyword_search: default platform/datatype/fields for the keywords command
+#text_fields: platform -> datatype -> text fields to search/index (keyword_search fields if not listed)
+#sketch: account field of each platform/datatype, and error bounds, for freq --sketch (see sketch_utils)
+#linkage: tweet and video datatypes, their id fields, and the tweet fields holding video links (see link_utils)
+def load_config(filename):
+	config = file_utils.load_json(filename)
+	config.setdefault("search_term_mapping", "./data/search_term_mapping.csv")
+	config.setdefault("results_dir", "results")
+	config.setdefault("cache_dir", "./data/cache")
+	config.setdefault("index_dir", "./data/index")
+	config.setdefault("rollup_store", "./data/rollup.sqlite")
+	config.setdefault("timestamp_fields", {})
+	config.setdefault("cascades", {})
+	config['cascades'].setdefault("platform", "Twitter")
+	config['cascades'].setdefault("chain_datatype", "retweet_chain")
+	config['cascades'].setdefault("tweets_datatype", "tweets")
+	config['cascades'].setdefault("child_field", ["tweet_id_h"])
+	config['cascades'].setdefault("parent_field", ["retweeted_from_tweet_id_h"])
+	config.setdefault("bots", {})
+	config['bots'].setdefault("platform", "Twitter")
+	config['bots'].setdefault("tweets_datatype", "tweets")
+	config['bots'].setdefault("score_files", [["botometer_en", ["scores", "english"]], ["botometer_ar", ["scores", "universal"]]])
+	config['bots'].setdefault("user_field", ["user", "id_str_h"])
+	config['bots'].setdefault("tweet_user_field", ["user", "id_str_h"])
+	config['bots'].setdefault("resolve", "max")
+	config['bots'].setdefault("band_edges", [0.0, 0.2, 0.4, 0.6, 0.8, 1.0])
+	config.setdefault("keyword_search", {})
+	config['keyword_search'].setdefault("platform", "YouTube")
+	config['keyword_search'].setdefault("datatype", "videos")
+	config['keyword_search'].setdefault("fields", keyword_fields)
+	config.setdefault("text_fields", {})
+	config.setdefault("sketch", {})
+	config['sketch'].setdefault("account_fields", {"YouTube": {"videos": ["snippet", "channelId_h"]}, "Twitter": {"tweets": ["user", "id_str_h"]}})
+	config['sketch'].setdefault("distinct_error", 0.01)
+	config['sketch'].setdefault("top_error", 0.001)
+	config['sketch'].setdefault("top_confidence", 0.99)
+	config['sketch'].setdefault("top_k", 10)
+	config.setdefault("linkage", {})
+	config['linkage'].setdefault("tweet_platform", "Twitter")
+	config['linkage'].setdefault("tweets_datatype", "tweets")
+	config['linkage'].setdefault("video_platform", "YouTube")
+	config['linkage'].setdefault("videos_datatype", "videos")
+	config['linkage'].setdefault("tweet_id_field", ["id_h"])
+	config['linkage'].setdefault("video_id_field", ["id"])
+	config['linkage'].setdefault("link_fields", [["entities", "urls"], ["text"]])
+	return config
+#end load_config
+
+#True if data is a record store (see store_utils) - store_utils needs numpy, so it's only imported for dictionaries
+def is_record_store(data):
+	if not isinstance(data, dict):
+		return False
+	import store_utils
+	return store_utils.is_record_store(data)
+#end is_record_store
+
+#text fields searched for a platform and datatype, by the keywords and textindex commands
+def get_text_fields(config, platform, datatype):
+	return config['text_fields'].get(platform, {}).get(datatype, config['keyword_search']['fields'])
+#end get_text_fields
+
+#account sketch parameters of each datatype of a platform (datatype -> sketch_utils.new_sketch args),
+#for the datatypes with an account field in the config
+def get_sketch_params(config, platform):
+	sketch = config['sketch']
+	bounds = {key: sketch[key] for key in ["distinct_error", "top_error", "top_confidence", "top_k"]}
+	return {datatype: dict(bounds, account_field=field) for datatype, field in sketch['account_fields'].get(platform, {}).items()}
+#end get_sketch_params
+
+#directory of the text index for a platform and datatype
+def text_index_dir(config, platform, datatype):
+	return os.path.join(config['index_dir'], "%s_%s_text" % (platform.lower(), datatype))
+#end text_index_dir
+
+#given the config and optional platform/datatype filters (lists, empty for all), return
+#list of (platform, datatype, filename) for the selected data files
+def select_files(config, platforms=None, datatypes=None):
+	selected = []
+	for platform, type_to_files in config['platforms'].items():
+		if platforms and platform not in platforms:
+			continue
+		for datatype, file in type_to_files.items():
+			if datatypes and datatype not in datatypes:
+				continue
+			selected.append((platform, datatype, file))
+	return selected
+#end select_files
 
 
 #given a dictionary of data type -> filename, load domain data
-def load_domain_data(type_to_files):
+#if stream is True, each datatype gets a generator instead of a list - objects are only read
+#from file as they are consumed, so each generator can only be looped once
+#if a list of fields is given (each a list of nested keys), only load those fields of each object
+#if cache_dir is given, each datatype gets a pyarrow table of the fields instead (loaded through parquet cache)
+#or, if cache_format is "store", a record store of the fields (see store_utils, memory mapped from cache_dir)
+#if dedup is "memory" or "disk", objects with a repeated id_h are dropped (first copy kept, see dedup_utils)
+#and stats for each datatype are added to dedup_report (dictionary of datatype -> report, if given)
+#in stream mode, the reports are only complete once the data has been looped
+#if load_stats is given (dictionary), read/parse timings and counts for each datatype are added to it
+#(see file_utils.stream_zipped_multi_json) - same as dedup_report, only complete once data is looped
+def load_domain_data(type_to_files, stream=False, fields=None, cache_dir=None, dedup=None, check_content=False, dedup_report=None, load_stats=None, cache_format="parquet"):
 	#load data into dictionary, where key is datatype as given in filename dict
 	data_dict = {}
+	if dedup_report is None:
+		dedup_report = {}
 
 	#load the data
 	for datatype, file in type_to_files.items():
+		if dedup is not None:
+			dedup_report[datatype] = dedup_utils.new_dedup_report(dedup, check_content)
+			dedup_report[datatype]['file'] = file
+
+		if cache_dir is not None and cache_format == "store":
+			import store_utils		#needs numpy, so only imported here
+			print("Loading", datatype, "from", file, "(record store)")
+			data_dict[datatype] = store_utils.load_cached_record_store(file, fields, cache_dir)
+			if dedup is not None:
+				data_dict[datatype] = dedup_utils.dedup_store(data_dict[datatype], report=dedup_report[datatype])
+			print("   Loaded", data_dict[datatype]['num_records'], "objects")
+			continue
+
+		if cache_dir is not None:
+			print("Loading", datatype, "from", file, "(cached)")
+			data_dict[datatype] = file_utils.load_cached_zipped_multi_json(file, fields, cache_dir)
+			if dedup is not None:
+				data_dict[datatype] = dedup_utils.dedup_table(data_dict[datatype], report=dedup_report[datatype])
+			print("   Loaded", data_dict[datatype].num_rows, "objects")
+			continue
+
+		#stream objects from file, through dedup if needed
+		stats = None
+		if load_stats is not None:
+			stats = load_stats[datatype] = {}
+		if dedup == "disk":
+			data = dedup_utils.dedup_records_on_disk(lambda file=file, stats=stats: file_utils.stream_zipped_multi_json(file, fields, stats), check_content=check_content, report=dedup_report[datatype])
+		elif dedup is not None:
+			data = dedup_utils.dedup_records(file_utils.stream_zipped_multi_json(file, fields, stats), check_content=check_content, report=dedup_report[datatype])
+		else:
+			data = file_utils.stream_zipped_multi_json(file, fields, stats)
+
+		if stream:
+			print("Streaming", datatype, "from", file)
+			data_dict[datatype] = data
+			continue
 		print("Loading", datatype, "from", file)
-		data_dict[datatype] = file_utils.load_zipped_multi_json(file)
+		data_dict[datatype] = list(data)
 		print("   Loaded", len(data_dict[datatype]), "objects")		
+		if dedup is not None:
+			print("   Removed", dedup_report[datatype]['duplicate_records'], "duplicates")
+			if dedup_report[datatype]['no_id']:
+				print("   Kept", dedup_report[datatype]['no_id'], "objects without an id")
 
 	#return data in dictionary, with same format as filename input
 	return data_dict
@@ -43,48 +193,81 @@ def load_domain_data(type_to_files):
 
 
 #given a loaded data collection (of a single type), do some narrative label analysis
-def narrative_analysis(data, datatype=""):
+#data can be a list or any iterable of objects (ie, a streaming generator) - only looped once
+#or a pyarrow table from the parquet cache (see table_narrative_analysis)
+#or a record store (see store_narrative_analysis)
+#if sketch_params is given (sketch_utils.new_sketch args), also sketch the distinct accounts and top
+#accounts of each label/component - added to the result as 'sketch'
+def narrative_analysis(data, datatype="", sketch_params=None):
 	#narrative labels live in the ['extension']['socialsim_information_id'] field
 	#list of strings, if no label contains ''
 
+	#columnar data, count with vectorized operations instead
+	if hasattr(data, "column_names") or is_record_store(data):
+		if sketch_params is not None:
+			raise ValueError("account sketches need the data objects, not a parquet cache table or record store")
+		if is_record_store(data):
+			return store_narrative_analysis(data, datatype)
+		return table_narrative_analysis(data, datatype)
+
+	sketch = None
+	if sketch_params is not None:
+		import sketch_utils		#needs numpy, so only imported here
+		sketch = sketch_utils.new_sketch(**sketch_params)
+		account_field = sketch_params['account_field']
+
 	print(datatype)
-	print("  ", len(data), "objects")
 
+	#count objects as we go, since we can't take len of a generator
+	data = iter(data)
+	obj_count = 0
 	#how many objects don't have a narrative assigned?
 	no_label = 0
-	#how many unique narrative labels?
-	label_counts = defaultdict(int)
-	#how many unique label components? (ie, many components to a single narrative label)
-	comp_counts = defaultdict(int)
-	#loop all data objects
-	for item in data:
+	#labels/components interned to column ids, and running column sums of the object x label/component
+	#matrices (frequency of each label, and of each label component)
+	label_dict = narrative_utils.new_label_dict()
+	label_sums = None
+	comp_sums = None
+	#loop all data objects, encoding a batch at a time into sparse matrices (see narrative_utils)
+	for batch in file_utils.batched(data, narrative_utils.ENCODE_BATCH):
+		obj_count += len(batch)
 		#skip if these items don't have extensions
-		if 'extension' not in item:
+		if any('extension' not in item for item in batch):
 			no_label = -1
 			break
-		#count items with no narrative label
-		if item['extension']['socialsim_information_id'][0] == "" or item['extension']['socialsim_information_id'][0] == '':
-			no_label += 1
-		#add to counter for each narrative label
-		for label in item['extension']['socialsim_information_id']:
-			label_counts[label] += 1
-			#and break that down into individual components
-			for comp in label.split('-'):
-				comp_counts[comp] += 1
-
-	#no narrative labels for these objects - return
+		label_lists = [item['extension']['socialsim_information_id'] for item in batch]
+		encoded = narrative_utils.encode_label_lists(label_lists, label_dict)
+		#count items with no narrative label, and add up the label/component columns
+		no_label += encoded['unlabeled_count']
+		label_sums = narrative_utils.add_column_sums(label_sums, encoded['labels'])
+		comp_sums = narrative_utils.add_column_sums(comp_sums, encoded['comps'])
+		#and add to the account sketches
+		if sketch is not None:
+			for item, labels in zip(batch, label_lists):
+				sketch_utils.add_object(sketch, file_utils.get_field(item, account_field), labels)
+
+	#no narrative labels for these objects - count the rest and return
 	if no_label == -1:
+		obj_count += sum(1 for item in data)
+		print("  ", obj_count, "objects")
 		print("   No narrative labels for", datatype)
-		return {"unlabeled_count": len(data), "label_freq": {}, "comp_freq": {}}
+		res = {"unlabeled_count": obj_count, "label_freq": {}, "comp_freq": {}}
+		if sketch is not None:
+			res['sketch'] = sketch
+		return res
+	print("  ", obj_count, "objects")
 
-	#remove empty label from frequency counts
-	del label_counts['']
-	del comp_counts['']
+	#label/component frequencies from the column sums
+	label_counts = defaultdict(int, narrative_utils.column_freq(label_sums, label_dict['labels']))
+	comp_counts = defaultdict(int, narrative_utils.column_freq(comp_sums, label_dict['comps']))
+
+	#remove empty component from frequency counts (from labels like "a-")
+	comp_counts.pop('', None)
 
 	#print results
 
 	#count of objects with label
-	print("   %d objects with narrative (%.3f)" % (len(data)-no_label, (len(data)-no_label)/len(data)))
+	print("   %d objects with narrative (%.3f)" % (obj_count-no_label, (obj_count-no_label)/obj_count))
 
 	#overall counts, across all objects of this type
 	print("  ", len(label_counts), "unique labels")
@@ -99,12 +282,85 @@ def narrative_analysis(data, datatype=""):
 	'''
 
 	#return counts and such
-	return {"unlabeled_count": no_label, "label_freq": label_counts, "comp_freq": comp_counts}
+	res = {"unlabeled_count": no_label, "label_freq": label_counts, "comp_freq": comp_counts}
+	if sketch is not None:
+		sketch_utils.flush(sketch)
+		res['sketch'] = sketch
+	return res
 #end narrative_analysis
 
 
+#same as narrative_analysis, but for a pyarrow table with the narrative labels in a list<string> column
+#(as loaded by file_utils.load_cached_zipped_multi_json) - all counting done by arrow compute kernels
+def table_narrative_analysis(table, datatype="", label_col="extension.socialsim_information_id"):
+	import pyarrow.compute as pc
+
+	print(datatype)
+	obj_count = table.num_rows
+	print("  ", obj_count, "objects")
+
+	#no narrative labels for these objects - return
+	if label_col not in table.column_names or table[label_col].null_count == obj_count:
+		print("   No narrative labels for", datatype)
+		return {"unlabeled_count": obj_count, "label_freq": {}, "comp_freq": {}}
+	labels = table[label_col]
+
+	#count items with no narrative label (first label is empty)
+	no_label = pc.sum(pc.equal(pc.list_element(labels, 0), "")).as_py() or 0
+
+	#frequency of each narrative label, and of each component (split labels on '-')
+	all_labels = pc.list_flatten(labels)
+	label_counts = defaultdict(int, {row['values']: row['counts'] for row in pc.value_counts(all_labels).to_pylist()})
+	all_comps = pc.list_flatten(pc.split_pattern(all_labels, "-"))
+	comp_counts = defaultdict(int, {row['values']: row['counts'] for row in pc.value_counts(all_comps).to_pylist()})
+
+	#remove empty label from frequency counts
+	label_counts.pop('', None)
+	comp_counts.pop('', None)
+
+	#print results
+	print("   %d objects with narrative (%.3f)" % (obj_count-no_label, (obj_count-no_label)/obj_count))
+	print("  ", len(label_counts), "unique labels")
+	print("  ", len(comp_counts), "unique narrative components")
+
+	return {"unlabeled_count": no_label, "label_freq": label_counts, "comp_freq": comp_counts}
+#end table_narrative_analysis
+
+
+#same as narrative_analysis, but for a record store (see store_utils) - labels are already interned to
+#integer ids, so the object x label matrix is built straight from the store's label arrays
+def store_narrative_analysis(store, datatype=""):
+	print(datatype)
+	obj_count = store['num_records']
+	print("  ", obj_count, "objects")
+
+	#no narrative labels for (some of) these objects - same as narrative_analysis, count them all as unlabeled
+	if store['missing_labels'] > 0:
+		print("   No narrative labels for", datatype)
+		return {"unlabeled_count": obj_count, "label_freq": {}, "comp_freq": {}}
+
+	#count items with no narrative label (first label is empty), and the frequency of each label/component
+	label_dict = narrative_utils.new_label_dict()
+	freq = narrative_utils.encoded_narrative_freq(narrative_utils.encode_interned(store['label_ids'], store['label_offsets'], store['labels'], label_dict), label_dict)
+	no_label = freq['unlabeled_count']
+	label_counts = defaultdict(int, freq['label_freq'])
+	comp_counts = defaultdict(int, freq['comp_freq'])
+
+	#remove empty component from frequency counts (from labels like "a-")
+	comp_counts.pop('', None)
+
+	#print results
+	print("   %d objects with narrative (%.3f)" % (obj_count-no_label, (obj_count-no_label)/obj_count))
+	print("  ", len(label_counts), "unique labels")
+	print("  ", len(comp_counts), "unique narrative components")
+
+	return {"unlabeled_count": no_label, "label_freq": label_counts, "comp_freq": comp_counts}
+#end store_narrative_analysis
+
+
 #perform narrative label analysis on all data for an entire platform (across all data types)
-def platform_narrative_analysis(data, platform=""):
+#sketch_params: datatype -> account sketch parameters, for the datatypes to sketch (see narrative_analysis)
+def platform_narrative_analysis(data, platform="", sketch_params=None):
 	narr_res = {}		#counts for each datatype
 	#how many unique labels/components, across all data objects?
 	uniq_labels = set()
@@ -112,7 +368,7 @@ def platform_narrative_analysis(data, platform=""):
 
 	print("\n%snarrative analysis" % (platform+" " if platform != "" else ""))
 	for datatype, data in data.items():
-		narr_res[datatype] = narrative_analysis(data, datatype)
+		narr_res[datatype] = narrative_analysis(data, datatype, (sketch_params or {}).get(datatype))
 		uniq_labels = uniq_labels.union(set(narr_res[datatype]['label_freq'].keys()))
 		uniq_comps = uniq_comps.union(set(narr_res[datatype]['comp_freq'].keys()))
 	print(len(uniq_labels), "unique labels and", len(uniq_comps), "unique components overall")
@@ -122,69 +378,139 @@ def platform_narrative_analysis(data, platform=""):
 #end platform_narrative_analysis
 
 
+#combine two narrative_analysis results for the same datatype (ie, from different parts of the same file)
+def merge_narrative_results(res_a, res_b):
+	label_freq = defaultdict(int, res_a['label_freq'])
+	comp_freq = defaultdict(int, res_a['comp_freq'])
+	for label, count in res_b['label_freq'].items():
+		label_freq[label] += count
+	for comp, count in res_b['comp_freq'].items():
+		comp_freq[comp] += count
+	res = {"unlabeled_count": res_a['unlabeled_count'] + res_b['unlabeled_count'], "label_freq": label_freq, "comp_freq": comp_freq}
+	if 'sketch' in res_a:
+		import sketch_utils
+		res['sketch'] = sketch_utils.merge_sketches(res_a['sketch'], res_b['sketch'])
+	return res
+#end merge_narrative_results
+
+
+#worker for the parallel analysis: stream a single datatype file and return only its frequencies
+#if start and end are given, only analyse that (indexed) byte range of the file
+#if sketch_params is given, also sketch the accounts (see narrative_analysis)
+def file_narrative_analysis(datatype, file, start=None, end=None, sketch_params=None):
+	fields = narrative_fields + ([sketch_params['account_field']] if sketch_params is not None else [])
+	if start is None:
+		return narrative_analysis(file_utils.stream_zipped_multi_json(file, fields), datatype, sketch_params)
+	return narrative_analysis(file_utils.stream_zipped_multi_json_range(file, start, end, fields), "%s (bytes %d-%d)" % (datatype, start, end), sketch_params)
+#end file_narrative_analysis
+
+
+#parallel version of load_domain_data + platform_narrative_analysis, for multiple platforms at once
+#given dictionary of platform -> (data type -> filename), load and analyse each file in a separate process
+#if chunk_size is given, files bigger than that are also split into ranges of about chunk_size
+#decompressed bytes (using a gzip seek index, built on first use), with one process per range
+#returns dictionary of platform -> (narr_res, uniq_labels, uniq_comps), same as platform_narrative_analysis
+#if shard is given as (i, n), only every n'th file/range (starting from i) is analysed - so n machines can
+#split the data, and their partial results be merged (see partial_utils)
+#if sources is given (list), the (platform, datatype, file, start, end) of each file/range analysed is added to it
+#if file_lengths is given (dictionary), the decompressed length of each file split into ranges is added to it
+#(whether or not this shard analyses the last range)
+#sketch_params: platform -> datatype -> account sketch parameters, for the datatypes to sketch
+def parallel_narrative_analysis(platform_files, processes=None, chunk_size=None, shard=None, sources=None, sketch_params=None, file_lengths=None):
+	#flat list of jobs, one per file (or file range)
+	jobs = []
+	for platform, type_to_files in platform_files.items():
+		for datatype, file in type_to_files.items():
+			#(files inside a tar can't be split, no seek index)
+			if chunk_size is not None and file_utils.split_tar_member(file)[1] is None and os.path.getsize(file) > chunk_size:
+				ranges = file_utils.gzip_line_ranges(file, chunk_size)
+				for start, end in ranges:
+					jobs.append((platform, datatype, file, start, end))
+				if file_lengths is not None and ranges:
+					file_lengths[file] = ranges[-1][1]
+			else:
+				jobs.append((platform, datatype, file, None, None))
+	if shard is not None:
+		jobs = jobs[shard[0]::shard[1]]
+	if sources is not None:
+		sources.extend(jobs)
+	if processes is None:
+		processes = max(1, min(len(jobs), multiprocessing.cpu_count()))
+
+	#run the workers (results come back in job order, regardless of which finishes first)
+	with multiprocessing.Pool(processes) as pool:
+		job_res = pool.starmap(file_narrative_analysis, [job[1:] + ((sketch_params or {}).get(job[0], {}).get(job[1]),) for job in jobs])
+
+	#merge worker results into per-platform results
+	platform_res = {platform: ({}, set(), set()) for platform in platform_files}
+	for (platform, datatype, file, start, end), res in zip(jobs, job_res):
+		narr_res, uniq_labels, uniq_comps = platform_res[platform]
+		if datatype in narr_res:
+			res = merge_narrative_results(narr_res[datatype], res)
+		narr_res[datatype] = res
+		uniq_labels.update(res['label_freq'].keys())
+		uniq_comps.update(res['comp_freq'].keys())
+	for platform, (narr_res, uniq_labels, uniq_comps) in platform_res.items():
+		print("%s%d unique labels and %d unique components overall" % (platform+": " if platform != "" else "", len(uniq_labels), len(uniq_comps)))
+
+	return platform_res
+#end parallel_narrative_analysis
+
+
 #search data for narrative keywords
 #only search the list of fields given as argument (for flexibility)
 #each field will itself be a list, where subsequent entries are nested below the previous
 #skip any fields that don't exist (because some are optional, ugh)
-def search_narrative_keywords(data, fields, keywords_dict):
+#keywords are matched with a single pass per text (see keyword_utils) - pass a prebuilt matcher from
+#keyword_utils.build_keyword_matcher to reuse it across calls, otherwise one is built from keywords_dict
+#if word_boundary is True, keywords only match whole words (only used when building the matcher here)
+#data can also be a record store (see store_utils) holding the fields
+def search_narrative_keywords(data, fields, keywords_dict, word_boundary=False, matcher=None):
+	if matcher is None:
+		matcher = keyword_utils.build_keyword_matcher(keywords_dict, word_boundary)
+
 	#store item narratives in nested dict
 	#id_h -> given-> given narrative label
 	#id_h -> inferred -> inferred narrative label, based on keywords
 	item_narratives = {}	 
 
+	#record store: ids, labels and texts come straight from its buffers
+	if is_record_store(data):
+		import store_utils
+		for record_id, labels, texts in zip(store_utils.iter_batched(data, store_utils.store_ids), store_utils.iter_batched(data, store_utils.store_labels), store_utils.store_search_texts(data, fields)):
+			item_narratives[record_id] = {'inferred': keyword_utils.match_text_labels(matcher, texts)}
+			item_narratives[record_id]['given'] = labels if labels and labels[0] != '' else []
+		return item_narratives
+
 	#loop each object
 	for item in data:
 		#pull given narrative label
 		item_narratives[item['id_h']] = {'inferred': []}
 		item_narratives[item['id_h']]['given'] = item['extension']['socialsim_information_id'] if item['extension']['socialsim_information_id'][0] != '' else []
 
-		#search each field
-		for field in fields:
-			#grab desired text field
-			text = item
-			for subfield in field:
-				if subfield in text:
-					text = text[subfield]
-				else:
-					text = None
-					break
-
-			#skip if bad text (ie, skipping field)
-			if text is None: break
-
-			#if text is a list (tags), make into a string
-			if isinstance(text, list):
-				text = ' '.join(text)
-
-			#convert text to all lowercase
-			text = text.lower()
-
-			#print(field[-1], "text:", text)
-
-			#look for all keywords in this text
-			for keyword, label in keywords_dict.items():
-				if keyword in text and label not in item_narratives[item['id_h']]['inferred']:
-					item_narratives[item['id_h']]['inferred'].append(label)
-					#print("\0u' %s ' in %s -> %s" % (keyword, field[-1], label))
-
-		#print("given", item_narratives[item['id_h']]['given'])
-		#print("inferred", item_narratives[item['id_h']]['inferred'])
+		#search each field (lowercased), looking for all keywords in each one
+		item_narratives[item['id_h']]['inferred'] = keyword_utils.match_text_labels(matcher, keyword_utils.search_texts(item, fields))
 
 	return item_narratives		#return dictionary
 #end search_narrative_keywords
 
 
 #given assigned narrative labels, break into set of components present in any narrative label
-def narratives_to_comp(all_narrative_dict):
+#labels are split through a label dictionary (see narrative_utils), so each distinct label is only split once
+#pass a shared label_dict to reuse it across calls
+def narratives_to_comp(all_narrative_dict, label_dict=None):
+	if label_dict is None:
+		label_dict = narrative_utils.new_label_dict()
 	#loop all objects
 	for obj_id, narrative_dict in all_narrative_dict.items():
 		#new dict entry for list of given components
 		narrative_dict['given_comp'] = []
-		#loop each narrative label
+		given_comp = set()
+		#loop each narrative label, and add its (cached) components
 		for label in narrative_dict['given']:
-			#and split
-			for comp in label.split('-'):
-				if comp not in narrative_dict['given_comp']:
+			for comp in narrative_utils.label_components(label_dict, label):
+				if comp not in given_comp:
+					given_comp.add(comp)
 					narrative_dict['given_comp'].append(comp)
 	#return updated dict
 	return all_narrative_dict
@@ -228,105 +554,463 @@ def save_narrative_freq(narr_dict, labels, components, filename):
 
 
 
-#----- MAIN EXECUTION -----#
-
-print("")
-
-#load search term -> narrative component mapping
-search_term_dict = file_utils.read_csv_dict(search_term_mapping_file)
-
-print(len(search_term_dict), "search keywords")
-#print(list(search_term_dict.keys()))
-
-
-#load the youtube data
-print("\nLoading YouTube data")
-youtube_data = load_domain_data(youtube_data_files)
-
-#and the Twitter
-print("\nLoading Twitter data")
-twitter_data = load_domain_data(twitter_data_files)
-
-#narrative analysis
-#YouTube
-youtube_narr_res, youtube_labels, youtube_comps = platform_narrative_analysis(youtube_data, "YouTube")
-#Twitter
-#narrative analysis
-twitter_narr_res, twitter_labels, twitter_comps = platform_narrative_analysis(twitter_data, "Twitter")
-
-#combine into single list of labels and components
-all_labels = youtube_labels.union(twitter_labels)
-all_comps = youtube_comps.union(twitter_comps)
-print("\n%d labels, %d components across both platforms" % (len(all_labels), len(all_comps)))
-
-#save frequencies to files (4 separate for now, can't be bothered to combine further)
-save_narrative_freq(youtube_narr_res, all_labels, all_comps, "results/youtube_freq")
-save_narrative_freq(twitter_narr_res, all_labels, all_comps, "results/twitter_freq")
-
-
-
-exit(0)
-
-#does the video title/description/tags lead to the same narrative labels?
-#videos_narrative_dict = search_narrative_keywords(youtube_data['videos'], [["snippet","title_m"], ["snippet","description_m"], ["snippet","tags"]], search_term_dict)
-'''
-print("\nvideos with given narrative, vs inferred")
-for video_id, narrative_dict in videos_narrative_dict.items():
-	if len(narrative_dict['given']) > 0:
-		print(video_id, narrative_dict['given'], narrative_dict['inferred'])
-'''
-
-#convert given/assigned narrative labels to list of components - for easier comparison against inferred
-#videos_narrative_dict = narratives_to_comp(videos_narrative_dict)
-'''
-print("\nvideos with given narrative components, vs inferred")
-for video_id, narrative_dict in videos_narrative_dict.items():
-	if len(narrative_dict['given_comp']) > 0:
-		print(video_id, narrative_dict['given_comp'], narrative_dict['inferred'])
-'''
-
-'''
-#which given components did we not find?
-print("\nvideos and narrative components not found via keywords")
-missing_comp_count = 0	#count of videos with missing components
-for video_id, narrative_dict in videos_narrative_dict.items():
-	vid_count = 0
-	for comp in narrative_dict['given_comp']:
-		if comp not in narrative_dict['inferred']:
-			if vid_count == 0: print(video_id, ":", end=" ")
-			print(comp, end=" ")
-			vid_count += 1
-	if vid_count != 0: 
-		print("")
-		missing_comp_count += 1
-print(missing_comp_count, "videos missing given components (of", len(youtube_data['videos']) - youtube_narr_res['videos']['unlabeled_count'], "labelled)")
-
-#single video - how are we missing keywords?
-
-print("")
-vid_id = "0FPAb4yCjI1Jfyzy_YyYiA"
-for video in youtube_data['videos']:
-	if video['id_h'] == vid_id:
-		print("title:", video['snippet']['title_m'])
-		print("description:", video['snippet']['description_m'])
-print("")
-print(videos_narrative_dict[vid_id])
-
-exit(0)
-
-#are there duplicate videos in the dataset?
-print("")
-print(len(youtube_data['videos']), "videos in list")
-print(len(set(video['id_h'] for video in youtube_data['videos'])), "videos in set")
-
-#who are the duplicates, and are they the same?
-#list of ids in list
-id_list = [video['id_h'] for video in youtube_data['videos']]
-#duplicate ids
-id_duplicates = set([x for x in id_list if id_list.count(x) > 1])
-print(len(id_duplicates), "duplicates:", id_duplicates)
-
-exit(0)
-'''
-
-
+#----- COMMANDS -----#
+
+#freq: narrative label/component frequencies for every platform and datatype in the config,
+#saved to <results_dir>/<platform>_freq_narrative_labels.csv and _narrative_components.csv
+def run_freq(args, config):
+	results_dir = config['results_dir']
+	platforms = config['platforms']
+	sketch_params = {platform: get_sketch_params(config, platform) for platform in platforms} if args.sketch else {}
+
+	#record time/memory for each stage of the run
+	instrument_utils.start_run(args.profile, args.trace_memory, os.path.join(results_dir, "profiles"))
+
+	sources = []		#files (or file ranges) analysed, for partial results
+	file_lengths = {}		#decompressed length of the files split into ranges, for partial results
+	if args.parallel or args.shard is not None:
+		#load and analyse every datatype file of all platforms at once, one process per file (or file range)
+		print("\nLoading and analysing %s data in parallel" % " and ".join(platforms))
+		chunk_size = args.chunk_size*1024*1024 if args.chunk_size else None
+		with instrument_utils.stage("parallel_analyse"):
+			platform_res = parallel_narrative_analysis(platforms, args.processes, chunk_size, args.shard, sources, sketch_params, file_lengths)
+
+	else:
+		#which fields to load - dedup also needs the ids (or whole objects, to compare duplicate copies)
+		cache_dir = config['cache_dir'] if args.cache or args.store else None
+		if cache_dir is not None:
+			load_fields = cache_fields
+		elif not args.stream or (args.dedup is not None and args.check_content):
+			load_fields = None
+		else:
+			load_fields = narrative_fields + ([["id_h"]] if args.dedup is not None else [])
+			#plus account fields for the sketches (fields missing from an object are skipped)
+			for params in sketch_params.values():
+				load_fields += [p['account_field'] for p in params.values() if p['account_field'] not in load_fields]
+
+		dedup_report = {}
+		#read/parse stats for each file, with --load-stats (when streaming, reads happen during the analysis stage)
+		load_stats = {platform: {} for platform in platforms} if args.load_stats else {}
+		platform_res = {}
+		for platform, type_to_files in platforms.items():
+			dedup_report[platform] = {}
+			sources.extend((platform, datatype, file, None, None) for datatype, file in type_to_files.items())
+
+			#load the data
+			print("\nLoading %s data" % platform)
+			with instrument_utils.stage("load", platform=platform, streaming=args.stream):
+				data = load_domain_data(type_to_files, args.stream, load_fields, cache_dir, args.dedup, args.check_content, dedup_report[platform], load_stats.get(platform), "store" if args.store else "parquet")
+
+			#narrative analysis
+			with instrument_utils.stage("analyse", platform=platform) as rec:
+				platform_res[platform] = platform_narrative_analysis(data, platform, sketch_params.get(platform))
+				if load_stats.get(platform):
+					rec['files'] = load_stats[platform]
+					rec['records'] = sum(stats['records'] for stats in load_stats[platform].values())
+				elif cache_dir is not None or not args.stream:		#(can't count a stream without the stats)
+					rec['records'] = sum(table['num_records'] if is_record_store(table) else len(table) for table in data.values())
+			del data
+
+		#save dedup stats (only complete after the analysis, if streaming)
+		if args.dedup is not None:
+			dedup_report_file = os.path.join(results_dir, "dedup_report.json")
+			file_utils.save_json(dedup_report, dedup_report_file)
+			print("\nDedup report saved to", dedup_report_file)
+
+	with instrument_utils.stage("write"):
+		if args.partial is not None:
+			#save partial result instead, to be combined with the other shards by the reduce command
+			import partial_utils
+			partial_utils.save_partial(partial_utils.make_partial(platform_res, sources, file_lengths), args.partial)
+			print("Partial result saved to", args.partial)
+		else:
+			save_platform_freq(platform_res, results_dir)
+
+	#save timing/memory report
+	run_report_file = os.path.join(results_dir, "run_report.json")
+	instrument_utils.save_run_report(run_report_file)
+	print("Run report saved to", run_report_file)
+#end run_freq
+
+#save frequencies of platform results (platform -> (narr_res, uniq_labels, uniq_comps)) to files, separate
+#files for each platform - labels/components are combined across all platforms, and sorted
+#account sketch results (freq --sketch) are saved next to them, for the datatypes that have them
+def save_platform_freq(platform_res, results_dir):
+	all_labels = sorted(set().union(*(uniq_labels for narr_res, uniq_labels, uniq_comps in platform_res.values())))
+	all_comps = sorted(set().union(*(uniq_comps for narr_res, uniq_labels, uniq_comps in platform_res.values())))
+	print("\n%d labels, %d components across all platforms" % (len(all_labels), len(all_comps)))
+	for platform, (narr_res, uniq_labels, uniq_comps) in platform_res.items():
+		save_narrative_freq(narr_res, all_labels, all_comps, os.path.join(results_dir, platform.lower() + "_freq"))
+		if any('sketch' in res for res in narr_res.values()):
+			import sketch_utils
+			sketch_res = {datatype: sketch_utils.sketch_results(res['sketch']) for datatype, res in narr_res.items() if 'sketch' in res}
+			sketch_utils.save_sketch_results(sketch_res, all_labels, all_comps, os.path.join(results_dir, platform.lower() + "_freq"))
+#end save_platform_freq
+
+
+#reduce: merge partial results from sharded freq runs (freq --shard I/N --partial FILE), and save the
+#final frequency csvs - same output as a single freq run over all the data
+def run_reduce(args, config):
+	import partial_utils
+
+	partials = [partial_utils.load_partial(filename) for filename in args.partials]
+	merged = partial_utils.merge_all_partials(partials)
+	print("Merged %d partial results (%d sources)" % (len(partials), len(merged['sources'])))
+	if args.output_partial:
+		partial_utils.save_partial(merged, args.output_partial)
+		print("Merged partial result saved to", args.output_partial)
+	else:
+		#the csvs need every configured data file counted, start to end
+		partial_utils.check_coverage(merged, [file for platform, datatype, file in select_files(config)])
+		#datatype columns in config order
+		datatype_order = {platform: list(type_to_files.keys()) for platform, type_to_files in config['platforms'].items()}
+		save_platform_freq(partial_utils.partial_to_platform_res(merged, datatype_order), config['results_dir'])
+#end run_reduce
+
+#parse a shard argument "I/N" (shard I of N, counting from 0)
+def shard_arg(value):
+	try:
+		i, n = [int(part) for part in value.split("/")]
+	except ValueError:
+		raise argparse.ArgumentTypeError("shard must be I/N, ie 0/4")
+	if n < 1 or not 0 <= i < n:
+		raise argparse.ArgumentTypeError("shard must be I/N with 0 <= I < N")
+	return (i, n)
+#end shard_arg
+
+
+#keywords: does the text of each object (ie, video title/description/tags) lead to the same narrative
+#components as the given labels? saves given and inferred narratives for every object to json
+#with --index, answered from the text index (built on first use) instead of scanning the data file
+#with --store, searched in the record store cache (built on first use)
+def run_keywords(args, config):
+	search = config['keyword_search']
+	platform = args.platform or search['platform']
+	datatype = args.datatype or search['datatype']
+	fields = get_text_fields(config, platform, datatype)
+
+	#load search term -> narrative component mapping, and compile keywords into a matcher
+	search_term_dict = file_utils.read_csv_dict(config['search_term_mapping'])
+	print(len(search_term_dict), "search keywords")
+	matcher = keyword_utils.build_keyword_matcher(search_term_dict, args.word_boundary)
+
+	#search (only loading the fields we need)
+	file = config['platforms'][platform][datatype]
+	if args.index:
+		import text_index_utils		#needs numpy, so only imported here
+		print("Searching", platform, datatype, "from text index of", file)
+		index = text_index_utils.get_text_index(file, fields, text_index_dir(config, platform, datatype))
+		narrative_dict = text_index_utils.index_narrative_keywords(index, search_term_dict, matcher=matcher)
+	elif args.store:
+		import store_utils		#needs numpy, so only imported here
+		print("Searching", platform, datatype, "from record store of", file)
+		store = store_utils.load_cached_record_store(file, fields, config['cache_dir'])
+		narrative_dict = search_narrative_keywords(store, fields, search_term_dict, matcher=matcher)
+	else:
+		print("Searching", platform, datatype, "from", file)
+		data = file_utils.stream_zipped_multi_json(file, [["id_h"]] + narrative_fields + fields)
+		narrative_dict = search_narrative_keywords(data, fields, search_term_dict, matcher=matcher)
+
+	#convert given/assigned narrative labels to list of components - for easier comparison against inferred
+	label_dict = narrative_utils.new_label_dict()
+	narrative_dict = narratives_to_comp(narrative_dict, label_dict)
+
+	#which given components did we not find? (compared as object x component matrices)
+	obj_ids = list(narrative_dict.keys())
+	encoded = narrative_utils.encode_label_lists((narrative_dict[obj_id]['given'] for obj_id in obj_ids), label_dict)
+	encoded['ids'] = obj_ids
+	comparison = narrative_utils.compare_given_inferred(encoded, {obj_id: narratives['inferred'] for obj_id, narratives in narrative_dict.items()}, label_dict)
+	print(comparison['objects_missing_comps'], "%s missing given components (of %d labelled)" % (datatype, comparison['labelled_objects']))
+
+	output = args.output or os.path.join(config['results_dir'], "%s_%s_keyword_narratives.json" % (platform.lower(), datatype))
+	file_utils.save_json(narrative_dict, output)
+	print("Given and inferred narratives saved to", output)
+	save_keyword_comparison(comparison, label_dict, os.path.join(config['results_dir'], "%s_%s_keyword" % (platform.lower(), datatype)))
+#end run_keywords
+
+
+#save a given vs inferred comparison (from narrative_utils.compare_given_inferred) to csvs:
+#<basename>_components.csv: objects where each component is given, inferred, both, or given but not inferred
+#<basename>_cooccurrence.csv: objects with each given component (rows) and each inferred component (columns)
+def save_keyword_comparison(comparison, label_dict, basename):
+	comps = sorted(comp for comp in label_dict['comps'] if comp != '')
+	counts = comparison['comp_counts']
+	fields = ["given", "inferred", "both", "missing"]
+	file_utils.lists_to_csv([comps] + [[counts[comp][field] for comp in comps] for field in fields], ['narrative_components'] + fields, basename + "_components.csv")
+
+	cooccurrence = comparison['cooccurrence'].toarray()
+	cols = [label_dict['comp_ids'][comp] for comp in comps]
+	file_utils.lists_to_csv([comps] + [cooccurrence[cols, col].tolist() for col in cols], ['given_component'] + ["inferred_" + comp for comp in comps], basename + "_cooccurrence.csv")
+	print("Component comparison saved to %s_components.csv and %s_cooccurrence.csv" % (basename, basename))
+#end save_keyword_comparison
+
+
+#index: build (or reuse) an id_h -> record offset index for the selected data files, for fast lookups
+#optionally look up and print some records by id
+def run_index(args, config):
+	import index_utils		#needs numpy, so only imported here
+
+	for platform in (args.platform or list(config['platforms'].keys())):
+		files = [file for p, datatype, file in select_files(config, [platform], args.datatype)]
+		if len(files) == 0:
+			continue
+		file_utils.verify_dir(config['index_dir'])
+		index_file = os.path.join(config['index_dir'], "%s_ids.npz" % platform.lower())
+		print("Indexing", len(files), platform, "files to", index_file)
+		index = index_utils.get_id_index(files, index_file)
+		print("  ", len(index['keys']), "records indexed")
+
+		for record_id, record in index_utils.get_many(index, args.lookup).items():
+			print(json.dumps(record))
+		index_utils.close_id_index(index)
+#end run_index
+
+
+#textindex: build (or reuse) the text index of the selected data files, for the keywords --index command
+#and ad-hoc searches - optionally print the records containing some keywords/phrases
+def run_textindex(args, config):
+	import text_index_utils		#needs numpy, so only imported here
+
+	platforms = args.platform or list(config['text_fields'].keys()) or [config['keyword_search']['platform']]
+	datatypes = args.datatype or [datatype for platform in platforms for datatype in config['text_fields'].get(platform, {})] or [config['keyword_search']['datatype']]
+	for platform, datatype, file in select_files(config, platforms, datatypes):
+		fields = get_text_fields(config, platform, datatype)
+		index_dir = text_index_dir(config, platform, datatype)
+		print("Text index of", platform, datatype, "in", index_dir)
+		index = text_index_utils.get_text_index(file, fields, index_dir)
+		print("  ", len(index['records']), "records,", len(index['vocab']), "distinct tokens")
+
+		for query in args.query:
+			ids = text_index_utils.search_index(index, query, args.word_boundary)
+			print("  ", "\"%s\":" % query, len(ids), "records")
+			for record_id in ids[:args.show]:
+				print("     ", record_id)
+#end run_textindex
+
+
+#convert: build (or refresh) the parquet cache (or record stores, with --store) for the selected data files
+def run_convert(args, config):
+	for platform, datatype, file in select_files(config, args.platform, args.datatype):
+		print("Converting", platform, datatype, "from", file)
+		if args.store:
+			import store_utils		#needs numpy, so only imported here
+			store = store_utils.load_cached_record_store(file, cache_fields, config['cache_dir'])
+			print("  ", store['num_records'], "objects stored")
+			continue
+		table = file_utils.load_cached_zipped_multi_json(file, cache_fields, config['cache_dir'])
+		print("  ", table.num_rows, "objects cached")
+#end run_convert
+
+
+#rollup: add new/changed data files to the time-bucketed rollup store (files already counted are skipped),
+#then save counts per bucket to <results_dir>/<platform>_rollup_<bucket>.csv
+def run_rollup(args, config):
+	import rollup_utils
+
+	conn = rollup_utils.open_rollup_store(config['rollup_store'])
+	for platform, datatype, file in select_files(config, args.platform, args.datatype):
+		timestamp_field = config['timestamp_fields'].get(platform)
+		if args.rebuild:
+			rollup_utils.remove_rollup_source(conn, file)
+		if rollup_utils.update_rollup_store(conn, platform, datatype, file, timestamp_field):
+			print("Counted", platform, datatype, "from", file)
+		else:
+			print("Skipping", platform, datatype, "(already counted)")
+		records, no_timestamp = rollup_utils.source_counts(conn, file)
+		if no_timestamp:
+			print("   %d of %d objects have no readable timestamp (counted in the unknown bucket)" % (no_timestamp, records))
+
+	for platform in (args.platform or list(config['platforms'].keys())):
+		for bucket in (args.bucket or ["day"]):
+			filename = os.path.join(config['results_dir'], "%s_rollup_%s.csv" % (platform.lower(), bucket))
+			rollup_utils.save_rollup_csv(rollup_utils.rollup(conn, bucket, platform), filename)
+			print("Rollup saved to", filename)
+	conn.close()
+#end run_rollup
+
+
+#cascades: build the retweet graph from the retweet chain, and save cascade size/depth/breadth stats per
+#narrative label and component of the root tweets to <results_dir>/<platform>_cascades_narrative_*.csv
+def run_cascades(args, config):
+	import graph_utils		#needs numpy, so only imported here
+
+	cascades = config['cascades']
+	files = config['platforms'][cascades['platform']]
+	print("Loading retweet chain from", files[cascades['chain_datatype']])
+	graph = graph_utils.load_retweet_graph(files[cascades['chain_datatype']], cascades['child_field'], cascades['parent_field'])
+	stats = graph_utils.cascade_stats(graph)
+	print("  ", len(graph['ids']), "tweets in", len(stats['root']), "cascades (largest %d, deepest %d)" % (stats['size'].max(initial=0), stats['depth'].max(initial=0)))
+
+	#narratives of the root tweets (only the id and label fields are loaded)
+	tweets = file_utils.stream_zipped_multi_json(files[cascades['tweets_datatype']], [["id_h"]] + narrative_fields)
+	root_label_dict = graph_utils.root_labels(graph, tweets)
+	print("  ", len(root_label_dict), "root tweets found in", cascades['tweets_datatype'])
+
+	label_stats, comp_stats = graph_utils.narrative_cascade_stats(stats, root_label_dict)
+	filename = os.path.join(config['results_dir'], "%s_cascades" % cascades['platform'].lower())
+	graph_utils.save_cascade_stats(label_stats, "narrative_label", filename + "_narrative_labels.csv")
+	graph_utils.save_cascade_stats(comp_stats, "narrative_component", filename + "_narrative_components.csv")
+	print("Cascade stats saved to %s_narrative_labels.csv and %s_narrative_components.csv" % (filename, filename))
+#end run_cascades
+
+
+#bots: join botometer scores onto tweets by user, and save narrative frequencies per bot score band
+#to <results_dir>/<platform>_bot_freq_narrative_labels.csv and _narrative_components.csv
+def run_bots(args, config):
+	import bot_utils		#needs numpy, so only imported here
+
+	bots = config['bots']
+	files = config['platforms'][bots['platform']]
+	resolve = args.resolve or bots['resolve']
+	print("Loading bot scores (%s for users in more than one file)" % resolve)
+	bot_scores = bot_utils.load_bot_scores([(files[datatype], score_field) for datatype, score_field in bots['score_files']], bots['user_field'], resolve)
+	print("  ", bot_scores['stats']['users'], "users,", bot_scores['stats']['overlapping_users'], "in more than one file")
+
+	#only load the user id and narrative fields of the tweets
+	tweets = file_utils.stream_zipped_multi_json(files[bots['tweets_datatype']], [bots['tweet_user_field']] + narrative_fields)
+	band_res, band_counts = bot_utils.bot_narrative_analysis(tweets, bot_scores, bots['tweet_user_field'], bots['band_edges'])
+	for band, count in band_counts.items():
+		print("  ", band + ":", count, "tweets")
+
+	all_labels = sorted(set().union(*(res['label_freq'].keys() for res in band_res.values())))
+	all_comps = sorted(set().union(*(res['comp_freq'].keys() for res in band_res.values())))
+	save_narrative_freq(band_res, all_labels, all_comps, os.path.join(config['results_dir'], "%s_bot_freq" % bots['platform'].lower()))
+#end run_bots
+
+
+#links: join tweets to the YouTube videos they link to (one streaming pass over the tweets, against a table
+#of all video ids), saving every tweet -> video edge with both sides' narratives to
+#<results_dir>/twitter_youtube_links.csv, and cross-platform spread counts per narrative label/component to
+#<results_dir>/twitter_youtube_spread_narrative_labels.csv and _narrative_components.csv
+def run_links(args, config):
+	import link_utils		#needs numpy, so only imported here
+
+	linkage = config['linkage']
+	video_file = config['platforms'][linkage['video_platform']][linkage['videos_datatype']]
+	tweet_file = config['platforms'][linkage['tweet_platform']][linkage['tweets_datatype']]
+	base = os.path.join(config['results_dir'], "%s_%s" % (linkage['tweet_platform'].lower(), linkage['video_platform'].lower()))
+
+	#video id table (only the id and narrative fields are loaded)
+	print("Loading video ids from", video_file)
+	video_table = link_utils.build_video_table(file_utils.stream_zipped_multi_json(video_file, [linkage['video_id_field']] + narrative_fields), linkage['video_id_field'])
+	print("  ", len(video_table['keys']), "videos")
+	if video_table['missing_ids']:
+		print("   Skipped %d videos without %s (video_id_field has to be the plain YouTube id, as in the urls)" % (video_table['missing_ids'], ".".join(linkage['video_id_field'])))
+
+	#stream the tweets, join their links against the table
+	print("Linking tweets from", tweet_file)
+	tweets = file_utils.stream_zipped_multi_json(tweet_file, [linkage['tweet_id_field']] + narrative_fields + linkage['link_fields'])
+	counts, num_tweets, num_edges = link_utils.link_and_count(tweets, video_table, base + "_links.csv", linkage['tweet_id_field'], linkage['link_fields'], args.batch_size)
+	print("  ", num_tweets, "tweets link to", int(counts['linked'].sum()), "videos (%d links)" % num_edges)
+	print("Links saved to", base + "_links.csv")
+
+	link_utils.save_narrative_spread(link_utils.narrative_spread(video_table, counts), "narrative_label", base + "_spread_narrative_labels.csv")
+	link_utils.save_narrative_spread(link_utils.narrative_spread(video_table, counts, split=True), "narrative_component", base + "_spread_narrative_components.csv")
+	print("Spread per narrative saved to %s_spread_narrative_labels.csv and %s_spread_narrative_components.csv" % (base, base))
+#end run_links
+
+
+#build the command line parser
+def build_arg_parser():
+	parser = argparse.ArgumentParser(description="Narrative analysis of the White Helmets YouTube + Twitter data")
+	parser.add_argument("--config", default=DEFAULT_CONFIG, help="json config with data file locations (default: %(default)s)")
+	parser.add_argument("--prefetch", type=int, default=0, metavar="DEPTH", help="read and decompress .json.gz files in a background thread, up to DEPTH blocks ahead of the parsing (0 for off)")
+	parser.add_argument("--prefetch-block-size", type=int, default=1, metavar="MB", help="compressed MB per prefetched block (default: %(default)s)")
+	commands = parser.add_subparsers(dest="command", required=True)
+
+	freq = commands.add_parser("freq", help="narrative label/component frequencies for each platform and datatype")
+	freq.add_argument("--no-stream", dest="stream", action="store_false", help="load each dataset into memory before analysing, instead of streaming")
+	freq.add_argument("--cache", action="store_true", help="load data through the parquet cache (built on first use), and count on columns")
+	freq.add_argument("--store", action="store_true", help="load data through the record store cache (built on first use, memory mapped after that)")
+	freq.add_argument("--parallel", action="store_true", help="load and analyse each datatype file in a separate process")
+	freq.add_argument("--processes", type=int, default=None, help="number of worker processes in parallel mode (default: one per file, up to cpu count)")
+	freq.add_argument("--chunk-size", type=int, default=256, help="in parallel mode, split files bigger than this many MB into ranges (0 to only split by file; needs indexed_gzip)")
+	freq.add_argument("--dedup", choices=["memory", "disk"], default=None, help="drop objects with repeated id_h, keeping ids in memory or in on-disk partitions")
+	freq.add_argument("--check-content", action="store_true", help="with --dedup, also report ids whose duplicate copies differ")
+	freq.add_argument("--profile", action="append", default=[], metavar="STAGE", help="run this stage (load/analyse/write/parallel_analyse) under cProfile")
+	freq.add_argument("--trace-memory", action="append", default=[], metavar="STAGE", help="run this stage under tracemalloc")
+	freq.add_argument("--load-stats", action="store_true", help="time reading/decompressing vs parsing of each file, and count its records and bytes, for the run report (slightly slower)")
+	freq.add_argument("--shard", type=shard_arg, default=None, metavar="I/N", help="only analyse every N'th file/range, starting from I (implies --parallel)")
+	freq.add_argument("--partial", default=None, metavar="FILE", help="save a partial result (json) instead of the csvs, to merge with the reduce command")
+	freq.add_argument("--sketch", action="store_true", help="also estimate distinct accounts and top accounts per label/component (account fields and error bounds from config)")
+
+	keywords = commands.add_parser("keywords", help="infer narratives from text with the search term mapping, compare to given labels")
+	keywords.add_argument("--platform", default=None, help="platform to search (default from config)")
+	keywords.add_argument("--datatype", default=None, help="datatype to search (default from config)")
+	keywords.add_argument("--word-boundary", action="store_true", help="only match keywords as whole words")
+	keywords.add_argument("--output", default=None, help="json file for the given/inferred narratives")
+	keywords.add_argument("--index", action="store_true", help="search the text index (built on first use) instead of scanning the data")
+	keywords.add_argument("--store", action="store_true", help="search the record store cache (built on first use) instead of scanning the data")
+
+	textindex = commands.add_parser("textindex", help="build text indexes for fast keyword searches, and optionally search them", description="Build text indexes for fast keyword searches, and optionally search them. Building takes about 200MB plus the vocabulary of the texts, however big the data file (postings are spilled to disk in sorted runs, and merged in slices of the same size).")
+	textindex.add_argument("--platform", action="append", default=[], help="platform to index (repeat for more, default all in text_fields)")
+	textindex.add_argument("--datatype", action="append", default=[], help="datatype to index (repeat for more, default all in text_fields)")
+	textindex.add_argument("--query", action="append", default=[], metavar="TEXT", help="print the ids of records containing this keyword/phrase (repeat for more)")
+	textindex.add_argument("--word-boundary", action="store_true", help="only match queries as whole words")
+	textindex.add_argument("--show", type=int, default=10, help="number of record ids to print per query (default: %(default)s)")
+
+	index = commands.add_parser("index", help="build id_h -> record offset indexes, and optionally look up records")
+	index.add_argument("--platform", action="append", default=[], help="platform to index (repeat for more, default all)")
+	index.add_argument("--datatype", action="append", default=[], help="datatype to index (repeat for more, default all)")
+	index.add_argument("--lookup", action="append", default=[], metavar="ID_H", help="print the record with this id")
+
+	convert = commands.add_parser("convert", help="convert raw .json.gz files to the parquet cache (or record stores)")
+	convert.add_argument("--platform", action="append", default=[], help="platform to convert (repeat for more, default all)")
+	convert.add_argument("--datatype", action="append", default=[], help="datatype to convert (repeat for more, default all)")
+	convert.add_argument("--store", action="store_true", help="build record stores (for freq --store) instead of the parquet cache")
+
+	rollup = commands.add_parser("rollup", help="narrative frequencies per hour/day/week, updated incrementally as data files are added")
+	rollup.add_argument("--platform", action="append", default=[], help="platform to count (repeat for more, default all)")
+	rollup.add_argument("--datatype", action="append", default=[], help="datatype to count (repeat for more, default all)")
+	rollup.add_argument("--bucket", action="append", choices=["hour", "day", "week"], default=[], help="bucket size to save (repeat for more, default day)")
+	rollup.add_argument("--rebuild", action="store_true", help="recount the selected files even if they haven't changed")
+
+	commands.add_parser("cascades", help="retweet cascade size/depth/breadth per narrative of the root tweet")
+
+	bots = commands.add_parser("bots", help="narrative frequencies of tweets split by the botometer score of their user")
+	bots.add_argument("--resolve", choices=["first", "max", "mean"], default=None, help="score for users in more than one botometer file (default from config)")
+
+	links = commands.add_parser("links", help="link tweets to the YouTube videos they reference, and count cross-platform spread per narrative")
+	links.add_argument("--batch-size", type=int, default=100000, help="tweets per batch of video id lookups (default: %(default)s)")
+
+	reduce = commands.add_parser("reduce", help="merge partial results from sharded freq runs into the final frequency csvs")
+	reduce.add_argument("partials", nargs="+", help="partial result files")
+	reduce.add_argument("--output-partial", default=None, metavar="FILE", help="save the merged partial result instead of the csvs (ie to reduce in stages)")
+
+	return parser
+#end build_arg_parser
+
+
+#reject freq option combinations that would otherwise be silently ignored (exits with a usage error)
+#parallel/sharded runs stream every file in the workers, so they can't dedup, use the caches, load into memory
+#or time the reads
+def check_freq_args(parser, args):
+	if args.parallel or args.shard is not None:
+		ignored = [option for option, used in [("--dedup", args.dedup is not None), ("--cache", args.cache), ("--store", args.store), ("--no-stream", not args.stream), ("--load-stats", args.load_stats)] if used]
+		if ignored:
+			parser.error("freq %s can't be used with --parallel or --shard" % ", ".join(ignored))
+	if args.sketch and (args.cache or args.store or args.partial is not None):
+		parser.error("freq --sketch can't be used with --cache, --store or --partial")
+	if args.load_stats and (args.cache or args.store):
+		parser.error("freq --load-stats can't be used with --cache or --store (only .json.gz reads are timed)")
+#end check_freq_args
+
+
+COMMANDS = {"freq": run_freq, "keywords": run_keywords, "index": run_index, "textindex": run_textindex, "convert": run_convert, "rollup": run_rollup, "cascades": run_cascades, "bots": run_bots, "links": run_links, "reduce": run_reduce}
+
+#parse command line and run the chosen command
+def main(argv=None):
+	parser = build_arg_parser()
+	args = parser.parse_args(argv)
+	if args.command == "freq":
+		check_freq_args(parser, args)
+	config = load_config(args.config)
+	file_utils.PREFETCH_DEPTH = args.prefetch
+	file_utils.PREFETCH_BLOCK_SIZE = args.prefetch_block_size*1024*1024
+	COMMANDS[args.command](args, config)
+#end main
+
+
+#guard main, so worker processes for the parallel analysis don't rerun everything on import
+if __name__ == "__main__":
+	main()
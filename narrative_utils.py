@@ -0,0 +1,233 @@
+#utility methods for integer-encoded narrative labels
+#each distinct narrative label and label component is interned to an int once (with the label -> component
+#expansion cached), so per-object narratives can be stored as sparse object x label/component matrices
+#and counted/compared with numpy/scipy reductions instead of python loops over label strings
+
+#numpy/scipy only imported by the matrix functions, the label dictionary itself is plain python
+
+#empty label used in the data for objects with no narrative
+NO_LABEL = ''
+
+#objects per batch when encoding a stream of objects (see narrative_analysis in load_data), so the
+#matrices of one batch stay small however big the data
+ENCODE_BATCH = 10000
+
+#create a new (empty) label dictionary
+#labels/comps: id -> string, label_ids/comp_ids: string -> id
+#label_comps: label id -> list of component ids (one per component in the label, in order)
+def new_label_dict():
+	return {"labels": [], "label_ids": {}, "comps": [], "comp_ids": {}, "label_comps": []}
+#end new_label_dict
+
+#given a label dictionary and narrative label string, return the label's id (adding it if new)
+def intern_label(label_dict, label):
+	label_id = label_dict['label_ids'].get(label)
+	if label_id is None:
+		label_id = len(label_dict['labels'])
+		label_dict['labels'].append(label)
+		label_dict['label_ids'][label] = label_id
+		#split into components only once per distinct label
+		label_dict['label_comps'].append([intern_comp(label_dict, comp) for comp in label.split('-')])
+	return label_id
+#end intern_label
+
+#given a label dictionary and narrative component string, return the component's id (adding it if new)
+def intern_comp(label_dict, comp):
+	comp_id = label_dict['comp_ids'].get(comp)
+	if comp_id is None:
+		comp_id = len(label_dict['comps'])
+		label_dict['comps'].append(comp)
+		label_dict['comp_ids'][comp] = comp_id
+	return comp_id
+#end intern_comp
+
+#given a label dictionary and a narrative label string, return list of unique component strings in the label
+#(same order as in the label, cached via the interned expansion)
+def label_components(label_dict, label):
+	comps = label_dict['comps']
+	return list(dict.fromkeys(comps[comp_id] for comp_id in label_dict['label_comps'][intern_label(label_dict, label)]))
+#end label_components
+
+#label x component matrix of the label dictionary (CSR): entry (i, j) is the number of times component j
+#appears in label i - multiplying an object x label matrix by this gives the object x component matrix
+def label_comp_matrix(label_dict):
+	import numpy as np
+	import scipy.sparse as sp
+
+	lengths = [len(comps) for comps in label_dict['label_comps']]
+	cols = [comp_id for comps in label_dict['label_comps'] for comp_id in comps]
+	ptr = np.concatenate(([0], np.cumsum(lengths, dtype=np.int64)))
+	matrix = sp.csr_matrix((np.ones(len(cols), dtype=np.int32), np.array(cols, dtype=np.int32), ptr), shape=(len(label_dict['labels']), len(label_dict['comps'])))
+	matrix.sum_duplicates()
+	return matrix
+#end label_comp_matrix
+
+#given narrative label lists (list or any iterable, one list per object, looped once) and a label dictionary,
+#build sparse (CSR) incidence matrices for the narrative labels of each object:
+#  labels: object x label, value is number of times the label is listed for the object
+#  comps:  object x component, value is number of times the component appears in the object's labels
+#column sums of these are the label/component frequencies of narrative_analysis
+#returns dictionary with the two matrices, and count of objects with no narrative label (empty list, or
+#first label empty)
+#matrices have one column per label/component in the dictionary at the time they are built -
+#if the dictionary is shared and grows later, use pad_columns before combining matrices
+def encode_label_lists(label_lists, label_dict):
+	import numpy as np
+	import scipy.sparse as sp
+
+	unlabeled = 0
+	#CSR arrays for the label matrix: column ids, and row start offsets
+	label_cols = []
+	label_ptr = [0]
+	label_ids = label_dict['label_ids']
+	for labels in label_lists:
+		if not labels or labels[0] == NO_LABEL:
+			unlabeled += 1
+		for label in labels:
+			if label != NO_LABEL:
+				label_id = label_ids.get(label)		#(most labels already interned, skip the call)
+				label_cols.append(label_id if label_id is not None else intern_label(label_dict, label))
+		label_ptr.append(len(label_cols))
+
+	#duplicate (row, col) entries are summed, giving the counts
+	shape = (len(label_ptr)-1, len(label_dict['labels']))
+	label_matrix = sp.csr_matrix((np.ones(len(label_cols), dtype=np.int32), np.array(label_cols, dtype=np.int32), np.array(label_ptr, dtype=np.int64)), shape=shape)
+	label_matrix.sum_duplicates()
+
+	return {"labels": label_matrix, "comps": (label_matrix @ label_comp_matrix(label_dict)).tocsr(), "unlabeled_count": unlabeled}
+#end encode_label_lists
+
+#given data objects (list or any iterable, looped once) and a label dictionary, encode their narrative labels
+#(see encode_label_lists) - also returns the list of object ids (id_field, or None if missing)
+#objects without the extension field count as unlabeled
+def encode_narratives(data, label_dict, id_field="id_h"):
+	ids = []
+	label_lists = []
+	for item in data:
+		ids.append(item.get(id_field))
+		label_lists.append(item['extension']['socialsim_information_id'] if 'extension' in item else [NO_LABEL])
+	encoded = encode_label_lists(label_lists, label_dict)
+	encoded['ids'] = ids
+	return encoded
+#end encode_narratives
+
+#same as encode_label_lists, for labels that are already interned somewhere else (ie, a record store):
+#label_ids is the flat array of every object's label ids, label_offsets the start of each object's labels
+#in it (plus the end), and labels the strings of those ids - no python loop over the objects
+def encode_interned(label_ids, label_offsets, labels, label_dict):
+	import numpy as np
+	import scipy.sparse as sp
+
+	#ids of the other interning -> label dictionary ids (-1 for the empty label, which isn't a column)
+	id_map = np.array([intern_label(label_dict, label) if label != NO_LABEL else -1 for label in labels], dtype=np.int64)
+	label_offsets = np.asarray(label_offsets, dtype=np.int64)
+	num_objects = len(label_offsets)-1
+	cols = id_map[label_ids]
+	rows = np.repeat(np.arange(num_objects), np.diff(label_offsets))
+
+	#unlabeled: no labels, or first label empty
+	first = np.full(num_objects, -1, dtype=np.int64)
+	has_labels = np.diff(label_offsets) > 0
+	first[has_labels] = cols[label_offsets[:-1][has_labels]]
+	unlabeled = int(np.count_nonzero(first < 0))
+
+	keep = cols >= 0
+	label_matrix = sp.csr_matrix((np.ones(int(np.count_nonzero(keep)), dtype=np.int32), (rows[keep], cols[keep])), shape=(num_objects, len(label_dict['labels'])))
+	return {"labels": label_matrix, "comps": (label_matrix @ label_comp_matrix(label_dict)).tocsr(), "unlabeled_count": unlabeled}
+#end encode_interned
+
+#given a sparse matrix, return a copy with extra (empty) columns so that it has num_cols columns
+#(for matrices built before the shared label dictionary grew)
+def pad_columns(matrix, num_cols):
+	matrix = matrix.copy()
+	matrix.resize((matrix.shape[0], num_cols))
+	return matrix
+#end pad_columns
+
+#add the column sums of a matrix to a running total (numpy array, or None to start), and return the new total
+#the matrix can have more columns than the total, if the label dictionary has grown since
+def add_column_sums(sums, matrix):
+	import numpy as np
+
+	matrix_sums = np.asarray(matrix.sum(axis=0), dtype=np.int64).ravel()
+	if sums is not None:
+		matrix_sums[:len(sums)] += sums
+	return matrix_sums
+#end add_column_sums
+
+#given column sums (numpy array, or None for no columns) and the column names, return dictionary of
+#name -> sum for the nonzero columns
+def column_freq(sums, names):
+	import numpy as np
+
+	if sums is None:
+		return {}
+	return {names[i]: int(sums[i]) for i in np.flatnonzero(sums)}
+#end column_freq
+
+#given encoded narratives (from encode_narratives) and the label dictionary, return the same
+#frequency dictionary as narrative_analysis: unlabeled_count, label_freq, comp_freq
+def encoded_narrative_freq(encoded, label_dict):
+	label_freq = column_freq(add_column_sums(None, encoded['labels']), label_dict['labels'])
+	comp_freq = column_freq(add_column_sums(None, encoded['comps']), label_dict['comps'])
+	return {"unlabeled_count": encoded['unlabeled_count'], "label_freq": label_freq, "comp_freq": comp_freq}
+#end encoded_narrative_freq
+
+#given a dictionary of object id -> list of narrative components (ie, the 'inferred' lists from
+#search_narrative_keywords), and the list of object ids for the matrix rows (ie, encoded['ids']),
+#return binary object x component CSR matrix (components interned in label_dict)
+def comp_list_matrix(comp_lists, ids, label_dict):
+	import numpy as np
+	import scipy.sparse as sp
+
+	cols = []
+	ptr = [0]
+	for obj_id in ids:
+		cols.extend(set(intern_comp(label_dict, comp) for comp in comp_lists.get(obj_id, [])))
+		ptr.append(len(cols))
+	return sp.csr_matrix((np.ones(len(cols), dtype=np.int32), np.array(cols, dtype=np.int32), np.array(ptr, dtype=np.int64)), shape=(len(ids), len(label_dict['comps'])))
+#end comp_list_matrix
+
+#compare given narrative components against inferred ones (ie, from keyword search) for the same objects
+#given: encoded narratives (from encode_narratives), dictionary of object id -> inferred component list
+#returns dictionary of:
+#  comp_counts: component -> objects where it is given, inferred, both, or given but not inferred ("missing")
+#  labelled_objects: objects with at least one given component
+#  objects_missing_comps: labelled objects missing at least one given component
+#  cooccurrence: given x inferred component matrix, see comp_cooccurrence (columns are label_dict['comps'])
+def compare_given_inferred(encoded, inferred_lists, label_dict):
+	import numpy as np
+
+	inferred = comp_list_matrix(inferred_lists, encoded['ids'], label_dict)
+	given = pad_columns(encoded['comps'], len(label_dict['comps']))
+	given.data[:] = 1		#presence only, not counts
+
+	both = given.multiply(inferred)
+	given_counts = np.asarray(given.sum(axis=0)).ravel()
+	inferred_counts = np.asarray(inferred.sum(axis=0)).ravel()
+	both_counts = np.asarray(both.sum(axis=0)).ravel()
+
+	#objects with a given component not found by inference
+	given_per_obj = np.asarray(given.sum(axis=1)).ravel()
+	missing_per_obj = given_per_obj - np.asarray(both.sum(axis=1)).ravel()
+
+	comp_counts = {}
+	for i, comp in enumerate(label_dict['comps']):
+		comp_counts[comp] = {"given": int(given_counts[i]), "inferred": int(inferred_counts[i]), "both": int(both_counts[i]), "missing": int(given_counts[i] - both_counts[i])}
+	return {"comp_counts": comp_counts, "labelled_objects": int(np.count_nonzero(given_per_obj)), "objects_missing_comps": int(np.count_nonzero(missing_per_obj)), "cooccurrence": comp_cooccurrence(given, inferred)}
+#end compare_given_inferred
+
+#given an object x component matrix, return component x component co-occurrence matrix:
+#entry (i, j) is the number of objects that have both component i and component j
+#(diagonal is the number of objects with each component)
+#if a second matrix is given (same objects and columns), entry (i, j) is the number of objects with
+#component i in the first and component j in the second instead
+def comp_cooccurrence(comp_matrix, other_matrix=None):
+	presence = comp_matrix.copy()
+	presence.data[:] = 1
+	other = presence
+	if other_matrix is not None:
+		other = other_matrix.copy()
+		other.data[:] = 1
+	return (presence.T @ other).tocsr()
+#end comp_cooccurrence
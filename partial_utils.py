@@ -0,0 +1,186 @@
+#utility methods for partial narrative analysis results, for runs split across machines (shards)
+#each shard saves its per-datatype counts to a partial result file (versioned json), and any number of
+#partials can be merged in any order/grouping - merging only sums counts and unions label sets, so the
+#final frequency csvs come out the same however the data was split
+#each partial also lists the data sources (file, or file byte range) it counted, and the size/mtime of
+#each file, so the same data can't be merged twice (any overlapping byte ranges of a file are rejected,
+#whatever chunk size they were split with) and partials of different versions of a file can't be mixed
+#the decompressed length of files split into byte ranges is kept too, so a final merge can check that every
+#byte of every data file was counted (see check_coverage)
+
+import json
+import os
+
+import file_utils
+
+#partial result file format and version (bump the version if the structure changes)
+PARTIAL_FORMAT = "narrative_partial"
+PARTIAL_VERSION = 3
+
+#create a new empty partial result
+def new_partial():
+	return {"format": PARTIAL_FORMAT, "version": PARTIAL_VERSION, "sources": [], "files": {}, "platforms": {}}
+#end new_partial
+
+#build a partial result from platform results (platform -> (narr_res, uniq_labels, uniq_comps), as returned
+#by platform_narrative_analysis/parallel_narrative_analysis) and the list of sources counted, each a list of
+#[platform, datatype, file, start byte, end byte] (start/end None for whole files)
+#the size and mtime of each source file are recorded too (of the tar, for files inside a tar), plus the
+#decompressed length of the files split into ranges (file_lengths: file -> length, see parallel_narrative_analysis)
+def make_partial(platform_res, sources, file_lengths=None):
+	partial = new_partial()
+	partial['sources'] = sorted([list(source) for source in sources], key=source_sort_key)
+	for source in partial['sources']:
+		if source[2] not in partial['files']:
+			stat = os.stat(file_utils.split_tar_member(source[2])[0])
+			partial['files'][source[2]] = {"size": stat.st_size, "mtime": stat.st_mtime}
+			if source[3] is not None:
+				partial['files'][source[2]]['length'] = (file_lengths or {})[source[2]]
+	for platform, (narr_res, uniq_labels, uniq_comps) in platform_res.items():
+		partial['platforms'][platform] = {
+			"labels": sorted(uniq_labels),
+			"comps": sorted(uniq_comps),
+			"datatypes": {datatype: {"unlabeled_count": res['unlabeled_count'], "label_freq": dict(sorted(res['label_freq'].items())), "comp_freq": dict(sorted(res['comp_freq'].items()))} for datatype, res in sorted(narr_res.items())}
+		}
+	return partial
+#end make_partial
+
+#sort key for sources (None sorts before any byte offset)
+def source_sort_key(source):
+	return [(value is not None, value) for value in source]
+#end source_sort_key
+
+#(start, end) decompressed byte range of a source, end None for the end of the file (so a whole file
+#is (0, None), and overlaps every range of that file)
+def source_range(source):
+	start, end = source[3], source[4]
+	return (0 if start is None else start, end)
+#end source_range
+
+#True if two source ranges (from source_range) share any bytes
+def ranges_overlap(range_a, range_b):
+	return (range_b[1] is None or range_a[0] < range_b[1]) and (range_a[1] is None or range_b[0] < range_a[1])
+#end ranges_overlap
+
+#raise ValueError if two partials counted any of the same data: a file with a different size/mtime in
+#each, or overlapping byte ranges of the same file (whole file vs range, or ranges of different chunk sizes)
+def check_sources(a, b):
+	for path in sorted(set(a['files']) & set(b['files'])):
+		if (a['files'][path]['size'], a['files'][path]['mtime']) != (b['files'][path]['size'], b['files'][path]['mtime']):
+			raise ValueError("partial results were made from different versions of %s (size/mtime differ)" % path)
+	ranges_a = {}
+	for source in a['sources']:
+		ranges_a.setdefault(source[2], []).append(source_range(source))
+	for source in b['sources']:
+		range_b = source_range(source)
+		for range_a in ranges_a.get(source[2], []):
+			if ranges_overlap(range_a, range_b):
+				raise ValueError("partial results both include %s (bytes %d-%s and %d-%s)" % (source[2], range_a[0], range_a[1] or "end", range_b[0], range_b[1] or "end"))
+#end check_sources
+
+#merge two partial results into a new one (neither input is changed)
+#associative and order-independent: counts are summed and label sets unioned
+#raises ValueError if both partials counted any of the same data (see check_sources)
+def merge_partials(a, b):
+	check_partial(a)
+	check_partial(b)
+	check_sources(a, b)
+
+	merged = new_partial()
+	merged['sources'] = sorted(a['sources'] + b['sources'], key=source_sort_key)
+	merged['files'] = {path: dict(a['files'].get(path, {}), **b['files'].get(path, {})) for path in sorted(set(a['files']) | set(b['files']))}
+	for platform in sorted(set(a['platforms']) | set(b['platforms'])):
+		res_a = a['platforms'].get(platform, {"labels": [], "comps": [], "datatypes": {}})
+		res_b = b['platforms'].get(platform, {"labels": [], "comps": [], "datatypes": {}})
+		datatypes = {}
+		for datatype in sorted(set(res_a['datatypes']) | set(res_b['datatypes'])):
+			counts_a = res_a['datatypes'].get(datatype, {"unlabeled_count": 0, "label_freq": {}, "comp_freq": {}})
+			counts_b = res_b['datatypes'].get(datatype, {"unlabeled_count": 0, "label_freq": {}, "comp_freq": {}})
+			datatypes[datatype] = {
+				"unlabeled_count": counts_a['unlabeled_count'] + counts_b['unlabeled_count'],
+				"label_freq": add_counts(counts_a['label_freq'], counts_b['label_freq']),
+				"comp_freq": add_counts(counts_a['comp_freq'], counts_b['comp_freq'])
+			}
+		merged['platforms'][platform] = {
+			"labels": sorted(set(res_a['labels']) | set(res_b['labels'])),
+			"comps": sorted(set(res_a['comps']) | set(res_b['comps'])),
+			"datatypes": datatypes
+		}
+	return merged
+#end merge_partials
+
+#sum two dictionaries of counts, result sorted by key
+def add_counts(counts_a, counts_b):
+	return {key: counts_a.get(key, 0) + counts_b.get(key, 0) for key in sorted(set(counts_a) | set(counts_b))}
+#end add_counts
+
+#merge any number of partial results (at least one)
+def merge_all_partials(partials):
+	merged = partials[0]
+	for partial in partials[1:]:
+		merged = merge_partials(merged, partial)
+	return merged
+#end merge_all_partials
+
+#raise ValueError if a (merged) partial result didn't count all of the given data files, start to end:
+#a file with no sources, a different size/mtime than the file now, or byte ranges with a gap between them
+#or stopping short of the end of the file
+#files is a list of data files (ie every file in the config), each must be counted once for the final csvs
+def check_coverage(partial, files):
+	ranges = {}
+	for source in partial['sources']:
+		ranges.setdefault(source[2], []).append(source_range(source))
+	for path in files:
+		if path not in ranges:
+			raise ValueError("partial results don't include %s" % path)
+		stat = os.stat(file_utils.split_tar_member(path)[0])
+		if (partial['files'][path]['size'], partial['files'][path]['mtime']) != (stat.st_size, stat.st_mtime):
+			raise ValueError("%s has changed since the partial results were made (size/mtime differ)" % path)
+		if ranges[path] == [(0, None)]:
+			continue		#whole file
+		#ranges never overlap (see check_sources), so sorted they have to meet end to start
+		pos = 0
+		for start, end in sorted(ranges[path]):
+			if start != pos:
+				raise ValueError("partial results are missing bytes %d-%d of %s" % (pos, start, path))
+			pos = end
+		if pos != partial['files'][path]['length']:
+			raise ValueError("partial results are missing bytes %d-%d of %s" % (pos, partial['files'][path]['length'], path))
+#end check_coverage
+
+#raise ValueError if data isn't a partial result of a version we can read
+def check_partial(partial):
+	if not isinstance(partial, dict) or partial.get('format') != PARTIAL_FORMAT:
+		raise ValueError("not a narrative partial result")
+	if partial.get('version') != PARTIAL_VERSION:
+		raise ValueError("partial result version %s not supported (expected %d)" % (partial.get('version'), PARTIAL_VERSION))
+#end check_partial
+
+#save a partial result to json (sorted keys, so the same counts always give the same file)
+def save_partial(partial, filename):
+	with open(filename, 'w', encoding='utf-8') as f:
+		json.dump(partial, f, indent=1, sort_keys=True)
+#end save_partial
+
+#load a partial result saved by save_partial (raises ValueError if not a readable partial)
+def load_partial(filename):
+	with open(filename, 'r', encoding='utf-8') as f:
+		partial = json.load(f)
+	check_partial(partial)
+	return partial
+#end load_partial
+
+#convert a partial result back to platform results (platform -> (narr_res, uniq_labels, uniq_comps)), same
+#as platform_narrative_analysis returns
+#datatypes of each platform are ordered as in datatype_order (platform -> list of datatypes, ie from the
+#config), with any others after them in sorted order
+def partial_to_platform_res(partial, datatype_order=None):
+	check_partial(partial)
+	platform_res = {}
+	for platform, res in partial['platforms'].items():
+		order = [datatype for datatype in (datatype_order or {}).get(platform, []) if datatype in res['datatypes']]
+		order += sorted(datatype for datatype in res['datatypes'] if datatype not in order)
+		narr_res = {datatype: res['datatypes'][datatype] for datatype in order}
+		platform_res[platform] = (narr_res, set(res['labels']), set(res['comps']))
+	return platform_res
+#end partial_to_platform_res
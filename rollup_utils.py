@@ -0,0 +1,167 @@
+#utility methods for time-bucketed narrative frequency rollups
+#narrative label/component counts per platform, datatype and hour (from each object's timestamp) are
+#stored in a sqlite database - coarser buckets (day, week) are summed from the hourly counts with a
+#query, so no window size ever needs another pass over the raw data
+#counts are kept per source file, so when a new dump file arrives (or one changes) only that file is
+#counted and its rows added/replaced - the rest of the store is left as is
+#objects without a readable timestamp are counted in a separate "unknown" bucket, so the totals over all
+#buckets (unknown included) match the freq csvs
+
+import csv
+import datetime
+import os
+import sqlite3
+from collections import defaultdict
+
+import file_utils
+
+#bucket sizes, in seconds - weeks start on Monday (the epoch was a Thursday, hence the offset)
+BUCKET_SIZES = {"hour": 3600, "day": 86400, "week": 7*86400}
+BUCKET_OFFSETS = {"hour": 0, "day": 0, "week": 4*86400}
+
+#hour (and bucket) of objects with a missing or unreadable timestamp
+UNKNOWN_HOUR = -2**62
+
+#store version (stores of an older version are emptied and recounted)
+#2: objects without a timestamp are counted in the UNKNOWN_HOUR bucket, instead of skipped
+ROLLUP_VERSION = 2
+
+#timestamp field of each platform's objects, if not given
+TIMESTAMP_FIELDS = {"Twitter": ["created_at"], "YouTube": ["snippet", "publishedAt"]}
+
+#twitter's created_at format, ie "Wed Oct 10 20:19:24 +0000 2018"
+TWITTER_TIME_FORMAT = "%a %b %d %H:%M:%S %z %Y"
+
+#open (or create) a rollup store, returns the sqlite connection
+#counts in a store of an older version are dropped, so every file is counted again
+def open_rollup_store(filename):
+	conn = sqlite3.connect(filename)
+	conn.executescript("""
+		CREATE TABLE IF NOT EXISTS sources (
+			source_id INTEGER PRIMARY KEY, file TEXT UNIQUE, platform TEXT, datatype TEXT,
+			size INTEGER, mtime REAL, records INTEGER, no_timestamp INTEGER);
+		CREATE TABLE IF NOT EXISTS counts (
+			source_id INTEGER, hour INTEGER, kind TEXT, name TEXT, count INTEGER,
+			PRIMARY KEY (source_id, hour, kind, name)) WITHOUT ROWID;
+	""")
+	if conn.execute("PRAGMA user_version").fetchone()[0] != ROLLUP_VERSION:
+		with conn:
+			conn.execute("DELETE FROM counts")
+			conn.execute("DELETE FROM sources")
+			conn.execute("PRAGMA user_version = %d" % ROLLUP_VERSION)
+	return conn
+#end open_rollup_store
+
+#given a timestamp value from an object (twitter created_at, ISO 8601 like youtube's publishedAt,
+#or seconds since the epoch), return seconds since the epoch - or None if missing/unreadable
+def parse_timestamp(value):
+	if value is None or value == "":
+		return None
+	if isinstance(value, (int, float)):
+		return int(value)
+	try:
+		if value[0].isdigit():
+			return int(datetime.datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp())
+		return int(datetime.datetime.strptime(value, TWITTER_TIME_FORMAT).timestamp())
+	except ValueError:
+		return None
+#end parse_timestamp
+
+#given data objects (any iterable, looped once) and the timestamp field (list of nested keys), count
+#objects, unlabeled objects, narrative labels and components per hour - same counting as narrative_analysis
+#returns dictionary of (hour start, kind, name) -> count, where kind is "records", "unlabeled", "label"
+#or "comp" (name is '' for records/unlabeled), plus number of objects and number without a timestamp
+#(which are counted under UNKNOWN_HOUR)
+def count_hours(data, timestamp_field):
+	label_counts = defaultdict(int)		#(hour, label) -> count, split into components at the end
+	counts = defaultdict(int)
+	records = no_timestamp = 0
+	for item in data:
+		records += 1
+		timestamp = parse_timestamp(file_utils.get_field(item, timestamp_field))
+		if timestamp is None:
+			no_timestamp += 1
+			hour = UNKNOWN_HOUR
+		else:
+			hour = timestamp - timestamp % 3600
+		counts[(hour, "records", "")] += 1
+		labels = file_utils.get_field(item, ["extension", "socialsim_information_id"]) or [""]
+		if labels[0] == "":
+			counts[(hour, "unlabeled", "")] += 1
+		for label in labels:
+			label_counts[(hour, label)] += 1
+
+	for (hour, label), count in label_counts.items():
+		if label != "":
+			counts[(hour, "label", label)] += count
+		for comp in label.split('-'):
+			if comp != "":
+				counts[(hour, "comp", comp)] += count
+	return counts, records, no_timestamp
+#end count_hours
+
+#add a data file to the rollup store, or replace its counts if the file has changed since it was added
+#(files already in the store with the same size and modification time are skipped)
+#returns True if the file was counted, False if already up to date (see source_counts for what was counted)
+def update_rollup_store(conn, platform, datatype, filename, timestamp_field=None):
+	if timestamp_field is None:
+		timestamp_field = TIMESTAMP_FIELDS.get(platform, ["created_at"])
+	stat = os.stat(file_utils.split_tar_member(filename)[0])
+	path = os.path.abspath(filename)
+	row = conn.execute("SELECT source_id, size, mtime, platform, datatype FROM sources WHERE file = ?", (path,)).fetchone()
+	if row is not None and tuple(row[1:]) == (stat.st_size, stat.st_mtime, platform, datatype):
+		return False
+
+	#only load the fields we need
+	data = file_utils.stream_zipped_multi_json(filename, [timestamp_field, ["extension", "socialsim_information_id"]])
+	counts, records, no_timestamp = count_hours(data, timestamp_field)
+
+	#swap in the new counts in a single transaction (so an interrupted update leaves the old ones)
+	with conn:
+		if row is not None:
+			conn.execute("DELETE FROM counts WHERE source_id = ?", (row[0],))
+			conn.execute("DELETE FROM sources WHERE source_id = ?", (row[0],))
+		source_id = conn.execute("INSERT INTO sources (file, platform, datatype, size, mtime, records, no_timestamp) VALUES (?, ?, ?, ?, ?, ?, ?)",
+			(path, platform, datatype, stat.st_size, stat.st_mtime, records, no_timestamp)).lastrowid
+		conn.executemany("INSERT INTO counts VALUES (?, ?, ?, ?, ?)", ((source_id, hour, kind, name, count) for (hour, kind, name), count in counts.items()))
+	return True
+#end update_rollup_store
+
+#remove a data file's counts from the rollup store (ie, if it's been dropped from the config)
+def remove_rollup_source(conn, filename):
+	with conn:
+		conn.execute("DELETE FROM counts WHERE source_id IN (SELECT source_id FROM sources WHERE file = ?)", (os.path.abspath(filename),))
+		conn.execute("DELETE FROM sources WHERE file = ?", (os.path.abspath(filename),))
+#end remove_rollup_source
+
+#number of objects, and objects without a timestamp, counted for a data file (None if not in the store)
+def source_counts(conn, filename):
+	row = conn.execute("SELECT records, no_timestamp FROM sources WHERE file = ?", (os.path.abspath(filename),)).fetchone()
+	return tuple(row) if row is not None else None
+#end source_counts
+
+#get counts per bucket ("hour", "day" or "week") from the rollup store, summed over all source files
+#optionally only for a single platform/datatype
+#returns list of (platform, datatype, bucket start (seconds since epoch), kind, name, count), sorted
+#(objects without a timestamp are in bucket UNKNOWN_HOUR, which sorts first)
+def rollup(conn, bucket="day", platform=None, datatype=None):
+	size = BUCKET_SIZES[bucket]
+	offset = BUCKET_OFFSETS[bucket]
+	query = """SELECT s.platform, s.datatype, CASE WHEN c.hour = :unknown THEN :unknown ELSE ((c.hour - :offset) / :size) * :size + :offset END AS bucket, c.kind, c.name, SUM(c.count)
+		FROM counts c JOIN sources s ON c.source_id = s.source_id
+		WHERE (:platform IS NULL OR s.platform = :platform) AND (:datatype IS NULL OR s.datatype = :datatype)
+		GROUP BY s.platform, s.datatype, bucket, c.kind, c.name
+		ORDER BY s.platform, s.datatype, bucket, c.kind, c.name"""
+	return conn.execute(query, {"offset": offset, "size": size, "unknown": UNKNOWN_HOUR, "platform": platform, "datatype": datatype}).fetchall()
+#end rollup
+
+#save rollup rows (from rollup) to csv, with bucket start as a UTC date/time ("unknown" for objects without
+#a timestamp)
+def save_rollup_csv(rows, filename):
+	with open(filename, 'w', newline='') as f:
+		writer = csv.writer(f)
+		writer.writerow(["platform", "datatype", "bucket", "kind", "name", "count"])
+		for platform, datatype, bucket, kind, name, count in rows:
+			bucket = "unknown" if bucket == UNKNOWN_HOUR else datetime.datetime.fromtimestamp(bucket, datetime.timezone.utc).strftime("%Y-%m-%d %H:%M")
+			writer.writerow([platform, datatype, bucket, kind, name, count])
+#end save_rollup_csv
@@ -0,0 +1,300 @@
+#utility methods for approximate per-narrative account stats with fixed-size sketches
+#for every narrative label and component, a HyperLogLog sketch counts the distinct accounts (users,
+#channels) posting it, and a Count-Min sketch estimates how many objects each account posted - the
+#accounts with the highest estimates are kept as the narrative's top accounts
+#memory per label/component is fixed by the error bounds, not by the number of accounts, and two
+#sketches of the same parameters merge exactly (register max, counter sum) - so results of separate
+#files or file ranges can be combined
+#objects are buffered and added in batches, so hashing aside all updates are vectorized numpy ops
+
+import csv
+import math
+
+import numpy as np
+
+import index_utils
+
+#default account fields: tweet user, and video channel
+TWEET_ACCOUNT_FIELD = ["user", "id_str_h"]
+VIDEO_ACCOUNT_FIELD = ["snippet", "channelId_h"]
+
+#objects buffered before a batch update
+BATCH_SIZE = 100000
+
+#HyperLogLog precision (log2 of registers per label) limits
+MIN_PRECISION = 4
+MAX_PRECISION = 18
+
+#new empty sketch, for the objects of a single datatype
+#account_field: field holding each object's account id
+#distinct_error: relative standard error of the distinct account counts (HyperLogLog, 1.04/sqrt(registers))
+#top_error, top_confidence: account count estimates are at most top_error * (objects with that label)
+#too high, with probability top_confidence (Count-Min width e/top_error, depth ln(1/(1-top_confidence)))
+#top_k: number of top accounts kept per label/component
+def new_sketch(account_field, distinct_error=0.01, top_error=0.001, top_confidence=0.99, top_k=10):
+	precision = min(MAX_PRECISION, max(MIN_PRECISION, math.ceil(math.log2((1.04 / distinct_error) ** 2))))
+	width = math.ceil(math.e / top_error)
+	depth = max(1, math.ceil(math.log(1 / (1 - top_confidence))))
+	return {
+		"params": {"account_field": account_field, "precision": precision, "width": width, "depth": depth, "top_k": top_k},
+		"groups": {},		#("label"/"comp", name) -> row of the arrays below
+		"objects": np.zeros(0, dtype=np.int64),							#objects counted per group (exact)
+		"registers": np.zeros((0, 1 << precision), dtype=np.uint8),		#HyperLogLog registers per group
+		"counters": np.zeros((0, depth, width), dtype=np.uint32),		#Count-Min counters per group
+		"top_rows": np.zeros(0, dtype=np.int64),			#top account candidates: group row, account hash, account id
+		"top_hashes": np.zeros(0, dtype=np.uint64),
+		"top_ids": [],
+		"pending": [],		#(account id, labels) of objects not added yet
+		"label_rows": {},		#labels of an object -> group rows of its distinct labels and components (cache)
+	}
+#end new_sketch
+
+#add an object's account and narrative labels to the sketch (objects with no account or no label are skipped)
+def add_object(sketch, account, labels):
+	if account is None or labels[0] == "":
+		return
+	sketch['pending'].append((account, labels))
+	if len(sketch['pending']) >= BATCH_SIZE:
+		flush(sketch)
+#end add_object
+
+#row of a group, adding it (and growing the arrays) if new
+def group_row(sketch, key):
+	row = sketch['groups'].get(key)
+	if row is None:
+		row = sketch['groups'][key] = len(sketch['groups'])
+		if row == len(sketch['objects']):
+			grow(sketch, max(16, 2 * row))
+	return row
+#end group_row
+
+#grow the per-group arrays to the given number of rows
+def grow(sketch, rows):
+	for key in ["objects", "registers", "counters"]:
+		old = sketch[key]
+		sketch[key] = np.zeros((rows,) + old.shape[1:], dtype=old.dtype)
+		sketch[key][:len(old)] = old
+#end grow
+
+#add all pending objects to the sketch
+def flush(sketch):
+	if not sketch['pending']:
+		return
+	rows = []
+	hashes = []
+	ids = []
+	for account, labels in sketch['pending']:
+		labels = tuple(labels)
+		object_rows = sketch['label_rows'].get(labels)
+		if object_rows is None:
+			object_rows = sketch['label_rows'][labels] = label_group_rows(sketch, labels)
+		rows.extend(object_rows)
+		hashes.extend([index_utils.id_hash(account)] * len(object_rows))
+		ids.extend([account] * len(object_rows))
+	sketch['pending'] = []
+	rows = np.array(rows, dtype=np.int64)
+	hashes = np.array(hashes, dtype=np.uint64)
+
+	#exact object counts, and Count-Min counters (one counter per depth row, counted as flat counter indexes)
+	sketch['objects'] += np.bincount(rows, minlength=len(sketch['objects']))
+	p = sketch['params']
+	flat = (rows[:, None] * p['depth'] + np.arange(p['depth'])[None, :]) * p['width'] + counter_columns(sketch, hashes)
+	counters = sketch['counters'].reshape(-1)
+	counter_index, counts = np.unique(flat, return_counts=True)
+	counters[counter_index] += counts.astype(np.uint32)
+	update_registers(sketch, rows, hashes)
+	update_top(sketch, rows, hashes, ids)
+#end flush
+
+#group rows of the distinct labels and components of an object's labels
+def label_group_rows(sketch, labels):
+	labels = set(labels) - set([""])
+	comps = set(comp for label in labels for comp in label.split('-')) - set([""])
+	return [group_row(sketch, ("label", label)) for label in sorted(labels)] + [group_row(sketch, ("comp", comp)) for comp in sorted(comps)]
+#end label_group_rows
+
+#HyperLogLog update: the first precision bits of the hash pick the register, which keeps the highest
+#position of the first 1 bit in the rest of the hash
+def update_registers(sketch, rows, hashes):
+	precision = sketch['params']['precision']
+	register = (hashes >> np.uint64(64 - precision)).astype(np.int64)
+	rest = hashes & np.uint64((1 << (64 - precision)) - 1)
+	rank = (64 - precision) - bit_length(rest) + 1
+	np.maximum.at(sketch['registers'], (rows, register), rank.astype(np.uint8))
+#end update_registers
+
+#number of bits in each value of a uint64 array (0 for 0)
+def bit_length(values):
+	values = values.copy()
+	length = np.zeros(len(values), dtype=np.int64)
+	for shift in [32, 16, 8, 4, 2, 1]:
+		big = values >= np.uint64(1 << shift)
+		length[big] += shift
+		values[big] >>= np.uint64(shift)
+	return length + (values > 0)
+#end bit_length
+
+#Count-Min counter column of each hash in each row (depth columns per hash, from two halves of the hash)
+def counter_columns(sketch, hashes):
+	low = hashes & np.uint64(0xffffffff)
+	high = (hashes >> np.uint64(32)) | np.uint64(1)
+	rows = np.arange(sketch['params']['depth'], dtype=np.uint64)
+	return ((low[:, None] + rows[None, :] * high[:, None]) % np.uint64(sketch['params']['width'])).astype(np.int64)
+#end counter_columns
+
+#Count-Min estimate of each (group row, account hash) pair: smallest of its counters
+def estimate_counts(sketch, rows, hashes):
+	columns = counter_columns(sketch, hashes)
+	return sketch['counters'][rows[:, None], np.arange(sketch['params']['depth'])[None, :], columns].min(axis=1)
+#end estimate_counts
+
+#update the top account candidates with the accounts of a batch: re-estimate the old candidates and
+#the batch's accounts, and keep the top_k of each group (ties broken by hash, so results are repeatable)
+def update_top(sketch, rows, hashes, ids):
+	rows = np.concatenate([sketch['top_rows'], rows])
+	hashes = np.concatenate([sketch['top_hashes'], hashes])
+	ids = sketch['top_ids'] + list(ids)
+
+	#distinct (group, account) pairs
+	order = np.lexsort((hashes, rows))
+	rows = rows[order]
+	hashes = hashes[order]
+	first = np.concatenate([[True], (rows[1:] != rows[:-1]) | (hashes[1:] != hashes[:-1])]) if len(rows) else np.zeros(0, dtype=bool)
+	keep = order[first]
+	rows = rows[first]
+	hashes = hashes[first]
+
+	#highest estimates first within each group, top_k per group
+	counts = estimate_counts(sketch, rows, hashes).astype(np.int64)
+	order = np.lexsort((hashes, -counts, rows))
+	rows = rows[order]
+	group_start = np.searchsorted(rows, rows, side='left')
+	top = (np.arange(len(rows)) - group_start) < sketch['params']['top_k']
+	order = order[top]
+	sketch['top_rows'] = rows[top]
+	sketch['top_hashes'] = hashes[order]
+	sketch['top_ids'] = [ids[i] for i in keep[order].tolist()]
+#end update_top
+
+#merge two sketches of the same parameters into a new one (for the same datatype in different files)
+def merge_sketches(a, b):
+	flush(a)
+	flush(b)
+	if a['params'] != b['params']:
+		raise ValueError("can't merge sketches with different parameters: %s and %s" % (a['params'], b['params']))
+	p = a['params']
+	merged = new_sketch(p['account_field'], top_k=p['top_k'])
+	merged['params'] = dict(p)
+	for key in ["registers", "counters"]:
+		merged[key] = merged[key].reshape((0,) + a[key].shape[1:])
+	for key in list(a['groups']) + [key for key in b['groups'] if key not in a['groups']]:
+		group_row(merged, key)
+	for sketch in [a, b]:
+		rows = np.array([merged['groups'][key] for key in sketch['groups']], dtype=np.int64)
+		src = np.array(list(sketch['groups'].values()), dtype=np.int64)
+		merged['objects'][rows] += sketch['objects'][src]
+		merged['registers'][rows] = np.maximum(merged['registers'][rows], sketch['registers'][src])
+		merged['counters'][rows] += sketch['counters'][src]
+
+	#re-estimate both sides' candidates against the merged counters
+	remap = [np.zeros(len(sketch['objects']), dtype=np.int64) for sketch in [a, b]]
+	for i, sketch in enumerate([a, b]):
+		for key, row in sketch['groups'].items():
+			remap[i][row] = merged['groups'][key]
+	rows = np.concatenate([remap[0][a['top_rows']], remap[1][b['top_rows']]])
+	hashes = np.concatenate([a['top_hashes'], b['top_hashes']])
+	update_top(merged, rows, hashes, a['top_ids'] + b['top_ids'])
+	return merged
+#end merge_sketches
+
+#HyperLogLog distinct count estimate of every group row
+#uses Ertl's improved estimator (from the register value histogram), which has no bias in the mid range
+#between small (linear counting) and large cardinalities, so no empirical bias correction is needed
+def distinct_counts(sketch):
+	registers = sketch['registers'][:len(sketch['groups'])]
+	m = registers.shape[1]
+	q = 64 - sketch['params']['precision']
+	estimates = []
+	for row in registers:
+		hist = np.bincount(row, minlength=q+2).tolist()
+		if hist[0] == m:
+			estimates.append(0)
+			continue
+		z = m * hll_tau(1 - hist[q+1] / m)
+		for k in range(q, 0, -1):
+			z = 0.5 * (z + hist[k])
+		z += m * hll_sigma(hist[0] / m)
+		estimates.append(int(round(m * m / (2 * math.log(2) * z))))
+	return np.array(estimates, dtype=np.int64)
+#end distinct_counts
+
+#sigma and tau series of the improved estimator (for the empty and saturated registers)
+def hll_sigma(x):
+	if x == 1:
+		return math.inf
+	y = 1
+	z = x
+	while True:
+		x = x * x
+		z_old = z
+		z += x * y
+		y += y
+		if z == z_old:
+			return z
+#end hll_sigma
+
+def hll_tau(x):
+	if x == 0 or x == 1:
+		return 0
+	y = 1
+	z = 1 - x
+	while True:
+		x = math.sqrt(x)
+		z_old = z
+		y *= 0.5
+		z -= (1 - x) ** 2 * y
+		if z == z_old:
+			return z / 3
+#end hll_tau
+
+#results of a sketch: dictionary of "label_stats" and "comp_stats", each label/component ->
+#{objects, distinct_accounts, top_accounts: list of [account, estimated objects]}, plus the sketch params
+def sketch_results(sketch):
+	flush(sketch)
+	distinct = distinct_counts(sketch).tolist()
+	top = {}
+	for row, account, count in zip(sketch['top_rows'].tolist(), sketch['top_ids'], estimate_counts(sketch, sketch['top_rows'], sketch['top_hashes']).tolist()):
+		top.setdefault(row, []).append([account, count])
+	res = {"params": sketch['params'], "label_stats": {}, "comp_stats": {}}
+	for (kind, name), row in sorted(sketch['groups'].items()):
+		res[kind + "_stats"][name] = {"objects": int(sketch['objects'][row]), "distinct_accounts": distinct[row], "top_accounts": top.get(row, [])}
+	return res
+#end sketch_results
+
+#save sketch results of a platform (datatype -> sketch_results) next to its frequency csvs:
+#  <filename>_distinct_labels.csv, _distinct_components.csv: estimated distinct accounts of each label/component
+#  (rows), for each datatype (columns) - labels/components in the given order
+#  <filename>_top_accounts.csv: top accounts of each label/component and datatype, with their estimated number
+#  of objects and the max over-estimate (top_error * objects of the label)
+def save_sketch_results(datatype_res, labels, components, filename):
+	for kind, names, name_field, suffix in [("label", labels, "narrative_label", "labels"), ("comp", components, "narrative_components", "components")]:
+		with open("%s_distinct_%s.csv" % (filename, suffix), 'w', newline='') as f:
+			writer = csv.writer(f)
+			writer.writerow([name_field] + [datatype + "_distinct_accounts" for datatype in datatype_res])
+			for name in names:
+				writer.writerow([name] + [res[kind + "_stats"].get(name, {}).get("distinct_accounts", 0) for res in datatype_res.values()])
+
+	with open(filename + "_top_accounts.csv", 'w', newline='') as f:
+		writer = csv.writer(f)
+		writer.writerow(["type", "narrative", "datatype", "rank", "account", "objects_estimate", "max_error"])
+		for kind, names, type_name in [("label", labels, "label"), ("comp", components, "component")]:
+			for name in names:
+				for datatype, res in datatype_res.items():
+					stats = res[kind + "_stats"].get(name)
+					if stats is None:
+						continue
+					top_error = math.e / res['params']['width']
+					for rank, (account, count) in enumerate(stats['top_accounts'], 1):
+						writer.writerow([type_name, name, datatype, rank, account, count, math.ceil(top_error * stats['objects'])])
+	print("Account sketches saved to %s_distinct_labels.csv, %s_distinct_components.csv and %s_top_accounts.csv" % (filename, filename, filename))
+#end save_sketch_results
@@ -0,0 +1,327 @@
+#utility methods for a compact in-memory record store: only the chosen fields of each object, kept as a
+#handful of flat numpy arrays instead of a list of dictionaries
+#  ids:     id_h of every record, as one utf-8 byte buffer + offsets (empty for records without an id)
+#  labels:  narrative labels interned to integer ids (distinct label strings kept once), + offsets
+#  columns: other fields (ie text), one utf-8 byte buffer of values + offsets per field
+#a store is a dictionary of arrays (plus small lists), so it pickles with protocol 5 out-of-band buffers:
+#save_record_store writes the pickle stream followed by the raw array buffers, and load_record_store memory
+#maps the file and hands those buffers straight back to the arrays - reloading copies nothing
+#load_data.narrative_analysis and search_narrative_keywords accept a store in place of a list of objects
+#records are decoded from the buffers a batch at a time as they're looped over, never all at once
+
+import array
+import hashlib
+import json
+import mmap
+import os
+import pickle
+import struct
+
+import numpy as np
+
+import file_utils
+
+#store format version (stores of another version are rebuilt)
+STORE_FORMAT = "record_store"
+STORE_VERSION = 2
+
+#id and narrative label fields (always stored)
+ID_FIELD = ["id_h"]
+LABEL_FIELD = ["extension", "socialsim_information_id"]
+
+#kinds of column values, per record
+MISSING = 0		#field not in object (or null)
+STRING = 1		#single string value
+STRING_LIST = 2		#list of strings, one value each
+JSON = 3		#anything else, stored as its json text
+
+#file layout: magic, header length, header (json: pickle length and buffer offsets/lengths), pickle stream,
+#then each out-of-band buffer at an aligned offset (so arrays map straight onto the file)
+STORE_MAGIC = b"RSTORE01"
+BUFFER_ALIGN = 64
+
+#records decoded at a time when looping over a store (iter_records, store_search_texts, iter_batched), so
+#only one batch of python strings exists at once
+STORE_BATCH = 10000
+
+#build a record store from an iterable of objects (looped once), keeping the ids, narrative labels and
+#the given fields of each object
+def build_record_store(data, fields=()):
+	fields = [list(field) for field in fields if list(field) not in (ID_FIELD, LABEL_FIELD)]
+	ids = bytearray()
+	id_offsets = array.array('q', [0])
+	label_names = {}		#label -> label id
+	label_ids = array.array('i')
+	label_offsets = array.array('q', [0])
+	missing_labels = 0
+	builders = [{"kinds": array.array('b'), "record_offsets": array.array('q', [0]), "value_offsets": array.array('q', [0]), "values": bytearray()} for field in fields]
+
+	for item in data:
+		record_id = file_utils.get_field(item, ID_FIELD)
+		if record_id is not None:
+			ids += str(record_id).encode('utf-8')
+		id_offsets.append(len(ids))
+
+		labels = file_utils.get_field(item, LABEL_FIELD)
+		if labels is None:
+			missing_labels += 1
+			labels = []
+		label_ids.extend(label_names.setdefault(label, len(label_names)) for label in labels)
+		label_offsets.append(len(label_ids))
+
+		for field, builder in zip(fields, builders):
+			add_value(builder, file_utils.get_field(item, field))
+
+	labels = [None] * len(label_names)
+	for label, label_id in label_names.items():
+		labels[label_id] = label
+	store = {
+		"format": STORE_FORMAT,
+		"version": STORE_VERSION,
+		"num_records": len(id_offsets) - 1,
+		"ids": np.frombuffer(ids, dtype=np.uint8),
+		"id_offsets": np.frombuffer(id_offsets, dtype=np.int64),
+		"labels": labels,
+		"label_ids": np.frombuffer(label_ids, dtype=np.int32),
+		"label_offsets": np.frombuffer(label_offsets, dtype=np.int64),
+		"missing_labels": missing_labels,
+		"columns": {},
+	}
+	for field, builder in zip(fields, builders):
+		store['columns'][".".join(field)] = {
+			"field": field,
+			"kinds": np.frombuffer(builder['kinds'], dtype=np.int8),
+			"record_offsets": np.frombuffer(builder['record_offsets'], dtype=np.int64),
+			"value_offsets": np.frombuffer(builder['value_offsets'], dtype=np.int64),
+			"values": np.frombuffer(builder['values'], dtype=np.uint8),
+		}
+	return store
+#end build_record_store
+
+#add a single record's value of a field to a column builder
+def add_value(builder, value):
+	if value is None:
+		kind, values = MISSING, []
+	elif isinstance(value, str):
+		kind, values = STRING, [value]
+	elif isinstance(value, list) and all(isinstance(v, str) for v in value):
+		kind, values = STRING_LIST, value
+	else:
+		kind, values = JSON, [json.dumps(value)]
+	builder['kinds'].append(kind)
+	for v in values:
+		builder['values'] += v.encode('utf-8')
+		builder['value_offsets'].append(len(builder['values']))
+	builder['record_offsets'].append(len(builder['value_offsets']) - 1)
+#end add_value
+
+#is data a record store?
+def is_record_store(data):
+	return isinstance(data, dict) and data.get('format') == STORE_FORMAT
+#end is_record_store
+
+#split a byte buffer (numpy uint8 array) into strings at the given offsets (only the bytes between the
+#first and last offset are read)
+def decode_strings(buffer, offsets):
+	offsets = offsets.tolist()
+	base = offsets[0]
+	data = buffer[base:offsets[-1]].tobytes()
+	return [data[start-base:end-base].decode('utf-8') for start, end in zip(offsets[:-1], offsets[1:])]
+#end decode_strings
+
+#(start, end) record number ranges of STORE_BATCH records covering the whole store
+def batch_ranges(store):
+	for start in range(0, store['num_records'], STORE_BATCH):
+		yield start, min(start + STORE_BATCH, store['num_records'])
+#end batch_ranges
+
+#yield the values of every record one at a time, decoding STORE_BATCH records at a time with the given
+#function (store_ids, store_labels or column_values, plus any extra arguments)
+def iter_batched(store, func, *args):
+	for start, end in batch_ranges(store):
+		yield from func(store, *args, start=start, end=end)
+#end iter_batched
+
+#ids of records start to end (list of strings, in record order - all records by default)
+def store_ids(store, start=0, end=None):
+	end = store['num_records'] if end is None else end
+	return decode_strings(store['ids'], store['id_offsets'][start:end+1])
+#end store_ids
+
+#narrative labels of records start to end (list of lists of strings, in record order - all records by default)
+def store_labels(store, start=0, end=None):
+	end = store['num_records'] if end is None else end
+	labels = store['labels']
+	offsets = store['label_offsets'][start:end+1].tolist()
+	base = offsets[0]
+	label_ids = store['label_ids'][base:offsets[-1]].tolist()
+	return [[labels[label_id] for label_id in label_ids[first-base:last-base]] for first, last in zip(offsets[:-1], offsets[1:])]
+#end store_labels
+
+#values of a field (one of the store's columns) for records start to end (all records by default), same
+#as get_field on the original objects
+def column_values(store, field, start=0, end=None):
+	end = store['num_records'] if end is None else end
+	column = store['columns'][".".join(field)]
+	offsets = column['record_offsets'][start:end+1].tolist()
+	base = offsets[0]
+	values = decode_strings(column['values'], column['value_offsets'][base:offsets[-1]+1])
+	res = []
+	for kind, first, last in zip(column['kinds'][start:end].tolist(), offsets[:-1], offsets[1:]):
+		if kind == MISSING:
+			res.append(None)
+		elif kind == STRING:
+			res.append(values[first-base])
+		elif kind == STRING_LIST:
+			res.append(values[first-base:last-base])
+		else:
+			res.append(json.loads(values[first-base]))
+	return res
+#end column_values
+
+#yield the records of a store as dictionaries (stored fields only, same nesting as the original objects)
+#records with no narrative labels field get an empty label list, records without an id get no id field
+#(decoded STORE_BATCH records at a time)
+def iter_records(store, fields=None):
+	fields = [field for field in (fields or [column['field'] for column in store['columns'].values()]) if field not in (ID_FIELD, LABEL_FIELD)]
+	for start, end in batch_ranges(store):
+		columns = [column_values(store, field, start, end) for field in fields]
+		for i, (record_id, labels) in enumerate(zip(store_ids(store, start, end), store_labels(store, start, end))):
+			item = {}
+			if record_id != "":
+				file_utils.set_field(item, ID_FIELD, record_id)
+			file_utils.set_field(item, LABEL_FIELD, labels)
+			for field, values in zip(fields, columns):
+				if values[i] is not None:
+					file_utils.set_field(item, field, values[i])
+			yield item
+#end iter_records
+
+#texts to search in each record, same as keyword_utils.search_texts on the original objects: one per field,
+#lowercased, lists joined by spaces, stopping at the first missing field - yields a list of texts per record
+#(decoded STORE_BATCH records at a time)
+def store_search_texts(store, fields):
+	for start, end in batch_ranges(store):
+		columns = [column_values(store, field, start, end) for field in fields]
+		for i in range(end - start):
+			texts = []
+			for values in columns:
+				text = values[i]
+				if text is None:
+					break
+				if isinstance(text, list):
+					text = ' '.join(text)
+				texts.append(text.lower())
+			yield texts
+#end store_search_texts
+
+#new (in memory) record store with only the given records (array of record numbers, in the order given)
+def take_records(store, record_nums):
+	record_nums = np.asarray(record_nums, dtype=np.int64)
+	res = dict(store, columns={})
+	res.pop('source', None)
+	res['num_records'] = len(record_nums)
+	res['ids'], res['id_offsets'] = take_ragged(store['ids'], store['id_offsets'], record_nums)
+	res['label_ids'], res['label_offsets'] = take_ragged(store['label_ids'], store['label_offsets'], record_nums)
+	for name, column in store['columns'].items():
+		value_nums, record_offsets = take_ragged(np.arange(len(column['value_offsets']) - 1), column['record_offsets'], record_nums)
+		values, value_offsets = take_ragged(column['values'], column['value_offsets'], value_nums)
+		res['columns'][name] = {"field": column['field'], "kinds": column['kinds'][record_nums], "record_offsets": record_offsets, "value_offsets": value_offsets, "values": values}
+	return res
+#end take_records
+
+#given a flat array split into runs by offsets (run i is values[offsets[i]:offsets[i+1]]), return the
+#values and offsets of just the given runs
+def take_ragged(values, offsets, nums):
+	starts = offsets[nums]
+	lengths = offsets[nums + 1] - starts
+	new_offsets = np.zeros(len(nums) + 1, dtype=np.int64)
+	np.cumsum(lengths, out=new_offsets[1:])
+	positions = np.repeat(starts - new_offsets[:-1], lengths) + np.arange(new_offsets[-1])
+	return values[positions], new_offsets
+#end take_ragged
+
+#save a record store to file: pickle protocol 5, with the array buffers written out-of-band after the
+#pickle stream (aligned), so load_record_store can map them instead of reading/copying
+def save_record_store(store, filename):
+	buffers = []
+	stream = pickle.dumps(store, protocol=5, buffer_callback=buffers.append)
+	raws = [buffer.raw() for buffer in buffers]
+
+	#buffer positions, after the header and pickle stream
+	header = {"pickle_length": len(stream), "buffers": []}
+	header_length = 4096
+	while True:
+		pos = align(len(STORE_MAGIC) + 8 + header_length + len(stream))
+		header['buffers'] = []
+		for raw in raws:
+			header['buffers'].append([pos, raw.nbytes])
+			pos = align(pos + raw.nbytes)
+		header_bytes = json.dumps(header).encode('utf-8')
+		if len(header_bytes) <= header_length:
+			break
+		header_length = 2 * len(header_bytes)
+
+	with open(filename + ".tmp", 'wb') as f:
+		f.write(STORE_MAGIC)
+		f.write(struct.pack("<q", header_length))
+		f.write(header_bytes.ljust(header_length, b" "))
+		f.write(stream)
+		for (pos, length), raw in zip(header['buffers'], raws):
+			f.write(b"\0" * (pos - f.tell()))
+			f.write(raw)
+	os.replace(filename + ".tmp", filename)		#never leave a half-written store behind
+#end save_record_store
+
+#round a file position up to the buffer alignment
+def align(pos):
+	return (pos + BUFFER_ALIGN - 1) // BUFFER_ALIGN * BUFFER_ALIGN
+#end align
+
+#load a record store saved by save_record_store - the arrays are read-only views of the memory mapped file
+#(pages are only read from disk as they're used)
+def load_record_store(filename):
+	with open(filename, 'rb') as f:
+		if os.path.getsize(filename) == 0 or f.read(len(STORE_MAGIC)) != STORE_MAGIC:
+			raise ValueError("%s is not a record store file" % filename)
+		file_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+	view = memoryview(file_map)
+	header_length = struct.unpack("<q", view[len(STORE_MAGIC):len(STORE_MAGIC)+8])[0]
+	start = len(STORE_MAGIC) + 8
+	header = json.loads(bytes(view[start:start+header_length]))
+	start += header_length
+	buffers = [view[pos:pos+length] for pos, length in header['buffers']]
+	store = pickle.loads(view[start:start+header['pickle_length']], buffers=buffers)
+	if not is_record_store(store):
+		raise ValueError("%s is not a record store file" % filename)
+	return store
+#end load_record_store
+
+#given a .json.gz with multiple json objects and a list of fields, return a record store of them
+#the store is cached in cache_dir the first time, and later calls map the cached file instead (rebuilt if the
+#source file's size or mtime changes, or the store format changes) - same idea as file_utils.load_cached_zipped_multi_json
+def load_cached_record_store(filename, fields, cache_dir="./data/cache"):
+	stat = os.stat(file_utils.split_tar_member(filename)[0])
+	source = {"path": os.path.abspath(filename), "size": stat.st_size, "mtime": stat.st_mtime, "fields": fields}
+	key = hashlib.md5(json.dumps([source['path'], fields]).encode('utf-8')).hexdigest()[:12]
+	cache_file = os.path.join(cache_dir, "%s.%s.store" % (os.path.basename(filename), key))
+
+	#use the cache if it was built from this exact version of the file
+	if file_utils.verify_file(cache_file):
+		try:
+			store = load_record_store(cache_file)
+		except (ValueError, pickle.UnpicklingError, EOFError):
+			store = None
+		if store is not None and store['version'] == STORE_VERSION and store.get('source') == source:
+			if file_utils.DISPLAY:
+				print("Loading", filename, "from cache", cache_file)
+			return store
+
+	if file_utils.DISPLAY:
+		print("Caching", filename, "to", cache_file)
+	file_utils.verify_dir(cache_dir)
+	store = build_record_store(file_utils.stream_zipped_multi_json(filename, [ID_FIELD, LABEL_FIELD] + fields), fields)
+	store['source'] = source
+	save_record_store(store, cache_file)
+	return load_record_store(cache_file)
+#end load_cached_record_store
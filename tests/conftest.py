@@ -0,0 +1,6 @@
+#test setup: the modules live in the repo root, not a package, so make them importable from the tests
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
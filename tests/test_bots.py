@@ -0,0 +1,43 @@
+#tests for bot_utils: looking up a batch of users' bot scores
+
+import numpy as np
+
+import bot_utils
+
+def test_user_hashes_independent_of_batch(monkeypatch):
+	ids = ["a", "bb", "u12345", "é"]
+	single = [int(bot_utils.user_hashes([record_id])[0]) for record_id in ids]
+	assert bot_utils.user_hashes(ids).tolist() == single
+	assert bot_utils.user_hashes(["a", "a much longer id"])[0] == single[0]
+	assert len(bot_utils.user_hashes([])) == 0
+	#hashed in chunks
+	monkeypatch.setattr(bot_utils, "HASH_CHUNK", 3)
+	assert bot_utils.user_hashes(ids).tolist() == single
+	assert bot_utils.user_hashes(np.array(ids, dtype=object)).tolist() == single
+#end test_user_hashes_independent_of_batch
+
+def test_lookup_scores():
+	keys = bot_utils.user_hashes(["u1", "user2"])
+	order = np.argsort(keys)
+	bot_scores = {"keys": keys[order], "scores": np.array([0.1, 0.9], dtype=np.float32)[order]}
+	scores = bot_utils.lookup_scores(bot_scores, ["user2", None, "u3", "u1"])
+	assert np.allclose(scores[[0, 3]], [0.9, 0.1])
+	assert np.isnan(scores[[1, 2]]).all()
+#end test_lookup_scores
+
+#users in both files resolved, with the ids hashed a couple at a time while reading
+def test_load_bot_scores(tmp_path, monkeypatch):
+	import gzip
+	import json
+
+	files = []
+	for name, rows in [("en", [("u1", 0.2), ("u2", 0.5), ("u3", 0.1)]), ("ar", [("u2", 0.9), ("u4", 0.3), (None, 0.4)])]:
+		files.append((str(tmp_path / ("%s.json.gz" % name)), ["scores", name]))
+		with gzip.open(files[-1][0], 'wt', encoding='utf-8') as f:
+			for user_id, score in rows:
+				f.write(json.dumps({"user": {"id_str_h": user_id}, "scores": {name: score}}) + "\n")
+	monkeypatch.setattr(bot_utils, "HASH_CHUNK", 2)
+	bot_scores = bot_utils.load_bot_scores(files, resolve="max")
+	assert bot_scores['stats']['users'] == 4 and bot_scores['stats']['overlapping_users'] == 1
+	assert np.allclose(bot_utils.lookup_scores(bot_scores, ["u1", "u2", "u3", "u4"]), [0.2, 0.9, 0.1, 0.3])
+#end test_load_bot_scores
@@ -0,0 +1,83 @@
+#tests for dedup_utils, and the freq --dedup runs that use it
+
+import csv
+import gzip
+import json
+import os
+
+import pytest
+
+import dedup_utils
+import load_data
+
+#write a list of objects to a .json.gz file, one json object per line
+def write_json_gz(filename, objects):
+	with gzip.open(filename, 'wt', encoding='utf-8') as f:
+		for obj in objects:
+			f.write(json.dumps(obj) + "\n")
+#end write_json_gz
+
+#tweets with a repeated id, plus a retweet chain and bot scores without any ids
+def make_twitter_data(data_dir):
+	labels = ["a", "b", "a-b", "a", "b"]
+	tweets = [{"id_h": "t%d" % i, "extension": {"socialsim_information_id": [label]}} for i, label in enumerate(labels)]
+	tweets.append(dict(tweets[2]))		#duplicate of t2
+	chain = [{"tweet_id_h": "t%d" % i, "retweeted_from_tweet_id_h": "t0"} for i in range(1, 4)]
+	bots = [{"user": {"id_str_h": "u%d" % i}, "scores": {"english": 0.1*i}} for i in range(4)]
+	files = {"tweets": os.path.join(data_dir, "tweets.json.gz"), "retweet_chain": os.path.join(data_dir, "chain.json.gz"), "botometer_en": os.path.join(data_dir, "bot_en.json.gz")}
+	write_json_gz(files['tweets'], tweets)
+	write_json_gz(files['retweet_chain'], chain)
+	write_json_gz(files['botometer_en'], bots)
+	return files
+#end make_twitter_data
+
+def test_records_without_id_pass_through():
+	records = [{"id_h": "a"}, {"x": 1}, {"id_h": "a"}, {"id_h": ""}, {"x": 2}, {"id_h": "b"}]
+	expected = [records[0], records[1], records[3], records[4], records[5]]
+	for dedup in ["memory", "disk"]:
+		report = dedup_utils.new_dedup_report(dedup, True)
+		if dedup == "memory":
+			res = list(dedup_utils.dedup_records(records, check_content=True, report=report))
+		else:
+			res = list(dedup_utils.dedup_records_on_disk(lambda: records, check_content=True, report=report, num_partitions=4))
+		assert res == expected
+		assert (report['records'], report['no_id'], report['unique_ids'], report['duplicate_records']) == (6, 3, 2, 1)
+#end test_records_without_id_pass_through
+
+def test_store_records_without_id_pass_through():
+	import store_utils
+
+	records = [{"id_h": "a"}, {"x": 1}, {"id_h": "a"}, {"x": 2}, {"id_h": "b"}]
+	store = store_utils.build_record_store(records)
+	report = dedup_utils.new_dedup_report("store", False)
+	deduped = dedup_utils.dedup_store(store, report=report)
+	assert store_utils.store_ids(deduped) == ["a", "", "", "b"]
+	assert [sorted(record) for record in store_utils.iter_records(deduped)] == [["extension", "id_h"], ["extension"], ["extension"], ["extension", "id_h"]]
+	assert (report['records'], report['no_id'], report['unique_ids'], report['duplicate_records']) == (5, 2, 2, 1)
+#end test_store_records_without_id_pass_through
+
+def test_freq_dedup_disk(tmp_path):
+	files = make_twitter_data(str(tmp_path))
+	config = {"platforms": {"Twitter": files}, "results_dir": str(tmp_path / "results")}
+	os.makedirs(config['results_dir'])
+	config_file = str(tmp_path / "config.json")
+	with open(config_file, 'w') as f:
+		json.dump(config, f)
+
+	load_data.main(["--config", config_file, "freq", "--dedup", "disk"])
+
+	with open(os.path.join(config['results_dir'], "dedup_report.json")) as f:
+		report = json.load(f)['Twitter']
+	assert (report['tweets']['records'], report['tweets']['duplicate_records'], report['tweets']['unique_ids']) == (6, 1, 5)
+	assert (report['retweet_chain']['records'], report['retweet_chain']['no_id']) == (3, 3)
+	assert (report['botometer_en']['records'], report['botometer_en']['no_id']) == (4, 4)
+
+	with open(os.path.join(config['results_dir'], "twitter_freq_narrative_labels.csv"), newline='') as f:
+		freq = {row['narrative_label']: int(row['tweets_freq']) for row in csv.DictReader(f)}
+	assert freq == {"a": 2, "b": 2, "a-b": 1}
+#end test_freq_dedup_disk
+
+def test_freq_parallel_rejects_dedup(tmp_path):
+	with pytest.raises(SystemExit):
+		load_data.main(["--config", str(tmp_path / "config.json"), "freq", "--parallel", "--dedup", "memory"])
+#end test_freq_parallel_rejects_dedup
@@ -0,0 +1,132 @@
+#tests for file_utils: the pipelined gzip reader gives the same lines (and errors) as the plain one
+
+import gzip
+import os
+
+import pytest
+
+import file_utils
+
+#lines of a file as read by the plain gzip reader (open_zipped), newlines removed
+def plain_lines(filename):
+	with file_utils.open_zipped(filename) as f:
+		return [line.rstrip(b"\n") for line in f]
+#end plain_lines
+
+#lines of a file as read by the pipelined reader, with small blocks to split lines and padding across reads
+def pipelined_lines(filename, block_size=7):
+	return list(file_utils.stream_zipped_multi_json_pipelined(filename, lambda line: line, block_size=block_size))
+#end pipelined_lines
+
+#write gzip data (bytes) to a file, return its name
+def write_file(tmp_path, data):
+	filename = str(tmp_path / "data.json.gz")
+	with open(filename, 'wb') as f:
+		f.write(data)
+	return filename
+#end write_file
+
+def test_padded_members(tmp_path):
+	data = gzip.compress(b'{"a": 1}\n{"a": 2}\n') + b"\x00" * 20 + gzip.compress(b'{"a": 3}\n') + b"\x00" * 3
+	filename = write_file(tmp_path, data)
+	assert pipelined_lines(filename) == plain_lines(filename) == [b'{"a": 1}', b'{"a": 2}', b'{"a": 3}']
+	assert pipelined_lines(filename, block_size=1024) == plain_lines(filename)
+#end test_padded_members
+
+def test_truncated_member(tmp_path):
+	data = gzip.compress(b'{"a": 1}\n' * 100)
+	filename = write_file(tmp_path, data[:len(data)-10])
+	with pytest.raises(EOFError):
+		plain_lines(filename)
+	with pytest.raises(EOFError):
+		pipelined_lines(filename)
+#end test_truncated_member
+
+def test_blank_lines(tmp_path):
+	filename = write_file(tmp_path, gzip.compress(b'{"a": 1}\n\n  \n{"a": 2}\n\n{"a": 3}'))
+	assert pipelined_lines(filename) == plain_lines(filename) == [b'{"a": 1}', b'', b'  ', b'{"a": 2}', b'', b'{"a": 3}']
+#end test_blank_lines
+
+def test_empty_file(tmp_path):
+	filename = write_file(tmp_path, b"")
+	assert pipelined_lines(filename) == plain_lines(filename) == []
+#end test_empty_file
+
+def test_combine_csv_list(tmp_path):
+	files = []
+	for i, text in enumerate(["a,b\n1,2\n", "b,a\n4,3", "a,b\n5,6\n"]):
+		files.append(str(tmp_path / ("part%d.csv" % i)))
+		with open(files[-1], 'w') as f:
+			f.write(text)
+	combined = str(tmp_path / "combined.csv")
+	file_utils.combine_csv_list(files, combined)
+	with open(combined, encoding='utf-8-sig') as f:
+		assert f.read() == "a,b\n1,2\n3,4\n5,6\n"
+#end test_combine_csv_list
+
+def test_combine_csv_list_failure(tmp_path):
+	files = [str(tmp_path / "part0.csv"), str(tmp_path / "part1.csv")]
+	with open(files[0], 'w') as f:
+		f.write("a,b\n1,2\n")
+	with open(files[1], 'w') as f:
+		f.write("a,c\n1,2\n")
+	combined = str(tmp_path / "combined.csv")
+	with pytest.raises(ValueError):
+		file_utils.combine_csv_list(files, combined)
+	with pytest.raises(FileNotFoundError):
+		file_utils.combine_csv_list([str(tmp_path / "missing.csv")], combined)
+	assert sorted(os.listdir(str(tmp_path))) == ["part0.csv", "part1.csv"]
+#end test_combine_csv_list_failure
+
+def test_combine_csv_list_parquet_failure(tmp_path):
+	files = [str(tmp_path / "part0.csv"), str(tmp_path / "part1.csv")]
+	with open(files[0], 'w') as f:
+		f.write("a,b\n1,2\n")
+	with open(files[1], 'w') as f:
+		f.write("a,c\n3,4\n")
+	with pytest.raises(ValueError):
+		file_utils.combine_csv_list(files, str(tmp_path / "combined.parquet"), processes=1)
+	assert sorted(os.listdir(str(tmp_path))) == ["part0.csv", "part1.csv"]
+#end test_combine_csv_list_parquet_failure
+
+#shards whose columns were inferred as different types: int and float combine as float, int and text as text,
+#and a float after the first block of a file that looked like ints turns that file's columns into text
+def test_combine_csv_list_parquet_mixed_types(tmp_path):
+	import pyarrow.parquet as pq
+
+	files = [str(tmp_path / ("part%d.csv" % i)) for i in range(3)]
+	for filename, text in zip(files, ["a,b,c\n1,2,x\n", "b,a,c\n1.5,3,y\n", "a,b,c\n4,five,\n"]):
+		with open(filename, 'w') as f:
+			f.write(text)
+	combined = str(tmp_path / "combined.parquet")
+	file_utils.combine_csv_list(files, combined, processes=1)
+	table = pq.read_table(combined)
+	assert [str(field.type) for field in table.schema] == ["int64", "string", "string"]
+	assert table.to_pydict() == {"a": [1, 3, 4], "b": ["2", "1.5", "five"], "c": ["x", "y", None]}
+
+	with open(files[0], 'w') as f:
+		f.write("a,b\n" + "1,2\n" * 300000 + "1.5,3\n")
+	with open(files[1], 'w') as f:
+		f.write("a,b\n2,2.5\n")
+	file_utils.combine_csv_list(files[:2], combined, processes=1)
+	table = pq.read_table(combined)
+	assert [str(field.type) for field in table.schema] == ["string", "string"]
+	assert table.num_rows == 300002 and table['a'][-2].as_py() == "1.5" and table['b'][-1].as_py() == "2.5"
+#end test_combine_csv_list_parquet_mixed_types
+
+#parquet cache of objects whose field types change after the first batch
+def test_cached_json_type_drift(tmp_path):
+	import json
+
+	objects = [{"n": 1, "s": None, "m": "text", "q": 1}, {"n": 2, "q": "a"}, {"n": 2.5, "s": {"a": 1}, "l": ["x"], "m": {"k": 1}}]
+	filename = str(tmp_path / "data.json.gz")
+	with gzip.open(filename, 'wt', encoding='utf-8') as f:
+		for obj in objects:
+			f.write(json.dumps(obj) + "\n")
+	fields = [["n"], ["s"], ["l"], ["m"], ["q"], ["none"]]
+	table = file_utils.load_cached_zipped_multi_json(filename, fields, str(tmp_path / "cache"), batch_size=2)
+	assert [str(field.type) for field in table.schema] == ["double", "struct<a: int64>", "list<element: string>", "string", "string", "string"]
+	assert table.to_pydict() == {"n": [1.0, 2.0, 2.5], "s": [None, None, {"a": 1}], "l": [None, None, ["x"]], "m": ["text", None, '{"k": 1}'], "q": ["1", "a", None], "none": [None, None, None]}
+	assert file_utils.load_cached_zipped_multi_json(filename, fields, str(tmp_path / "cache")).equals(table)
+	assert len(os.listdir(str(tmp_path / "cache"))) == 1
+#end test_cached_json_type_drift
@@ -0,0 +1,62 @@
+#tests for graph_utils retweet cascades
+
+import graph_utils
+
+#retweet chain: cascade a -> b, c; b -> d, e; d -> f (b also listed under a second parent x, which is
+#ignored), cascade h -> g, a cycle p <-> q with r hanging off it, and objects that are skipped
+CHAIN = [
+	("b", "a"), ("c", "a"), ("d", "b"), ("b", "x"), ("e", "b"), ("f", "d"),
+	("g", "h"),
+	("p", "q"), ("q", "p"), ("r", "q"),
+	("z", "z"), ("y", None),
+]
+
+#retweet graph of CHAIN
+def build_graph():
+	return graph_utils.build_retweet_graph([{"tweet_id_h": child, "retweeted_from_tweet_id_h": parent} for child, parent in CHAIN])
+#end build_graph
+
+#first parent listed wins, and each node's children come from the parent array
+def test_first_parent():
+	graph = build_graph()
+	nodes = graph['id_nodes']
+	assert "z" not in nodes and "y" not in nodes
+	assert graph['parent'][nodes["b"]] == nodes["a"]
+	assert graph['parent'][nodes["x"]] == -1
+	assert sorted(graph['ids'][node] for node in graph_utils.children_of(graph, nodes["b"])) == ["d", "e"]
+	assert len(graph_utils.children_of(graph, nodes["x"])) == 0
+#end test_first_parent
+
+#pointer jumping finds every node's root and depth, and marks nodes on or below a cycle as bad
+def test_node_roots():
+	graph = build_graph()
+	nodes = graph['id_nodes']
+	root, depth = graph_utils.node_roots(graph)
+	for tweet, (root_tweet, tweet_depth) in {"a": ("a", 0), "c": ("a", 1), "e": ("a", 2), "f": ("a", 3), "x": ("x", 0), "g": ("h", 1)}.items():
+		assert (root[nodes[tweet]], depth[nodes[tweet]]) == (nodes[root_tweet], tweet_depth)
+	for tweet in ["p", "q", "r"]:
+		assert (root[nodes[tweet]], depth[nodes[tweet]]) == (-1, -1)
+#end test_node_roots
+
+#cascade size/depth/breadth, and their aggregates per narrative of the root tweet
+def test_cascade_stats():
+	graph = build_graph()
+	nodes = graph['id_nodes']
+	stats = graph_utils.cascade_stats(graph)
+	cascades = {graph['ids'][root]: (size, depth, breadth) for root, size, depth, breadth in zip(stats['root'].tolist(), stats['size'].tolist(), stats['depth'].tolist(), stats['breadth'].tolist())}
+	assert cascades == {"a": (6, 3, 2), "x": (1, 0, 1), "h": (2, 1, 1)}
+
+	#narratives of root tweets only (c isn't a root), x has none
+	tweets = [{"id_h": "a", "extension": {"socialsim_information_id": ["u-v", "u"]}}, {"id_h": "h", "extension": {"socialsim_information_id": ["v"]}}, {"id_h": "c", "extension": {"socialsim_information_id": ["w"]}}]
+	root_label_dict = graph_utils.root_labels(graph, tweets)
+	assert root_label_dict == {nodes["a"]: ["u-v", "u"], nodes["h"]: ["v"]}
+
+	label_stats, comp_stats = graph_utils.narrative_cascade_stats(stats, root_label_dict)
+	assert sorted(label_stats) == ["", "u", "u-v", "v"]
+	assert (label_stats["u-v"]['cascades'], label_stats["u-v"]['tweets']) == (1, 6)
+	assert (label_stats[""]['cascades'], label_stats[""]['tweets']) == (1, 1)
+	#u is in both labels of a, but a is still one cascade for it
+	assert comp_stats["u"] == {"cascades": 1, "tweets": 6, "max_size": 6, "max_depth": 3, "max_breadth": 2, "mean_size": 6.0, "mean_depth": 3.0}
+	assert comp_stats["v"] == {"cascades": 2, "tweets": 8, "max_size": 6, "max_depth": 3, "max_breadth": 2, "mean_size": 4.0, "mean_depth": 2.0}
+	assert "w" not in comp_stats
+#end test_cascade_stats
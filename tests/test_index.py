@@ -0,0 +1,36 @@
+#tests for index_utils id lookups
+
+import gzip
+import json
+
+import pytest
+
+import index_utils
+
+#write records to a json file, gzipped if the name ends in .gz
+def write_records(filename, records):
+	opener = gzip.open if filename.endswith(".gz") else open
+	with opener(filename, 'wt') as f:
+		for record in records:
+			f.write(json.dumps(record) + "\n")
+#end write_records
+
+#records are found by id in both plain and gzipped files, missing ids are left out
+def test_get_many(tmp_path):
+	plain = [{"id_h": "p%d" % i, "n": i} for i in range(50)]
+	zipped = [{"id_h": "z%d" % i, "n": i} for i in range(50)]
+	write_records(str(tmp_path / "plain.json"), plain)
+	write_records(str(tmp_path / "zipped.json.gz"), zipped)
+
+	index = index_utils.get_id_index([str(tmp_path / "plain.json"), str(tmp_path / "zipped.json.gz")], str(tmp_path / "ids.npz"))
+	assert len(index['keys']) == 100
+	found = index_utils.get_many(index, ["p3", "z49", "z0", "missing"])
+	assert found == {"p3": plain[3], "z49": zipped[49], "z0": zipped[0]}
+	index_utils.close_id_index(index)
+#end test_get_many
+
+#tar member paths are rejected up front, not with a missing file error
+def test_tar_member_rejected(tmp_path):
+	with pytest.raises(ValueError, match="tar member"):
+		index_utils.build_id_index([str(tmp_path / "data.tar") + "::tweets.json.gz"], str(tmp_path / "ids.npz"))
+#end test_tar_member_rejected
@@ -0,0 +1,20 @@
+#tests for link_utils: joining tweets' YouTube links against the videos
+
+import link_utils
+
+def test_link_tweets_on_url_ids():
+	videos = [
+		{"id": "dQw4w9WgXcQ", "id_h": "hashed-1", "extension": {"socialsim_information_id": ["a"]}},
+		{"id": "9bZkp7q19f0", "id_h": "hashed-2", "extension": {"socialsim_information_id": ["b"]}},
+		{"id_h": "hashed-3", "extension": {"socialsim_information_id": ["a"]}},
+	]
+	tweets = [
+		{"id_h": "t1", "extension": {"socialsim_information_id": ["a"]}, "entities": {"urls": [{"expanded_url": "https://www.youtube.com/watch?v=dQw4w9WgXcQ&t=10"}]}},
+		{"id_h": "t2", "extension": {"socialsim_information_id": ["b"]}, "text": "see youtu.be/9bZkp7q19f0 and youtu.be/dQw4w9WgXcQ"},
+		{"id_h": "t3", "extension": {"socialsim_information_id": [""]}, "text": "youtube.com/watch?v=hashed-1"},
+	]
+	video_table = link_utils.build_video_table(videos)
+	assert video_table['missing_ids'] == 1
+	linked = {tweet_id: sorted(edge[0] for edge in edges) for tweet_id, tweet_set, edges in link_utils.link_tweets(tweets, video_table)}
+	assert linked == {"t1": ["dQw4w9WgXcQ"], "t2": ["9bZkp7q19f0", "dQw4w9WgXcQ"]}
+#end test_link_tweets_on_url_ids
@@ -0,0 +1,51 @@
+#tests for narrative_utils: label dictionary and sparse object x label/component matrices
+
+import numpy as np
+
+import narrative_utils
+
+#label lists of a few objects: repeats, a label repeating a component, and unlabeled objects
+LABEL_LISTS = [["a-b", "c"], ["b-b"], [""], ["c", "a-b"], []]
+
+def test_encode_freq():
+	label_dict = narrative_utils.new_label_dict()
+	encoded = narrative_utils.encode_label_lists(LABEL_LISTS, label_dict)
+	freq = narrative_utils.encoded_narrative_freq(encoded, label_dict)
+	assert freq['unlabeled_count'] == 2
+	assert freq['label_freq'] == {"a-b": 2, "c": 2, "b-b": 1}
+	assert freq['comp_freq'] == {"a": 2, "b": 4, "c": 2}
+	assert encoded['labels'].shape == (5, 3)
+#end test_encode_freq
+
+#already interned labels (ie, a record store) give the same matrices
+def test_encode_interned():
+	labels = ["", "c", "a-b", "b-b"]
+	ids = {label: i for i, label in enumerate(labels)}
+	label_ids = np.array([ids[label] for labels_of in LABEL_LISTS for label in labels_of], dtype=np.int32)
+	label_offsets = np.cumsum([0] + [len(labels_of) for labels_of in LABEL_LISTS])
+	label_dict = narrative_utils.new_label_dict()
+	encoded = narrative_utils.encode_interned(label_ids, label_offsets, labels, label_dict)
+
+	expected_dict = narrative_utils.new_label_dict()
+	expected = narrative_utils.encode_label_lists(LABEL_LISTS, expected_dict)
+	assert narrative_utils.encoded_narrative_freq(encoded, label_dict) == narrative_utils.encoded_narrative_freq(expected, expected_dict)
+#end test_encode_interned
+
+def test_compare_given_inferred():
+	label_dict = narrative_utils.new_label_dict()
+	encoded = narrative_utils.encode_narratives([{"id_h": "x", "extension": {"socialsim_information_id": ["a-b"]}}, {"id_h": "y", "extension": {"socialsim_information_id": ["c"]}}, {"id_h": "z"}], label_dict)
+	comparison = narrative_utils.compare_given_inferred(encoded, {"x": ["a", "d"], "y": ["c"], "z": ["a"]}, label_dict)
+	assert comparison['labelled_objects'] == 2
+	assert comparison['objects_missing_comps'] == 1
+	assert comparison['comp_counts']['a'] == {"given": 1, "inferred": 2, "both": 1, "missing": 0}
+	assert comparison['comp_counts']['b'] == {"given": 1, "inferred": 0, "both": 0, "missing": 1}
+	cooccurrence = comparison['cooccurrence']
+	comp_ids = label_dict['comp_ids']
+	assert cooccurrence[comp_ids['b'], comp_ids['d']] == 1
+	assert cooccurrence[comp_ids['c'], comp_ids['a']] == 0
+#end test_compare_given_inferred
+
+def test_label_components():
+	label_dict = narrative_utils.new_label_dict()
+	assert narrative_utils.label_components(label_dict, "b-a-b") == ["b", "a"]
+#end test_label_components
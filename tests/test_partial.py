@@ -0,0 +1,79 @@
+#tests for partial_utils: merging partial results of sharded runs
+
+import os
+
+import pytest
+
+import partial_utils
+
+#platform results with a single datatype and label, as returned by platform_narrative_analysis
+def make_platform_res(count):
+	return {"Twitter": ({"tweets": {"unlabeled_count": 0, "label_freq": {"a": count}, "comp_freq": {"a": count}}}, set(["a"]), set(["a"]))}
+#end make_platform_res
+
+#write a data file, return its name
+def make_file(tmp_path, name="tweets.json.gz"):
+	filename = str(tmp_path / name)
+	with open(filename, 'wb') as f:
+		f.write(b'x' * 100)
+	return filename
+#end make_file
+
+def test_merge_ranges(tmp_path):
+	filename = make_file(tmp_path)
+	a = partial_utils.make_partial(make_platform_res(2), [("Twitter", "tweets", filename, 0, 50)], {filename: 120})
+	b = partial_utils.make_partial(make_platform_res(3), [("Twitter", "tweets", filename, 50, 120)], {filename: 120})
+	merged = partial_utils.merge_partials(a, b)
+	assert merged['platforms']['Twitter']['datatypes']['tweets']['label_freq'] == {"a": 5}
+	assert len(merged['sources']) == 2
+#end test_merge_ranges
+
+def test_reject_overlapping_sources(tmp_path):
+	filename = make_file(tmp_path)
+	whole = partial_utils.make_partial(make_platform_res(5), [("Twitter", "tweets", filename, None, None)])
+	first = partial_utils.make_partial(make_platform_res(2), [("Twitter", "tweets", filename, 0, 50)], {filename: 120})
+	other_chunks = partial_utils.make_partial(make_platform_res(2), [("Twitter", "tweets", filename, 40, 80)], {filename: 120})
+	with pytest.raises(ValueError):
+		partial_utils.merge_partials(whole, first)
+	with pytest.raises(ValueError):
+		partial_utils.merge_partials(first, whole)
+	with pytest.raises(ValueError):
+		partial_utils.merge_partials(first, other_chunks)
+	with pytest.raises(ValueError):
+		partial_utils.merge_partials(whole, whole)
+#end test_reject_overlapping_sources
+
+def test_reject_changed_file(tmp_path):
+	filename = make_file(tmp_path)
+	a = partial_utils.make_partial(make_platform_res(2), [("Twitter", "tweets", filename, 0, 50)], {filename: 120})
+	with open(filename, 'ab') as f:
+		f.write(b'x')
+	os.utime(filename, (0, 0))
+	b = partial_utils.make_partial(make_platform_res(3), [("Twitter", "tweets", filename, 50, 120)], {filename: 120})
+	with pytest.raises(ValueError):
+		partial_utils.merge_partials(a, b)
+#end test_reject_changed_file
+
+#final merges must cover every data file, whole or as ranges from the start to the end of the file
+def test_check_coverage(tmp_path):
+	filename = make_file(tmp_path)
+	other = make_file(tmp_path, "videos.json.gz")
+	first = partial_utils.make_partial(make_platform_res(2), [("Twitter", "tweets", filename, 0, 50)], {filename: 120})
+	last = partial_utils.make_partial(make_platform_res(3), [("Twitter", "tweets", filename, 80, 120)], {filename: 120})
+	middle = partial_utils.make_partial(make_platform_res(1), [("Twitter", "tweets", filename, 50, 80)], {filename: 120})
+	whole = partial_utils.make_partial(make_platform_res(5), [("YouTube", "videos", other, None, None)])
+
+	partial_utils.check_coverage(partial_utils.merge_all_partials([last, whole, first, middle]), [filename, other])
+	with pytest.raises(ValueError, match="missing bytes 50-80"):
+		partial_utils.check_coverage(partial_utils.merge_all_partials([first, last, whole]), [filename, other])
+	with pytest.raises(ValueError, match="missing bytes 80-120"):
+		partial_utils.check_coverage(partial_utils.merge_all_partials([first, middle, whole]), [filename, other])
+	with pytest.raises(ValueError, match="include"):
+		partial_utils.check_coverage(partial_utils.merge_all_partials([first, middle, last]), [filename, other])
+
+	#data file changed since the shards ran
+	with open(other, 'ab') as f:
+		f.write(b'x')
+	with pytest.raises(ValueError, match="changed"):
+		partial_utils.check_coverage(partial_utils.merge_all_partials([first, middle, last, whole]), [filename, other])
+#end test_check_coverage
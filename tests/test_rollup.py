@@ -0,0 +1,25 @@
+#tests for rollup_utils: objects without a timestamp are counted, not dropped
+
+import rollup_utils
+
+def test_unknown_bucket(tmp_path):
+	data = [
+		{"created_at": "Wed Oct 10 20:19:24 +0000 2018", "extension": {"socialsim_information_id": ["a-b"]}},
+		{"created_at": "not a date", "extension": {"socialsim_information_id": ["a"]}},
+		{"extension": {"socialsim_information_id": [""]}},
+	]
+	counts, records, no_timestamp = rollup_utils.count_hours(data, ["created_at"])
+	assert (records, no_timestamp) == (3, 2)
+	assert counts[(rollup_utils.UNKNOWN_HOUR, "records", "")] == 2
+	assert counts[(rollup_utils.UNKNOWN_HOUR, "label", "a")] == 1
+	assert counts[(rollup_utils.UNKNOWN_HOUR, "unlabeled", "")] == 1
+
+	#bucket totals, unknown included, add up to every object
+	conn = rollup_utils.open_rollup_store(str(tmp_path / "rollup.sqlite"))
+	conn.execute("INSERT INTO sources (source_id, file, platform, datatype) VALUES (1, 'f', 'Twitter', 'tweets')")
+	conn.executemany("INSERT INTO counts VALUES (1, ?, ?, ?, ?)", ((hour, kind, name, count) for (hour, kind, name), count in counts.items()))
+	rows = rollup_utils.rollup(conn, "week")
+	assert sum(row[5] for row in rows if row[3] == "records") == 3
+	assert [row[2] for row in rows if row[3] == "records"] == [rollup_utils.UNKNOWN_HOUR, 1538956800]
+	conn.close()
+#end test_unknown_bucket
@@ -0,0 +1,61 @@
+#tests for sketch_utils account sketches
+
+import random
+
+import numpy as np
+
+import sketch_utils
+
+#(account, labels) objects: 5 heavy accounts with 40-44 objects each, and 300 light accounts with one
+#each, shuffled - the heavy accounts all post label "a-b", the light ones "a-b" or "c"
+def make_objects():
+	objects = [("heavy%d" % i, ["a-b"]) for i in range(5) for j in range(40 + i)]
+	objects += [("light%d" % i, ["a-b"] if i % 2 else ["c"]) for i in range(300)]
+	random.Random(1).shuffle(objects)
+	return objects
+#end make_objects
+
+#sketch of the given objects
+def build_sketch(objects, **params):
+	sketch = sketch_utils.new_sketch(["user"], **params)
+	for account, labels in objects:
+		sketch_utils.add_object(sketch, account, labels)
+	return sketch
+#end build_sketch
+
+#distinct account estimates stay within the configured error of the exact count (3 standard errors,
+#the hash is fixed so this is repeatable), and repeated accounts aren't counted again
+def test_distinct_accuracy():
+	for exact in [100, 5000, 50000]:
+		objects = [("user%d" % i, ["a"]) for i in range(exact)] * 2
+		res = sketch_utils.sketch_results(build_sketch(objects, distinct_error=0.02))
+		assert res['label_stats']["a"]['objects'] == 2 * exact
+		assert abs(res['label_stats']["a"]['distinct_accounts'] - exact) <= 3 * 0.02 * exact
+#end test_distinct_accuracy
+
+#top accounts come out highest estimate first, with estimates at most top_error * objects too high
+def test_top_accounts(monkeypatch):
+	monkeypatch.setattr(sketch_utils, "BATCH_SIZE", 50)		#several batches, so candidates are re-estimated
+	res = sketch_utils.sketch_results(build_sketch(make_objects(), top_k=3))
+	stats = res['label_stats']["a-b"]
+	assert stats['objects'] == 210 + 150
+	assert [account for account, count in stats['top_accounts']] == ["heavy4", "heavy3", "heavy2"]
+	for (account, count), true_count in zip(stats['top_accounts'], [44, 43, 42]):
+		assert true_count <= count <= true_count + 0.001 * stats['objects']
+	assert res['comp_stats']["a"] == stats
+	assert [account for account, count in res['label_stats']["c"]['top_accounts']][0].startswith("light")
+#end test_top_accounts
+
+#merging sketches of two halves of the data gives the same results as one sketch of all of it
+def test_merge_sketches():
+	objects = make_objects()
+	single = build_sketch(objects)
+	merged = sketch_utils.merge_sketches(build_sketch(objects[:200]), build_sketch(objects[200:]))
+	assert sketch_utils.sketch_results(merged) == sketch_utils.sketch_results(single)
+
+	#and the same registers/counters, whatever order the groups were added in
+	for kind_name, row in single['groups'].items():
+		merged_row = merged['groups'][kind_name]
+		assert np.array_equal(merged['registers'][merged_row], single['registers'][row])
+		assert np.array_equal(merged['counters'][merged_row], single['counters'][row])
+#end test_merge_sketches
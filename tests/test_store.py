@@ -0,0 +1,58 @@
+#tests for store_utils record stores
+
+import keyword_utils
+import store_utils
+
+FIELDS = [["snippet", "title"], ["snippet", "tags"], ["stats"]]
+
+#objects with every kind of stored value: strings, string lists, other json, missing fields and ids
+def make_records(count):
+	records = []
+	for i in range(count):
+		record = {"id_h": "r%d" % i, "extension": {"socialsim_information_id": ["a-b", "c"] if i % 3 else [""]}, "snippet": {"title": "Title %d é" % i}}
+		if i % 2:
+			record['snippet']['tags'] = ["tag%d" % i, "Tag"]
+		if i % 5 == 0:
+			record['stats'] = {"views": i, "ok": True}
+		if i % 7 == 0:
+			del record['id_h']
+		records.append(record)
+	return records
+#end make_records
+
+#records as iter_records gives them back: only the stored fields, and always a label list
+def stored_fields(record):
+	res = {"extension": {"socialsim_information_id": record['extension']['socialsim_information_id']}, "snippet": dict(record['snippet'])}
+	if 'id_h' in record:
+		res['id_h'] = record['id_h']
+	if 'stats' in record:
+		res['stats'] = record['stats']
+	return res
+#end stored_fields
+
+#saved and reloaded (memory mapped) stores give back the original records, across decode batches
+def test_store_round_trip(tmp_path, monkeypatch):
+	monkeypatch.setattr(store_utils, "STORE_BATCH", 4)
+	records = make_records(25)
+	store_utils.save_record_store(store_utils.build_record_store(records, FIELDS), str(tmp_path / "test.store"))
+	store = store_utils.load_record_store(str(tmp_path / "test.store"))
+
+	assert store['num_records'] == 25
+	assert list(store_utils.iter_records(store)) == [stored_fields(record) for record in records]
+	assert list(store_utils.iter_batched(store, store_utils.store_ids)) == [record.get('id_h', "") for record in records]
+	assert list(store_utils.iter_batched(store, store_utils.column_values, ["snippet", "tags"])) == [record['snippet'].get('tags') for record in records]
+	assert list(store_utils.store_search_texts(store, FIELDS[:2])) == [keyword_utils.search_texts(record, FIELDS[:2]) for record in records]
+#end test_store_round_trip
+
+#take_records picks records out of a store in the order given
+def test_take_records(tmp_path):
+	records = make_records(20)
+	store_utils.save_record_store(store_utils.build_record_store(records, FIELDS), str(tmp_path / "test.store"))
+	store = store_utils.load_record_store(str(tmp_path / "test.store"))
+
+	record_nums = [19, 0, 7, 7, 3]
+	taken = store_utils.take_records(store, record_nums)
+	assert taken['num_records'] == 5
+	assert list(store_utils.iter_records(taken)) == [stored_fields(records[i]) for i in record_nums]
+	assert store_utils.store_labels(taken) == [records[i]['extension']['socialsim_information_id'] for i in record_nums]
+#end test_take_records
@@ -0,0 +1,61 @@
+#tests for text_index_utils builds that spill postings to sorted runs on disk
+
+import gzip
+import json
+import os
+
+import text_index_utils
+
+#build an index with the given run size, returns the bytes of every file in it
+def build_files(tmp_path, filename, name, run_pairs):
+	index_dir = str(tmp_path / name)
+	text_index_utils.build_text_index(filename, [["text"]], index_dir, run_pairs=run_pairs)
+	files = {}
+	for entry in sorted(os.listdir(index_dir)):
+		with open(os.path.join(index_dir, entry), 'rb') as f:
+			files[entry] = f.read()
+	return index_dir, files
+#end build_files
+
+#tiny runs merge into the same index as one in-memory run, and no run files are left behind
+def test_spilled_runs_match(tmp_path):
+	filename = str(tmp_path / "tweets.json.gz")
+	words = ["vaccine", "syria", "helmets", "aleppo", "news", "fake", "white", "rescue"]
+	with gzip.open(filename, 'wt', encoding='utf-8') as f:
+		for i in range(200):
+			f.write(json.dumps({"id_h": "t%d" % i, "text": " ".join(words[(i*j) % len(words)] for j in range(1, 6)), "extension": {"socialsim_information_id": ["n%d" % (i % 3)]}}) + "\n")
+	_, whole = build_files(tmp_path, filename, "whole", 10**9)
+	index_dir, spilled = build_files(tmp_path, filename, "spilled", 7)
+	assert spilled == whole
+	assert not any(entry.startswith("run") or entry.endswith(".bin.tmp") for entry in spilled)
+	index = text_index_utils.load_text_index(index_dir)
+	assert len(text_index_utils.search_index(index, "aleppo")) == sum(1 for i in range(200) if any((i*j) % len(words) == 3 for j in range(1, 6)))
+#end test_spilled_runs_match
+
+#skewed text (a few tokens in every record, first seen so given the lowest ids): every merge slice of more
+#than one token stays within run_pairs pairs, and the output is still the same
+def test_skewed_merge_slices(tmp_path, monkeypatch):
+	filename = str(tmp_path / "tweets.json.gz")
+	with gzip.open(filename, 'wt', encoding='utf-8') as f:
+		for i in range(500):
+			f.write(json.dumps({"id_h": "t%d" % i, "text": "rt the news of w%d x%d" % (i % 97, i % 13), "extension": {"socialsim_information_id": [""]}}) + "\n")
+	_, whole = build_files(tmp_path, filename, "whole", 10**9)
+
+	merges = []
+	merge_slices = text_index_utils.merge_slices
+	def recording_merge_slices(token_counts, max_pairs):
+		slices = merge_slices(token_counts, max_pairs)
+		merges.append((token_counts, slices))
+		return slices
+	monkeypatch.setattr(text_index_utils, "merge_slices", recording_merge_slices)
+	run_pairs = 100
+	_, spilled = build_files(tmp_path, filename, "spilled", run_pairs)
+	assert spilled == whole
+
+	token_counts, slices = merges[0]
+	assert token_counts.sum() == 500 * 6
+	assert [low for low, high in slices[1:]] == [high for low, high in slices[:-1]] and slices[-1][1] == len(token_counts)
+	for low, high in slices:
+		assert high - low == 1 or token_counts[low:high].sum() <= run_pairs
+	assert sum(1 for low, high in slices if token_counts[low:high].sum() > run_pairs) == 4		#rt, the, news, of
+#end test_skewed_merge_slices
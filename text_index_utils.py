@@ -0,0 +1,375 @@
+#utility methods for a persistent inverted index over the text fields of a dataset, for fast keyword searches
+#built once per data file: every searched text (see keyword_utils.search_texts) is split into word tokens,
+#and each token gets a posting list of the records containing it (sorted record numbers, delta + varint
+#encoded) - the searched texts themselves are also stored, so they can be read back without the raw data
+#a keyword search looks up the tokens of each keyword to get candidate records, and then runs the normal
+#keyword matcher over just those records' stored texts - so results are exactly the same as scanning
+#everything (keywords are matched anywhere in the text, not only as whole tokens), just much faster
+#
+#index directory contents:
+#  meta.json         format version, fields, source file size/mtime, number of records
+#  records.json      [id, given narrative labels, number of fields searched] for each record
+#  text.bin          stored texts (utf-8), text_offsets.npy: start of each record/field text in text.bin
+#  vocab.json        token -> [offset, length] of its posting list in postings.bin
+
+import array
+import itertools
+import json
+import mmap
+import os
+import re
+
+import numpy as np
+
+import file_utils
+import keyword_utils
+
+#format version of the index directory (rebuilt if different)
+TEXT_INDEX_VERSION = 1
+
+#(token, record) pairs held in memory while building an index, before a sorted run is spilled to disk
+#(16 bytes each, 64MB - sorting a run, or merging a slice of the runs, takes about 3 times that)
+RUN_PAIRS = 4*1024*1024
+
+#values encoded at a time by encode_varints (bounds its temporary arrays)
+VARINT_CHUNK = 1024*1024
+
+#word tokens: runs of word characters (any keyword text containing word characters must have each of its
+#runs inside one of these tokens of the text, which is what makes the candidate lookup exact)
+TOKEN_PATTERN = re.compile(r'\w+')
+
+#build a text index for a data file (.json.gz) in index_dir, searching the given text fields
+#memory doesn't grow with the data (apart from the vocabulary): records and texts are written out as they're
+#read, and the (token, record) pairs are sorted and spilled to a run file every run_pairs pairs (see RUN_PAIRS),
+#then the runs are merged into the posting lists a slice of tokens at a time, each slice holding at most
+#run_pairs pairs (see merge_slices)
+#returns the loaded index (see load_text_index)
+def build_text_index(filename, fields, index_dir, id_field="id_h", run_pairs=RUN_PAIRS):
+	file_utils.verify_dir(index_dir)
+	if file_utils.verify_file(os.path.join(index_dir, "meta.json")):
+		os.remove(os.path.join(index_dir, "meta.json"))		#old index is no longer valid once we start overwriting it
+	vocab = {}			#token -> token id
+	pair_tokens = array.array('q')		#(token id, record number) for every distinct token of every record
+	pair_records = array.array('q')
+	runs = []			#sorted (token ids, record numbers) of each spilled run
+	token_counts = np.zeros(0, dtype=np.int64)		#pairs of each token id, over all runs
+	num_records = 0
+	num_bytes = 0
+
+	data = file_utils.stream_zipped_multi_json(filename, [[id_field], ["extension", "socialsim_information_id"]] + fields)
+	with open(os.path.join(index_dir, "text.bin"), 'wb') as text_file, open(os.path.join(index_dir, "text_offsets.bin"), 'wb') as offsets_file, open(os.path.join(index_dir, "records.json"), 'w', encoding='utf-8') as records_file:
+		offsets_file.write(array.array('q', [0]).tobytes())
+		records_file.write("[")
+		for record_num, item in enumerate(data):
+			labels = item['extension']['socialsim_information_id']
+			texts = keyword_utils.search_texts(item, fields)
+			records_file.write(("," if record_num > 0 else "") + json.dumps([item[id_field], labels if labels[0] != '' else [], len(texts)]))
+			num_records += 1
+
+			tokens = set()
+			text_offsets = array.array('q')
+			for i in range(len(fields)):
+				text = texts[i].encode('utf-8') if i < len(texts) else b""
+				text_file.write(text)
+				num_bytes += len(text)
+				text_offsets.append(num_bytes)
+				if i < len(texts):
+					tokens.update(TOKEN_PATTERN.findall(texts[i]))
+			offsets_file.write(text_offsets.tobytes())
+			for token in tokens:
+				pair_tokens.append(vocab.setdefault(token, len(vocab)))
+			pair_records.extend(itertools.repeat(record_num, len(tokens)))
+
+			if len(pair_records) >= run_pairs:
+				token_counts = add_token_counts(token_counts, pair_tokens, len(vocab))
+				runs.append(save_pair_run(pair_tokens, pair_records, os.path.join(index_dir, "run%d.npy" % len(runs))))
+				pair_tokens = array.array('q')
+				pair_records = array.array('q')
+		records_file.write("]")
+	token_counts = add_token_counts(token_counts, pair_tokens, len(vocab))
+	runs.append(sort_pair_run(pair_tokens, pair_records))		#last run stays in memory
+	del pair_tokens, pair_records
+
+	#posting lists: merge the runs (records are in order within each token, since runs are in record order)
+	tokens = [None] * len(vocab)
+	for token, token_id in vocab.items():
+		tokens[token_id] = token
+	vocab_positions = {}
+	postings_bytes = 0
+	with open(os.path.join(index_dir, "postings.bin"), 'wb') as f:
+		for low, high in merge_slices(token_counts, run_pairs):
+			#a single token with more pairs than a slice: write its posting list a run at a time instead
+			if high - low == 1 and token_counts[low] > run_pairs:
+				length = 0
+				prev_record = 0
+				for run_tokens, run_records in runs:
+					begin, end = np.searchsorted(run_tokens, [low, high])
+					if begin == end:
+						continue
+					run_slice = np.array(run_records[begin:end])
+					encoded = encode_varints(np.diff(run_slice, prepend=prev_record))[0]
+					f.write(encoded.tobytes())
+					length += len(encoded)
+					prev_record = int(run_slice[-1])
+				vocab_positions[tokens[low]] = [postings_bytes, length]
+				postings_bytes += length
+				continue
+
+			#pairs of this slice of token ids, from every run (in run order, so records stay in order)
+			#(arrays are dropped as soon as they're used, so at most about 4 copies of the slice are in memory)
+			bounds = [np.searchsorted(run_tokens, [low, high]) for run_tokens, run_records in runs]
+			slice_token_ids = np.concatenate([run_tokens[begin:end] for (run_tokens, run_records), (begin, end) in zip(runs, bounds)])
+			order = np.argsort(slice_token_ids, kind='stable')
+			slice_token_ids = slice_token_ids[order]
+			slice_records = np.concatenate([run_records[begin:end] for (run_tokens, run_records), (begin, end) in zip(runs, bounds)])[order]
+			del order
+
+			starts = np.flatnonzero(np.concatenate([[True], slice_token_ids[1:] != slice_token_ids[:-1]])) if len(slice_token_ids) else np.zeros(0, dtype=np.int64)
+			start_tokens = slice_token_ids[starts].tolist()
+			del slice_token_ids
+			deltas = np.diff(slice_records, prepend=0)
+			deltas[starts] = slice_records[starts]		#first record of each list is stored as is
+			del slice_records
+			encoded, value_offsets = encode_varints(deltas)
+			del deltas
+			f.write(encoded.tobytes())
+
+			byte_starts = value_offsets[starts] + postings_bytes
+			byte_ends = np.append(byte_starts[1:], postings_bytes + len(encoded))
+			for token_id, begin, end in zip(start_tokens, byte_starts.tolist(), byte_ends.tolist()):
+				vocab_positions[tokens[token_id]] = [int(begin), int(end - begin)]
+			postings_bytes += len(encoded)
+			del encoded, value_offsets
+	num_spilled = len(runs) - 1
+	del runs
+	for run_num in range(num_spilled):
+		os.remove(os.path.join(index_dir, "run%d.npy" % run_num))
+	with open(os.path.join(index_dir, "vocab.json"), 'w', encoding='utf-8') as f:
+		json.dump(vocab_positions, f)
+
+	#text offsets to .npy (copied through a memory map, not loaded)
+	offsets = np.memmap(os.path.join(index_dir, "text_offsets.bin"), dtype=np.int64, mode='r')
+	saved = np.lib.format.open_memmap(os.path.join(index_dir, "text_offsets.npy"), mode='w+', dtype=np.int64, shape=offsets.shape)
+	saved[:] = offsets
+	saved.flush()
+	del offsets, saved
+	os.remove(os.path.join(index_dir, "text_offsets.bin"))
+
+	#meta last, so a half-built index is never seen as current
+	stat = os.stat(file_utils.split_tar_member(filename)[0])
+	meta = {"version": TEXT_INDEX_VERSION, "file": os.path.abspath(filename), "size": stat.st_size, "mtime": stat.st_mtime, "fields": fields, "id_field": id_field, "records": num_records}
+	file_utils.save_json(meta, os.path.join(index_dir, "meta.json"))
+	return load_text_index(index_dir)
+#end build_text_index
+
+#add the pair counts of each token id in a run (array of token ids) to the counts so far - the counts
+#grow to num_tokens (the vocabulary keeps growing as runs are added)
+def add_token_counts(token_counts, run_tokens, num_tokens):
+	counts = np.bincount(np.frombuffer(run_tokens, dtype=np.int64), minlength=num_tokens)
+	counts[:len(token_counts)] += token_counts
+	return counts
+#end add_token_counts
+
+#split token ids into slices to merge (list of [low, high) token id ranges) with at most max_pairs pairs each,
+#given the pair count of each token id - cut by cumulative count, since pairs are far from evenly spread
+#(the most common tokens, first seen and given the lowest ids, are in nearly every record)
+#a single token with more than max_pairs pairs gets a slice of its own
+def merge_slices(token_counts, max_pairs):
+	cumulative = np.cumsum(token_counts)
+	slices = []
+	low = 0
+	while low < len(token_counts):
+		base = cumulative[low-1] if low > 0 else 0
+		high = max(low + 1, int(np.searchsorted(cumulative, base + max_pairs, side='right')))
+		slices.append((low, high))
+		low = high
+	return slices
+#end merge_slices
+
+#sort (token id, record number) pairs by token id (stable, so records stay in order within each token)
+#returns (token ids, record numbers) arrays
+def sort_pair_run(pair_tokens, pair_records):
+	pair_tokens = np.frombuffer(pair_tokens, dtype=np.int64)
+	pair_records = np.frombuffer(pair_records, dtype=np.int64)
+	order = np.argsort(pair_tokens, kind='stable')
+	return pair_tokens[order], pair_records[order]
+#end sort_pair_run
+
+#sort pairs (see sort_pair_run) and save them to a run file, returns the run memory mapped from the file
+def save_pair_run(pair_tokens, pair_records, filename):
+	run_tokens, run_records = sort_pair_run(pair_tokens, pair_records)
+	run = np.lib.format.open_memmap(filename, mode='w+', dtype=np.int64, shape=(2, len(run_tokens)))
+	run[0] = run_tokens
+	run[1] = run_records
+	run.flush()
+	del run, run_tokens, run_records
+	run = np.load(filename, mmap_mode='r')
+	return run[0], run[1]
+#end save_pair_run
+
+#load a text index built by build_text_index
+#texts and posting lists stay on disk (memory mapped), only the vocabulary and records are loaded
+def load_text_index(index_dir):
+	index = {"dir": index_dir, "meta": file_utils.load_json(os.path.join(index_dir, "meta.json"))}
+	with open(os.path.join(index_dir, "vocab.json"), 'r', encoding='utf-8') as f:
+		index['vocab'] = json.load(f)
+	with open(os.path.join(index_dir, "records.json"), 'r', encoding='utf-8') as f:
+		index['records'] = json.load(f)
+	index['text_offsets'] = np.load(os.path.join(index_dir, "text_offsets.npy"), mmap_mode='r')
+	index['text'] = map_file(os.path.join(index_dir, "text.bin"))
+	index['postings'] = map_file(os.path.join(index_dir, "postings.bin"))
+	return index
+#end load_text_index
+
+#read-only mmap of a whole file (or empty bytes, since empty files can't be mapped)
+def map_file(filename):
+	if os.path.getsize(filename) == 0:
+		return b""
+	with open(filename, 'rb') as f:
+		return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+#end map_file
+
+#load the text index for a data file if it exists and is current (same file, fields and format),
+#otherwise (re)build it
+def get_text_index(filename, fields, index_dir, id_field="id_h"):
+	meta_file = os.path.join(index_dir, "meta.json")
+	if file_utils.verify_file(meta_file):
+		meta = file_utils.load_json(meta_file)
+		stat = os.stat(file_utils.split_tar_member(filename)[0])
+		if meta.get('version') == TEXT_INDEX_VERSION and meta['file'] == os.path.abspath(filename) and meta['size'] == stat.st_size and meta['mtime'] == stat.st_mtime and meta['fields'] == fields and meta['id_field'] == id_field:
+			return load_text_index(index_dir)
+	if file_utils.DISPLAY:
+		print("Building text index for", filename)
+	return build_text_index(filename, fields, index_dir, id_field)
+#end get_text_index
+
+#encode array of non-negative ints as LEB128 varints (7 bits per byte, high bit set on all but the last byte)
+#returns (uint8 array of encoded bytes, byte offset of each value)
+#works through VARINT_CHUNK values at a time, so temporary arrays don't grow with the input
+def encode_varints(values):
+	values = np.asarray(values)
+	values = values.view(np.uint64) if values.dtype == np.int64 else values.astype(np.uint64)
+	num_bytes = np.ones(len(values), dtype=np.uint8)
+	for k in range(1, 10):
+		num_bytes += values >= (np.uint64(1) << np.uint64(7*k))
+	offsets = np.cumsum(num_bytes, dtype=np.int64) - num_bytes
+	encoded = np.zeros(int(offsets[-1]) + int(num_bytes[-1]) if len(values) else 0, dtype=np.uint8)
+	for low in range(0, len(values), VARINT_CHUNK):
+		chunk_values = values[low:low+VARINT_CHUNK]
+		chunk_bytes = num_bytes[low:low+VARINT_CHUNK]
+		chunk_offsets = offsets[low:low+VARINT_CHUNK]
+		for k in range(int(chunk_bytes.max())):
+			mask = chunk_bytes > k
+			byte = (chunk_values[mask] >> np.uint64(7*k)) & np.uint64(0x7f)
+			byte |= np.where(chunk_bytes[mask] > k + 1, np.uint64(0x80), np.uint64(0))
+			encoded[chunk_offsets[mask] + k] = byte.astype(np.uint8)
+	return encoded, offsets
+#end encode_varints
+
+#decode LEB128 varints (bytes) back to a uint64 array
+def decode_varints(data):
+	data = np.frombuffer(data, dtype=np.uint8)
+	if len(data) == 0:
+		return np.zeros(0, dtype=np.uint64)
+	is_last = data < 0x80
+	value_ids = np.cumsum(is_last) - is_last		#which value each byte belongs to
+	value_starts = np.flatnonzero(np.concatenate([[True], is_last[:-1]]))
+	shifts = ((np.arange(len(data)) - value_starts[value_ids]) * 7).astype(np.uint64)
+	parts = (data & 0x7f).astype(np.uint64) << shifts
+	values = np.zeros(int(is_last.sum()), dtype=np.uint64)
+	np.add.at(values, value_ids, parts)
+	return values
+#end decode_varints
+
+#posting list of a single token: sorted array of record numbers containing it
+def token_postings(index, token):
+	position = index['vocab'].get(token)
+	if position is None:
+		return np.zeros(0, dtype=np.int64)
+	offset, length = position
+	return np.cumsum(decode_varints(index['postings'][offset:offset+length])).astype(np.int64)
+#end token_postings
+
+#candidate records for a keyword (lowercase): records with, for each word-character run of the keyword,
+#a token that contains that run - every record containing the keyword is a candidate (but not all
+#candidates contain it, they still need to be checked against the text)
+#returns boolean array (one entry per record), or None if the keyword has no word characters (can't narrow down)
+#token_matches is from match_vocab_runs, if already done for many keywords
+def keyword_candidates(index, keyword, token_matches=None):
+	runs = TOKEN_PATTERN.findall(keyword)
+	if not runs:
+		return None
+	candidates = None
+	for run in set(runs):
+		tokens = token_matches[run] if token_matches is not None else [token for token in index['vocab'] if run in token]
+		records = np.zeros(len(index['records']), dtype=bool)
+		for token in tokens:
+			records[token_postings(index, token)] = True
+		candidates = records if candidates is None else candidates & records
+	return candidates
+#end keyword_candidates
+
+#for many keywords at once: dictionary of word-character run -> vocabulary tokens containing it
+#(one pass over the vocabulary with the keyword matcher, instead of one pass per run)
+def match_vocab_runs(index, keywords):
+	runs = sorted(set(run for keyword in keywords for run in TOKEN_PATTERN.findall(keyword)))
+	token_matches = {run: [] for run in runs}
+	if not runs:
+		return token_matches
+	matcher = keyword_utils.build_keyword_matcher({run: run for run in runs})
+	for token in index['vocab']:
+		for run in keyword_utils.match_labels(matcher, token):
+			token_matches[run].append(token)
+	return token_matches
+#end match_vocab_runs
+
+#stored search texts of the given records (array of record numbers): yields (record number, list of texts)
+#for each, texts are the same as keyword_utils.search_texts returned when the index was built
+#offsets for the whole batch are looked up at once, instead of one memory-mapped read per text
+def record_texts(index, record_nums):
+	num_fields = len(index['meta']['fields'])
+	record_nums = np.asarray(record_nums, dtype=np.int64)
+	first = record_nums * num_fields
+	offsets = index['text_offsets'][np.concatenate([first + i for i in range(num_fields + 1)])].reshape(num_fields + 1, -1).T.tolist()
+	text = index['text']
+	records = index['records']
+	for record_num, record_offsets in zip(record_nums.tolist(), offsets):
+		yield record_num, [text[record_offsets[i]:record_offsets[i+1]].decode('utf-8') for i in range(records[record_num][2])]
+#end record_texts
+
+#find records containing a keyword or phrase (matched the same as the keyword search, ie anywhere in the
+#lowercased text unless word_boundary is True) - returns list of record ids
+def search_index(index, keyword, word_boundary=False):
+	keyword = keyword.lower()
+	matcher = keyword_utils.build_keyword_matcher({keyword: keyword}, word_boundary)
+	candidates = keyword_candidates(index, keyword)
+	candidates = np.arange(len(index['records'])) if candidates is None else np.flatnonzero(candidates)
+	return [index['records'][record_num][0] for record_num, texts in record_texts(index, candidates) if keyword_utils.match_text_labels(matcher, texts)]
+#end search_index
+
+#same as load_data.search_narrative_keywords, but answered from the index: only records that could contain
+#one of the keywords are checked, all others get no inferred labels
+#returns dictionary of id -> {'inferred': [...], 'given': [...]}, identical to the scan
+def index_narrative_keywords(index, keywords_dict, word_boundary=False, matcher=None):
+	if matcher is None:
+		matcher = keyword_utils.build_keyword_matcher(keywords_dict, word_boundary)
+
+	#candidate records for all keywords
+	token_matches = match_vocab_runs(index, keywords_dict.keys())
+	candidates = np.zeros(len(index['records']), dtype=bool)
+	for keyword in keywords_dict:
+		records = keyword_candidates(index, keyword, token_matches)
+		if records is None:
+			candidates[:] = True		#keyword without word characters, check every record
+			break
+		candidates |= records
+
+	#check the candidates' texts
+	inferred = {record_num: keyword_utils.match_text_labels(matcher, texts) for record_num, texts in record_texts(index, np.flatnonzero(candidates))}
+
+	#results for every record, in record order (so repeated ids end up the same as the scan)
+	item_narratives = {}
+	for record_num, (record_id, given, num_texts) in enumerate(index['records']):
+		item_narratives[record_id] = {'inferred': inferred.get(record_num, []), 'given': given}
+	return item_narratives
+#end index_narrative_keywords